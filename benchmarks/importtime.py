@@ -0,0 +1,69 @@
+"""Import time of the package, measured with `python -X importtime`
+
+Usage:
+    python benchmarks/importtime.py [--runs 5] [--max-ms 150] [--output results.json]
+"""
+
+from argparse import ArgumentParser
+from json import dumps
+from pathlib import Path
+from statistics import median
+from subprocess import run  # nosec
+from sys import executable, exit as sys_exit
+
+ROOT: Path = Path(__file__).resolve().parents[1]
+
+STATEMENTS: dict[str, str] = {
+    "import minnesota": "import minnesota",
+    "from minnesota import S3Zip": "from minnesota import S3Zip",
+    "from minnesota import DynamoDb": "from minnesota import DynamoDb",
+    "from minnesota.api import get_app": "from minnesota.api import get_app",
+}
+
+
+def import_time(statement: str) -> tuple[float, list[tuple[str, float]]]:
+    """Get the cumulative import time, in ms, and the slowest top level imports"""
+    result = run(  # nosec
+        [executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=ROOT,
+    )
+    top: list[tuple[str, float]] = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # The header
+        # Top level imports are not indented
+        if not name.startswith("  ") or name[1] != " ":
+            top.append((name.strip(), int(cumulative) / 1000))
+    return sum(ms for _, ms in top), sorted(top, key=lambda t: t[1], reverse=True)[:10]
+
+
+def main() -> int:
+    """Run the benchmark"""
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=None)
+    parser.add_argument("--output", type=Path, default=None)
+    args = parser.parse_args()
+    results: dict[str, dict[str, object]] = {}
+    failed: bool = False
+    for label, statement in STATEMENTS.items():
+        runs = [import_time(statement) for _ in range(args.runs)]
+        total: float = median(ms for ms, _ in runs)
+        results[label] = {"median_ms": round(total, 1), "slowest": runs[-1][1]}
+        print(f"{label:<36} {total:8.1f} ms")
+        if args.max_ms is not None and label == "import minnesota" and total > args.max_ms:
+            print(f"  over the {args.max_ms} ms budget")
+            failed = True
+    if args.output is not None:
+        args.output.write_text(dumps(results, indent=2), encoding="utf-8")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys_exit(main())
@@ -0,0 +1,347 @@
+"""HTTP load test of a minnesota app, with local AWS stand-ins
+
+Starts a moto server, then `python -m minnesota` in mock mode on a routes folder \
+(the sample routes by default), and drives it with concurrent requests.
+
+Usage:
+    python benchmarks/loadtest.py [--concurrency 32] [--duration 20] [--workers 1] \
+        [--request GET:/notes/] [-e LOG_SAMPLE_RATE=0.01] [--output results.json]
+"""
+
+from argparse import ArgumentParser, Namespace
+from asyncio import gather, run as asyncio_run
+from contextlib import contextmanager, suppress
+from dataclasses import dataclass, field
+from json import dumps
+from logging import ERROR, getLogger
+from os import environ
+from pathlib import Path
+from random import choices
+from socket import socket
+from subprocess import DEVNULL, Popen, TimeoutExpired  # nosec
+from sys import executable, exit as sys_exit
+from tempfile import TemporaryFile
+from time import monotonic, perf_counter, sleep
+from typing import Any, Iterator
+
+from boto3 import client
+from httpx import AsyncClient, Client, HTTPError, Limits, Timeout
+from moto.server import ThreadedMotoServer
+
+ROOT: Path = Path(__file__).resolve().parents[1]
+REGION: str = "eu-west-1"  # The region of --mock
+SUB: str = "loadtest-user"
+ORIGIN: str = "http://localhost:3000"
+HTTP_ERROR: int = 500
+
+
+@dataclass
+class Scenario:
+    """A request of the load"""
+
+    name: str
+    method: str
+    path: str
+    weight: float = 1
+    json: Any = None
+    expect: int = 200
+
+
+@dataclass
+class Stats:
+    """Outcome of the requests of a scenario"""
+
+    latencies: list[float] = field(default_factory=list)
+    statuses: dict[int, int] = field(default_factory=dict)
+    unexpected: int = 0
+    failures: int = 0
+
+
+def sample_scenarios(ids: list[str]) -> list[Scenario]:
+    """Get the requests to the sample routes"""
+    return [
+        Scenario("list", "GET", "/notes/", 4),
+        Scenario("get", "GET", f"/notes/item?id={ids[0]}", 4),
+        Scenario("add", "POST", "/notes/", 1, {"title": "Load", "body": "test"}),
+        Scenario("missing", "GET", "/notes/missing", 0.5, expect=404),
+        Scenario("error", "GET", "/notes/error", 0.1, expect=500),
+        Scenario("alive", "GET", "/alive", 0.5),
+        Scenario("preflight", "OPTIONS", "/notes/", 0.5),
+    ]
+
+
+def parse_request(value: str) -> Scenario:
+    """Parse a `METHOD:/path[:weight[:status]]` request"""
+    method, path, *rest = value.split(":")
+    return Scenario(
+        name=f"{method.upper()} {path}",
+        method=method.upper(),
+        path=path,
+        weight=float(rest[0]) if rest else 1,
+        expect=int(rest[1]) if len(rest) > 1 else 200,
+    )
+
+
+def free_port() -> int:
+    """Get a free local port"""
+    with socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return int(sock.getsockname()[1])
+
+
+@contextmanager
+def aws_stand_in() -> Iterator[str]:
+    """Start a moto server with the table and the bucket of the app"""
+    port: int = free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    getLogger("werkzeug").setLevel(ERROR)
+    server.start()
+    endpoint: str = f"http://127.0.0.1:{port}"
+    try:
+        client("dynamodb", region_name=REGION, endpoint_url=endpoint).create_table(
+            TableName=environ["DYNAMO_TABLE_NAME"],
+            KeySchema=[
+                {"AttributeName": "id", "KeyType": "HASH"},
+                {"AttributeName": "userId", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": "id", "AttributeType": "S"},
+                {"AttributeName": "userId", "AttributeType": "S"},
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        client("s3", region_name=REGION, endpoint_url=endpoint).create_bucket(
+            Bucket=environ["S3_BUCKET_NAME"],
+            CreateBucketConfiguration={"LocationConstraint": REGION},
+        )
+        yield endpoint
+    finally:
+        server.stop()
+
+
+@contextmanager
+def app_server(options: Namespace, aws_endpoint: str) -> Iterator[str]:
+    """Start the app in mock mode, and wait until it is ready"""
+    port: int = free_port()
+    command: list[str] = [
+        executable,
+        "-m",
+        "minnesota",
+        "--routes-folder",
+        options.routes_folder,
+        "--cwd",
+        str(options.cwd),
+        "--host",
+        "127.0.0.1",
+        "--port",
+        str(port),
+        "--mock",
+        "--sub",
+        SUB,
+        "--workers",
+        str(options.workers),
+    ]
+    if options.stripe_endpoint:
+        command += ["--stripe-endpoint", options.stripe_endpoint]
+    else:
+        command.append("--skip-stripe")
+    for env in options.env or []:
+        command += ["-e", env]
+    process_env: dict[str, str] = {
+        **environ,
+        "PYTHONPATH": str(ROOT),
+        "AWS_ENDPOINT_URL": aws_endpoint,
+    }
+    with TemporaryFile() as output:
+        process = Popen(  # nosec
+            command,
+            cwd=options.cwd,
+            env=process_env,
+            stdin=DEVNULL,
+            stdout=output,
+            stderr=output,
+        )
+        base_url: str = f"http://127.0.0.1:{port}"
+        try:
+            wait_ready(base_url, process, options.startup_timeout)
+            yield base_url
+        except TimeoutError:
+            output.seek(0)
+            print(output.read().decode(errors="replace")[-4000:])
+            raise
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except TimeoutExpired:  # pragma: no cover
+                process.kill()
+
+
+def wait_ready(base_url: str, process: Popen[bytes], timeout: float) -> None:
+    """Poll /ready until the routes are loaded"""
+    deadline: float = monotonic() + timeout
+    with Client(base_url=base_url) as http:
+        while monotonic() < deadline:
+            if process.poll() is not None:
+                raise TimeoutError(f"The server exited with {process.returncode}")
+            with suppress(HTTPError):
+                if http.get("/ready").status_code == 200:  # noqa: PLR2004
+                    return
+            sleep(0.1)
+    raise TimeoutError(f"The server was not ready in {timeout}s")
+
+
+def seed(base_url: str, count: int) -> list[str]:
+    """Add some notes, and get their ids"""
+    with Client(base_url=base_url) as http:
+        return [
+            http.post("/notes/", json={"title": f"Note {i}", "body": "x" * 200}).json()
+            for i in range(count)
+        ]
+
+
+async def drive(
+    base_url: str,
+    scenarios: list[Scenario],
+    options: Namespace,
+) -> tuple[dict[str, Stats], float]:
+    """Send requests from concurrent workers, until the duration or the count is reached"""
+    stats: dict[str, Stats] = {scenario.name: Stats() for scenario in scenarios}
+    weights: list[float] = [scenario.weight for scenario in scenarios]
+    remaining: list[int] = [options.requests or -1]
+    deadline: float = monotonic() + options.duration
+
+    async def _worker(http: AsyncClient) -> None:
+        while monotonic() < deadline and remaining[0] != 0:
+            remaining[0] -= 1
+            scenario: Scenario = choices(scenarios, weights)[0]  # nosec
+            outcome: Stats = stats[scenario.name]
+            started: float = perf_counter()
+            try:
+                response = await http.request(
+                    scenario.method,
+                    scenario.path,
+                    json=scenario.json,
+                    headers={
+                        "Origin": ORIGIN,
+                        "Access-Control-Request-Method": "GET",
+                    }
+                    if scenario.method == "OPTIONS"
+                    else {"Origin": ORIGIN},
+                )
+            except HTTPError:
+                outcome.failures += 1
+                continue
+            outcome.latencies.append(perf_counter() - started)
+            outcome.statuses[response.status_code] = (
+                outcome.statuses.get(response.status_code, 0) + 1
+            )
+            if response.status_code != scenario.expect:
+                outcome.unexpected += 1
+
+    async with AsyncClient(
+        base_url=base_url,
+        timeout=Timeout(options.timeout),
+        limits=Limits(max_connections=options.concurrency),
+    ) as http:
+        started: float = perf_counter()
+        await gather(*(_worker(http) for _ in range(options.concurrency)))
+        return stats, perf_counter() - started
+
+
+def percentile(values: list[float], rank: float) -> float:
+    """Get a percentile of sorted values, in milliseconds"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(rank / 100 * len(values)))] * 1000
+
+
+def report(stats: dict[str, Stats], elapsed: float) -> dict[str, dict[str, Any]]:
+    """Print and get the throughput, latency and error rate of every scenario"""
+    results: dict[str, dict[str, Any]] = {}
+    print(
+        f"{'route':<24} {'reqs':>7} {'req/s':>9} {'p50':>8} {'p90':>8} "
+        f"{'p99':>8} {'max':>8} {'errors':>7} {'5xx':>6}"
+    )
+    for name, outcome in stats.items():
+        latencies: list[float] = sorted(outcome.latencies)
+        count: int = len(latencies) + outcome.failures
+        if count == 0:
+            continue
+        server_errors: int = sum(
+            n for status, n in outcome.statuses.items() if status >= HTTP_ERROR
+        )
+        results[name] = {
+            "requests": count,
+            "rps": count / elapsed,
+            "p50_ms": percentile(latencies, 50),
+            "p90_ms": percentile(latencies, 90),
+            "p99_ms": percentile(latencies, 99),
+            "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+            "error_rate": (outcome.unexpected + outcome.failures) / count,
+            "server_error_rate": server_errors / count,
+            "failures": outcome.failures,
+            "statuses": {str(status): n for status, n in sorted(outcome.statuses.items())},
+        }
+        result = results[name]
+        print(
+            f"{name:<24} {count:>7} {result['rps']:>9.1f} {result['p50_ms']:>8.1f} "
+            f"{result['p90_ms']:>8.1f} {result['p99_ms']:>8.1f} {result['max_ms']:>8.1f} "
+            f"{result['error_rate']:>7.1%} {result['server_error_rate']:>6.1%}"
+        )
+    total: int = sum(result["requests"] for result in results.values())
+    print(f"{total} requests in {elapsed:.1f}s, {total / elapsed:.1f} req/s")
+    return results
+
+
+def main() -> int:
+    """Run the load test"""
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--routes-folder", default="sample_routes")
+    parser.add_argument("--cwd", type=Path, default=ROOT.joinpath("benchmarks"))
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20, help="Seconds")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after N requests")
+    parser.add_argument("--timeout", type=float, default=30, help="Request timeout")
+    parser.add_argument("--workers", type=int, default=1, help="Server workers")
+    parser.add_argument("--seed", type=int, default=20, help="Notes added before the load")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--stripe-endpoint", default=None, help="Like stripe-mock")
+    parser.add_argument(
+        "--request",
+        action="append",
+        type=parse_request,
+        dest="scenarios",
+        help="METHOD:/path[:weight[:status]], replaces the sample requests",
+    )
+    parser.add_argument("-e", "--env", action="append", help="Server environment")
+    parser.add_argument("--output", type=Path, default=None)
+    options = parser.parse_args()
+    environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    environ.setdefault("DYNAMO_TABLE_NAME", "loadtest")
+    environ.setdefault("S3_BUCKET_NAME", "loadtest")
+    with aws_stand_in() as aws_endpoint, app_server(options, aws_endpoint) as base_url:
+        scenarios: list[Scenario] = options.scenarios or sample_scenarios(
+            seed(base_url, max(1, options.seed))
+        )
+        stats, elapsed = asyncio_run(drive(base_url, scenarios, options))
+    results = report(stats, elapsed)
+    if options.output is not None:
+        options.output.write_text(
+            dumps(
+                {
+                    "concurrency": options.concurrency,
+                    "workers": options.workers,
+                    "seconds": elapsed,
+                    "routes": results,
+                },
+                indent=2,
+            ),
+            encoding="utf-8",
+        )
+    return 1 if any(result["failures"] for result in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys_exit(main())
@@ -0,0 +1,55 @@
+"""Sample routes, served by the load test"""
+
+from typing import Annotated
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+from minnesota import CognitoUser, DynamoDb, Log, prepare_get_user_item
+from minnesota.aws.dynamodb import UserItem
+
+
+class Note(BaseModel):
+    """Note"""
+
+    title: str
+    body: str
+
+
+notes: DynamoDb[Note] = DynamoDb(Note)
+
+NoteItem = Annotated[UserItem[Note], Depends(prepare_get_user_item(Note))]
+
+router = APIRouter(prefix="/notes", tags=["notes"])
+
+
+@router.get("/")
+def list_notes(user: CognitoUser, log: Log) -> list[Note]:
+    """List the notes of the user"""
+    log.debug("Listing the notes of %s", user["sub"])
+    return [item.data for item in notes.get_items_for_user(user["sub"])]
+
+
+@router.post("/")
+def add_note(user: CognitoUser, note: Note) -> str:
+    """Add a note"""
+    return notes.add_item(user["sub"], note)
+
+
+@router.get("/item")
+def get_note(user_item: NoteItem) -> Note:
+    """Get a note of the user"""
+    return user_item["item"].data
+
+
+@router.get("/missing")
+def missing(user: CognitoUser) -> None:
+    """Always not found, to load the exception handlers"""
+    raise HTTPException(status_code=404, detail=f"Nothing for {user['sub']}")
+
+
+@router.get("/error")
+def error() -> None:
+    """Always failing"""
+    raise RuntimeError("Load test error")
+
+
+__all__ = ("router",)
@@ -0,0 +1,609 @@
+"""Benchmarks of the data access hot paths, run offline against moto
+
+Usage:
+    python benchmarks/suite.py run [--only dynamodb,s3] [--sizes 1000,10000,100000] \
+        [--repeat 5] [--output results.json]
+    python benchmarks/suite.py compare base.json head.json [--threshold 0.1]
+
+Without `--output`, the results are written to `benchmarks/results/<commit>.json`.
+"""
+
+from argparse import ArgumentParser, Namespace
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from json import dumps, loads
+from os import chdir, environ, getcwd
+from pathlib import Path
+from platform import platform, python_version
+from statistics import mean, median
+from subprocess import run  # nosec
+from sys import exit as sys_exit, modules, path as sys_path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any, Callable, Iterator, TypedDict
+
+ROOT: Path = Path(__file__).resolve().parents[1]
+RESULTS: Path = ROOT.joinpath("benchmarks", "results")
+
+if str(ROOT) not in sys_path:
+    sys_path.insert(0, str(ROOT))
+
+# moto and the clients read these, set them before anything is imported
+environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+environ.setdefault("DYNAMO_TABLE_NAME", "bench")
+environ.setdefault("S3_BUCKET_NAME", "bench")
+
+# pylint: disable=wrong-import-position
+from fastapi import APIRouter, FastAPI  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from moto import mock_aws  # noqa: E402
+from pydantic import BaseModel  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+from minnesota.api.app import get_app  # noqa: E402
+from minnesota.api.responses import FastJSONResponse, RawJSONResponse  # noqa: E402
+from minnesota.aws.clients import client  # noqa: E402
+from minnesota.aws.cognito import get_user_from_request  # noqa: E402
+from minnesota.aws.dynamodb import DynamoDb, DynamoDbItem  # noqa: E402
+from minnesota.aws.s3 import S3Zip  # noqa: E402
+from minnesota.utils.loader import load_types  # noqa: E402
+from minnesota.utils.registry import load_cached_types  # noqa: E402
+
+BATCH_SIZE: int = 25
+
+# Sizes above this are repeated half the times
+LARGE_SIZE: int = 10_000
+
+# Rows of the decode micro-benchmark, whatever the sizes
+DECODE_SIZE: int = 100_000
+
+
+class Result(TypedDict):
+    """Timings of a case, in milliseconds"""
+
+    min_ms: float
+    median_ms: float
+    mean_ms: float
+    repeat: int
+    ops: int
+    ops_per_s: float
+
+
+class Item(BaseModel):
+    """Item stored by the benchmarks"""
+
+    name: str
+    price: float
+    tags: list[str]
+    description: str
+
+
+Case = Callable[[Namespace], dict[str, Result]]
+
+CASES: dict[str, Case] = {}
+
+
+def case(name: str) -> Callable[[Case], Case]:
+    """Register a group of cases"""
+
+    def _register(func: Case) -> Case:
+        CASES[name] = func
+        return func
+
+    return _register
+
+
+def summarize(timings: list[float], ops: int = 1) -> Result:
+    """Summarize the timings of the repetitions, in seconds"""
+    best: float = min(timings)
+    return {
+        "min_ms": round(best * 1000, 4),
+        "median_ms": round(median(timings) * 1000, 4),
+        "mean_ms": round(mean(timings) * 1000, 4),
+        "repeat": len(timings),
+        "ops": ops,
+        "ops_per_s": round(ops / best, 1) if best else 0.0,
+    }
+
+
+def measure(func: Callable[[], Any], repeat: int, ops: int = 1) -> Result:
+    """Time a function, after a warm up call"""
+    func()
+    timings: list[float] = []
+    for _ in range(repeat):
+        started: float = perf_counter()
+        func()
+        timings.append(perf_counter() - started)
+    return summarize(timings, ops)
+
+
+def sample_item(i: int) -> Item:
+    """Get an item"""
+    return Item(
+        name=f"item {i}",
+        price=i / 100,
+        tags=["bench", str(i % 10)],
+        description="x" * 200,
+    )
+
+
+def create_table(table_name: str) -> None:
+    """Create the table used by `DynamoDb`"""
+    client("dynamodb").create_table(
+        TableName=table_name,
+        KeySchema=[
+            {"AttributeName": "id", "KeyType": "HASH"},
+            {"AttributeName": "userId", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "id", "AttributeType": "S"},
+            {"AttributeName": "userId", "AttributeType": "S"},
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+
+
+def fill_table(table_name: str, sub: str, size: int) -> list[str]:
+    """Write the items of a user with batch writes, and get their ids"""
+    dynamodb = client("dynamodb")
+    data: str = sample_item(0).model_dump_json()
+    ids: list[str] = [f"{sub}-{i:06d}" for i in range(size)]
+    for start in range(0, size, BATCH_SIZE):
+        dynamodb.batch_write_item(
+            RequestItems={
+                table_name: [
+                    {
+                        "PutRequest": {
+                            "Item": {
+                                "id": {"S": item_id},
+                                "userId": {"S": sub},
+                                "data": {"S": data},
+                            }
+                        }
+                    }
+                    for item_id in ids[start : start + BATCH_SIZE]
+                ]
+            }
+        )
+    return ids
+
+
+@case("dynamodb")
+def bench_dynamodb(options: Namespace) -> dict[str, Result]:
+    """`DynamoDb.get_items_for_user` and `DynamoDb.get_item`"""
+    results: dict[str, Result] = {}
+    for size in options.sizes:
+        with mock_aws():
+            create_table("bench")
+            fill_table("bench", "bench-user", size)
+            # Items of another user, that the scan has to filter out
+            fill_table("bench", "other-user", size // 10)
+            db: DynamoDb[Item] = DynamoDb(Item, table_name="bench")
+            repeat: int = max(1, options.repeat if size <= LARGE_SIZE else options.repeat // 2)
+            # A scan returns at most 1 MB, and get_items_for_user reads a single page,
+            # so with many items only part of them is found: labelled as such
+            found = db.get_items_for_user("bench-user")
+            label: str = str(size) if len(found) == size else f"{size}:first_page"
+            results[f"get_items_for_user[{label}]"] = measure(
+                lambda db=db: db.get_items_for_user("bench-user"),  # type: ignore[misc]
+                repeat,
+                len(found),
+            )
+            # The last item found is the worst case of the linear search
+            results[f"get_item[{label}]"] = measure(
+                lambda db=db, item=found[-1]: db.get_item(item.id, "bench-user"),  # type: ignore[misc]
+                repeat,
+            )
+    return results
+
+
+def convert_legacy(db: "DynamoDb[Item]", row: dict[str, dict[str, str]]) -> DynamoDbItem[Item]:
+    """Decode a row as `DynamoDb.convert` did before resolving the types once"""
+    return DynamoDbItem[Item](
+        id=row["id"]["S"],
+        user_id=row["userId"]["S"],
+        data=db._type(**loads(row["data"]["S"])),  # pylint: disable=protected-access
+    )
+
+
+@case("convert")
+def bench_convert(options: Namespace) -> dict[str, Result]:
+    """`DynamoDb.convert`, against the former decoding"""
+    results: dict[str, Result] = {}
+    data: str = sample_item(0).model_dump_json()
+    with mock_aws():
+        db: DynamoDb[Item] = DynamoDb(Item, table_name="bench")
+        for size in sorted({*options.sizes, DECODE_SIZE}):
+            raw: list[dict[str, dict[str, str]]] = [
+                {"id": {"S": str(i)}, "userId": {"S": "bench-user"}, "data": {"S": data}}
+                for i in range(size)
+            ]
+            repeat: int = max(1, options.repeat if size <= LARGE_SIZE else options.repeat // 2)
+            results[f"convert_legacy[{size}]"] = measure(
+                lambda raw=raw: [convert_legacy(db, row) for row in raw],  # type: ignore[misc]
+                repeat,
+                size,
+            )
+            results[f"convert[{size}]"] = measure(
+                lambda raw=raw: [db.convert(row) for row in raw],  # type: ignore[misc]
+                repeat,
+                size,
+            )
+    return results
+
+
+def responses_app(db: "DynamoDb[Item]", raw: list[dict[str, dict[str, str]]]) -> FastAPI:
+    """Get an app serving the same scanned items with every response class"""
+    router = APIRouter()
+
+    @router.get("/model", response_class=JSONResponse)
+    def model() -> list[DynamoDbItem[Item]]:
+        return [db.convert(row) for row in raw]
+
+    @router.get("/fast", response_class=FastJSONResponse)
+    def fast() -> list[DynamoDbItem[Item]]:
+        return [db.convert(row) for row in raw]
+
+    @router.get("/raw", response_class=RawJSONResponse)
+    def raw_json() -> RawJSONResponse:
+        return RawJSONResponse(db.items_json(raw))
+
+    app: FastAPI = get_app()
+    app.include_router(router)
+    return app
+
+
+@case("responses")
+def bench_responses(options: Namespace) -> dict[str, Result]:
+    """List responses through the app: model, fast and raw JSON, and compression"""
+    results: dict[str, Result] = {}
+    data: str = sample_item(0).model_dump_json()
+    with mock_aws():
+        db: DynamoDb[Item] = DynamoDb(Item, table_name="bench")
+        for size in options.sizes:
+            raw: list[dict[str, dict[str, str]]] = [
+                {"id": {"S": str(i)}, "userId": {"S": "bench-user"}, "data": {"S": data}}
+                for i in range(size)
+            ]
+            environ["COMPRESSION"] = "false"
+            with TestClient(responses_app(db, raw)) as http:
+                for route in ("model", "fast", "raw"):
+                    results[f"{route}[{size}]"] = measure(
+                        lambda http=http, route=route: http.get(f"/{route}"),  # type: ignore[misc]
+                        options.repeat,
+                        size,
+                    )
+            del environ["COMPRESSION"]
+            with TestClient(responses_app(db, raw)) as http:
+                for encoding in ("gzip", "br"):
+                    size_bytes: int = http.get(
+                        "/raw", headers={"Accept-Encoding": encoding}
+                    ).num_bytes_downloaded
+                    result = measure(
+                        lambda http=http, encoding=encoding: http.get(  # type: ignore[misc]
+                            "/raw", headers={"Accept-Encoding": encoding}
+                        ),
+                        options.repeat,
+                        size,
+                    )
+                    print(f"  raw+{encoding}[{size}] sends {size_bytes} bytes")
+                    results[f"raw+{encoding}[{size}]"] = result
+    return results
+
+
+ARCHIVES: tuple[tuple[int, int], ...] = (
+    (1, 1024 * 1024),
+    (10, 100 * 1024),
+    (100, 10 * 1024),
+    (1000, 1024),
+)
+
+
+@case("s3")
+def bench_s3(options: Namespace) -> dict[str, Result]:
+    """`S3Zip` open, read, write and close, for archives of several shapes"""
+    results: dict[str, Result] = {}
+    with mock_aws():
+        client("s3").create_bucket(Bucket="bench")
+        for members, size in ARCHIVES:
+            label: str = f"{members}x{size // 1024}KiB"
+            key: str = f"bench/{label}.zip"
+            payload: bytes = b"x" * size
+            phases: dict[str, list[float]] = {
+                "create": [],
+                "open": [],
+                "read": [],
+                "write": [],
+                "close": [],
+            }
+            for _ in range(options.repeat):
+                started: float = perf_counter()
+                with S3Zip(key) as archive:
+                    for i in range(members):
+                        archive.write(f"file_{i}.txt", payload)
+                phases["create"].append(perf_counter() - started)
+
+                started = perf_counter()
+                archive = S3Zip(key).__enter__()  # pylint: disable=unnecessary-dunder-call
+                phases["open"].append(perf_counter() - started)
+                started = perf_counter()
+                for i in range(members):
+                    archive.read(f"file_{i}.txt").getvalue()
+                phases["read"].append(perf_counter() - started)
+                started = perf_counter()
+                archive.write("file_0.txt", payload[::-1])
+                phases["write"].append(perf_counter() - started)
+                started = perf_counter()
+                archive.__exit__(None, None, None)
+                phases["close"].append(perf_counter() - started)
+            for phase, timings in phases.items():
+                # A single archive opened, written to or uploaded, or a member each
+                ops: int = members if phase in {"create", "read"} else 1
+                results[f"{phase}[{label}]"] = summarize(timings, ops)
+    return results
+
+
+def cognito_token() -> str:
+    """Create a user in a moto user pool and get its access token"""
+    cognito = client("cognito")
+    pool_id: str = cognito.create_user_pool(PoolName="bench")["UserPool"]["Id"]
+    client_id: str = cognito.create_user_pool_client(
+        UserPoolId=pool_id,
+        ClientName="bench",
+        ExplicitAuthFlows=["ADMIN_NO_SRP_AUTH"],
+    )["UserPoolClient"]["ClientId"]
+    cognito.admin_create_user(
+        UserPoolId=pool_id,
+        Username="bench@localhost.dev",
+        UserAttributes=[
+            {"Name": "email", "Value": "bench@localhost.dev"},
+            {"Name": "given_name", "Value": "Bench"},
+            {"Name": "family_name", "Value": "User"},
+        ],
+        MessageAction="SUPPRESS",
+    )
+    cognito.admin_set_user_password(
+        UserPoolId=pool_id,
+        Username="bench@localhost.dev",
+        Password="Bench-Passw0rd!",
+        Permanent=True,
+    )
+    return str(
+        cognito.admin_initiate_auth(
+            UserPoolId=pool_id,
+            ClientId=client_id,
+            AuthFlow="ADMIN_NO_SRP_AUTH",
+            AuthParameters={
+                "USERNAME": "bench@localhost.dev",
+                "PASSWORD": "Bench-Passw0rd!",
+            },
+        )["AuthenticationResult"]["AccessToken"]
+    )
+
+
+@case("cognito")
+def bench_cognito(options: Namespace) -> dict[str, Result]:
+    """`get_user_from_request`, with a fixed user and with a Cognito token"""
+    calls: int = 100
+
+    def _request(token: str) -> Request:
+        return Request(
+            {
+                "type": "http",
+                "method": "GET",
+                "path": "/",
+                "headers": [(b"authorization", f"Bearer {token}".encode())],
+            }
+        )
+
+    results: dict[str, Result] = {}
+
+    # A request each, as the user is kept on the request once resolved
+    def _fixed() -> None:
+        for _ in range(calls):
+            get_user_from_request(_request("unused"))
+
+    environ["FIXED_USER"] = "bench-user"
+    try:
+        results["fixed_user"] = measure(_fixed, options.repeat, calls)
+    finally:
+        del environ["FIXED_USER"]
+
+    with mock_aws():
+        token: str = cognito_token()
+
+        def _token() -> None:
+            for _ in range(calls):
+                get_user_from_request(_request(token))
+
+        results["access_token"] = measure(_token, options.repeat, calls)
+    return results
+
+
+ROUTER_MODULE: str = '''
+from fastapi import APIRouter
+
+router = APIRouter(prefix="/{name}")
+
+
+@router.get("/")
+def index() -> dict[str, str]:
+    return {{"name": "{name}"}}
+'''
+
+
+@contextmanager
+def routes_package(count: int) -> Iterator[str]:
+    """Create a routes package with a router per module, and chdir into its parent"""
+    previous: str = getcwd()
+    with TemporaryDirectory() as tmp:
+        package: Path = Path(tmp).joinpath(f"bench_routes_{count}")
+        package.mkdir()
+        package.joinpath("__init__.py").write_text(
+            "".join(f"from . import mod_{i}\n" for i in range(count)), encoding="utf-8"
+        )
+        for i in range(count):
+            package.joinpath(f"mod_{i}.py").write_text(
+                ROUTER_MODULE.format(name=f"mod_{i}"), encoding="utf-8"
+            )
+        chdir(tmp)
+        sys_path.insert(0, tmp)
+        try:
+            yield package.name
+        finally:
+            sys_path.remove(tmp)
+            chdir(previous)
+
+
+def unload(package: str) -> None:
+    """Remove a package from the imported modules, so the next load imports it again"""
+    for name in [
+        name for name in modules if name == package or name.startswith(package + ".")
+    ]:
+        del modules[name]
+
+
+@case("load_types")
+def bench_load_types(options: Namespace) -> dict[str, Result]:
+    """`load_types` and `load_cached_types` startup, importing the routes every time"""
+    results: dict[str, Result] = {}
+    for count in (10, 100):
+        with routes_package(count) as package:
+
+            def _walk(package: str = package) -> None:
+                unload(package)
+                load_types(APIRouter, cwd=getcwd(), folder_name=package)
+
+            def _cached(package: str = package) -> None:
+                unload(package)
+                load_cached_types(
+                    APIRouter,
+                    cwd=getcwd(),
+                    folder_name=package,
+                    cache_file=Path(getcwd()).joinpath("cache.json"),
+                )
+
+            results[f"load_types[{count}]"] = measure(_walk, options.repeat, count)
+            results[f"load_cached_types[{count}]"] = measure(_cached, options.repeat, count)
+    return results
+
+
+def commit() -> str:
+    """Get the current commit, with a suffix if the tree is dirty"""
+    # pylint: disable=broad-except
+    try:
+        sha: str = run(  # nosec
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=ROOT,
+        ).stdout.strip()
+        dirty: str = run(  # nosec
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=ROOT,
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+    return sha + ("-dirty" if dirty else "")
+
+
+def run_cases(options: Namespace) -> int:
+    """Run the benchmarks and write the results"""
+    results: dict[str, dict[str, Result]] = {}
+    for name, func in CASES.items():
+        if options.only and name not in options.only:
+            continue
+        print(f"{name}: {func.__doc__}")
+        results[name] = func(options)
+        for label, result in results[name].items():
+            print(
+                f"  {label:<36} {result['min_ms']:>12.3f} ms"
+                f" {result['ops_per_s']:>14.1f} ops/s"
+            )
+    sha: str = commit()
+    output: Path = options.output or RESULTS.joinpath(f"{sha}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(
+        dumps(
+            {
+                "commit": sha,
+                "date": datetime.now(timezone.utc).isoformat(),
+                "python": python_version(),
+                "platform": platform(),
+                "results": results,
+            },
+            indent=2,
+        ),
+        encoding="utf-8",
+    )
+    print(f"Results written to {output}")
+    return 0
+
+
+def compare(options: Namespace) -> int:
+    """Compare two result files, failing if a case got slower than the threshold"""
+    base: dict[str, Any] = loads(options.base.read_text(encoding="utf-8"))
+    head: dict[str, Any] = loads(options.head.read_text(encoding="utf-8"))
+    print(f"{base['commit']} -> {head['commit']}")
+    regressions: int = 0
+    for group, cases in head["results"].items():
+        for label, result in cases.items():
+            before: Result | None = base["results"].get(group, {}).get(label)
+            if before is None or not before["min_ms"]:
+                continue
+            change: float = result["min_ms"] / before["min_ms"] - 1
+            flag: str = ""
+            if change > options.threshold:
+                flag = "  SLOWER"
+                regressions += 1
+            elif change < -options.threshold:
+                flag = "  faster"
+            print(
+                f"  {group + '/' + label:<48} {before['min_ms']:>12.3f}"
+                f" {result['min_ms']:>12.3f} ms {change:>+8.1%}{flag}"
+            )
+    return 1 if regressions else 0
+
+
+def main() -> int:
+    """Run the benchmarks, or compare two runs"""
+    parser = ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument(
+        "--only",
+        type=lambda value: value.split(","),
+        default=[],
+        help=f"Comma separated groups, out of {', '.join(CASES)}",
+    )
+    run_parser.add_argument(
+        "--sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=[1_000, 10_000],
+        help="Comma separated item counts, like 1000,10000,100000",
+    )
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument("--output", type=Path, default=None)
+    compare_parser = commands.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("base", type=Path)
+    compare_parser.add_argument("head", type=Path)
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative slowdown reported as a regression. Defaults to 0.1",
+    )
+    options = parser.parse_args()
+    if options.command == "compare":
+        return compare(options)
+    return run_cases(options)
+
+
+if __name__ == "__main__":
+    sys_exit(main())
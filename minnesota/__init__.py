@@ -1,19 +1,57 @@
 """Minnesota"""
 
-from fastapi.routing import APIRouter
-from .aws import (
-    DynamoDb,
-    DynamoDbItem,
-    T,
-    prepare_get_user_item,
-    CognitoUser,
-    get_user_from_request,
-    S3Zip,
-    client,
-)
-from .logs import logger, Log
-from .utils import run_command
-from .clients import get_stripe_client, check_stripe
+from importlib import import_module
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:  # pragma: no cover
+    from fastapi.routing import APIRouter
+    from .aws import (
+        DynamoDb,
+        DynamoDbItem,
+        T,
+        prepare_get_user_item,
+        CognitoUser,
+        get_user_from_request,
+        S3Zip,
+        client,
+    )
+    from .logs import logger, Log
+    from .utils import run_command
+    from .clients import get_stripe_client, check_stripe
+
+# Imported on first access, so that `import minnesota` does not pay for
+# fastapi, boto3 and stripe when only some of them are used
+_LAZY: dict[str, str] = {
+    "APIRouter": "fastapi.routing",
+    "DynamoDb": ".aws.dynamodb",
+    "DynamoDbItem": ".aws.dynamodb",
+    "T": ".aws.dynamodb",
+    "prepare_get_user_item": ".aws.dynamodb",
+    "CognitoUser": ".aws.cognito",
+    "get_user_from_request": ".aws.cognito",
+    "S3Zip": ".aws.s3",
+    "client": ".aws.clients",
+    "logger": ".logs.logger",
+    "Log": ".logs.logger",
+    "run_command": ".utils.shell",
+    "get_stripe_client": ".clients.stripe_client",
+    "check_stripe": ".clients.stripe_client",
+}
+
+
+def __getattr__(name: str) -> Any:
+    """Import an attribute on first access"""
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_LAZY[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    """List the attributes, imported or not"""
+    return sorted({*globals(), *__all__})
+
 
 __all__ = (
     "APIRouter",
@@ -1,9 +1,10 @@
 """Minnesota"""
 
-from fastapi.routing import APIRouter
+from os import environ
 from uvicorn import run as uvicorn_run
-from .api import get_app
-from .utils import get_args, load_types
+from .api import create_app
+from .aws import load_secrets
+from .utils import get_args, get_server_options
 from .logs import logger
 
 
@@ -11,19 +12,29 @@ def main() -> None:
     """Main."""
     try:
         routes, cwd, host, port, is_mock = get_args()
-        app = get_app()
-        for route in routes:
-            logger.info(f"Loading routes from {route}")
-            api_routes = load_types(
-                APIRouter, instance=True, folder_name=str(route), cwd=str(cwd)
-            )
-            logger.info(f"Found {len(api_routes)} routes")
-            for api_route in api_routes:
-                app.include_router(api_route)
+        options = get_server_options()
+        if environ.get("SECRET_NAME"):
+            # Once, before the workers start: they inherit the environment
+            load_secrets(refresh=False)
+        if options["workers"] > 1 and not environ.get("ROUTES_CACHE"):
+            # Shared by the workers: on a cold start each one walks the routes,
+            # and the later starts only import the modules with routes
+            environ["ROUTES_CACHE"] = str(cwd.joinpath(".minnesota"))
+        logger.info(f"Routes: {', '.join(str(route) for route in routes)}")
         logger.info(f"Host: {host}")
         logger.info(f"Port: {port}")
         logger.info(f"Is mock: {is_mock}")
-        uvicorn_run(app, host=host, port=port)
+        logger.info(f"Workers: {options['workers']}")
+        if options["workers"] > 1:
+            uvicorn_run(
+                "minnesota.api.app:create_app",
+                factory=True,
+                host=host,
+                port=port,
+                **options,
+            )
+        else:
+            uvicorn_run(create_app(), host=host, port=port, **options)
     except Exception as exc:  # pylint: disable=broad-except
         logger.exception(exc)
 
@@ -1,5 +1,15 @@
 """API"""
 
-from .app import get_app
+from .app import get_app, create_app
+from .cache import cache_response
+from .responses import FastJSONResponse, RawJSONResponse
+from .routes import mount_routes
 
-__all__ = ["get_app"]
+__all__ = [
+    "get_app",
+    "create_app",
+    "mount_routes",
+    "cache_response",
+    "FastJSONResponse",
+    "RawJSONResponse",
+]
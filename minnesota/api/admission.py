@@ -0,0 +1,219 @@
+"""Admission control"""
+
+from asyncio import CancelledError, Future, get_running_loop, wait_for
+from collections import deque
+from math import ceil
+from os import environ
+from time import monotonic
+from typing import TYPE_CHECKING
+from ..utils.metrics import Metrics, metrics as default_metrics
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import TypedDict
+    from starlette.types import ASGIApp, Receive, Scope, Send
+
+    class AdmissionOptions(TypedDict):
+        """Options of AdmissionMiddleware"""
+
+        limit: int
+        max_queue: int
+        max_wait: float
+        routes: dict[str, int]
+        retry_after: float
+
+SHED_STATUS: int = 503
+
+
+class Limiter:
+    """Concurrency limit with a bounded FIFO queue, for a single event loop.
+
+    A slot freed is handed to the oldest waiter, so the waiters are served \
+    in order and the newcomers cannot overtake them.
+    """
+
+    limit: int
+    max_queue: int
+    active: int
+    _waiters: "deque[Future[None]]"
+
+    def __init__(self, limit: int, max_queue: int) -> None:
+        """Initialize the limiter"""
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self._waiters = deque()
+
+    @property
+    def queued(self) -> int:
+        """Requests waiting for a slot"""
+        return len(self._waiters)
+
+    async def acquire(self, timeout: float) -> bool:
+        """Take a slot, waiting at most `timeout` seconds
+
+        Returns:
+            bool: False if the queue is full, or on timeout
+        """
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.max_queue or timeout <= 0:
+            return False
+        waiter: "Future[None]" = get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await wait_for(waiter, timeout)
+        except CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Handed a slot as the client went away: pass it on
+                self.release()
+            raise
+        except TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # Handed a slot as the wait timed out: keep it
+                return True
+            return False
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        return True
+
+    def release(self) -> None:
+        """Free a slot, handing it to the oldest waiter if any"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class AdmissionMiddleware:  # pylint: disable=too-few-public-methods
+    """Limit the requests served at once, by the whole app and by path prefix.
+
+    Past the limit, the requests wait in a bounded queue for up to `max_wait` \
+    seconds. When the queue is full, or the wait is over, the request is answered \
+    at once with a 503 and a `Retry-After` header, instead of piling up \
+    in the threadpool.
+
+    The limits are per worker process.
+    """
+
+    limiter: Limiter | None
+    routes: list[tuple[str, Limiter]]
+    max_wait: float
+    retry_after: int
+    exempt: tuple[str, ...]
+    metrics: Metrics
+
+    def __init__(  # noqa: PLR0913, PLR0917
+        # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        app: "ASGIApp",
+        limit: int = 0,
+        max_queue: int = 0,
+        max_wait: float = 1.0,
+        routes: dict[str, int] | None = None,
+        retry_after: float = 1.0,
+        exempt: tuple[str, ...] = ("/alive",),
+        metrics: Metrics | None = None,
+    ) -> None:
+        """Initialize the middleware
+
+        Args:
+            app (ASGIApp): The app.
+            limit (int, optional): Requests served at once, 0 for no limit. Defaults to 0.
+            max_queue (int, optional): Requests waiting for a slot, for each limit. \
+                Defaults to 0.
+            max_wait (float, optional): Seconds a request waits for a slot. Defaults to 1.0.
+            routes (dict[str, int] | None, optional): Requests served at once \
+                by path prefix, the longest prefix applying. Defaults to None.
+            retry_after (float, optional): Seconds the clients are told to wait. \
+                Defaults to 1.0.
+            exempt (tuple[str, ...], optional): Paths never limited. \
+                Defaults to ("/alive",).
+        """
+        self.app = app
+        self.limiter = Limiter(limit, max_queue) if limit > 0 else None
+        self.routes = sorted(
+            ((prefix, Limiter(count, max_queue)) for prefix, count in (routes or {}).items()),
+            key=lambda route: len(route[0]),
+            reverse=True,
+        )
+        self.max_wait = max_wait
+        self.retry_after = max(1, ceil(retry_after))
+        self.exempt = exempt
+        self.metrics = metrics or default_metrics
+
+    def _route(self, path: str) -> tuple[str, Limiter] | None:
+        """Get the limit of the longest prefix of a path"""
+        for prefix, limiter in self.routes:
+            if path.startswith(prefix):
+                return prefix, limiter
+        return None
+
+    async def _shed(self, send: "Send", reason: str) -> None:
+        """Refuse a request"""
+        self.metrics.inc("minnesota_http_requests_shed_total", (("limit", reason),))
+        await send(
+            {
+                "type": "http.response.start",
+                "status": SHED_STATUS,
+                "headers": [
+                    (b"content-type", b"text/plain; charset=utf-8"),
+                    (b"content-length", b"19"),
+                    (b"retry-after", str(self.retry_after).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": b"Service Unavailable"})
+
+    async def __call__(self, scope: "Scope", receive: "Receive", send: "Send") -> None:
+        """Handle a request"""
+        if scope["type"] != "http" or scope["path"] in self.exempt:
+            await self.app(scope, receive, send)
+            return
+        deadline: float = monotonic() + self.max_wait
+        route = self._route(scope["path"])
+        # The route first, so no app slot is held while waiting for it
+        if route is not None and not await route[1].acquire(self.max_wait):
+            await self._shed(send, route[0])
+            return
+        try:
+            if self.limiter is not None and not await self.limiter.acquire(
+                deadline - monotonic()
+            ):
+                await self._shed(send, "app")
+                return
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                if self.limiter is not None:
+                    self.limiter.release()
+        finally:
+            if route is not None:
+                route[1].release()
+
+
+def admission_options() -> "AdmissionOptions | None":
+    """Get the options of `AdmissionMiddleware` set by `MAX_CONCURRENCY`, \
+    `MAX_QUEUE`, `MAX_QUEUE_WAIT`, `ROUTE_LIMITS` (`/prefix=limit`, comma separated) \
+    and `RETRY_AFTER`, or None if nothing is limited"""
+    limit: int = int(environ.get("MAX_CONCURRENCY", "0"))
+    routes: dict[str, int] = {}
+    for route in environ.get("ROUTE_LIMITS", "").split(","):
+        if "=" in route:
+            prefix, count = route.rsplit("=", 1)
+            routes[prefix.strip()] = int(count)
+    if limit <= 0 and not routes:
+        return None
+    return {
+        "limit": limit,
+        "max_queue": int(environ.get("MAX_QUEUE", str(max(limit, 1)))),
+        "max_wait": float(environ.get("MAX_QUEUE_WAIT", "1.0")),
+        "routes": routes,
+        "retry_after": float(environ.get("RETRY_AFTER", "1")),
+    }
+
+
+__all__ = ("AdmissionMiddleware", "Limiter", "admission_options")
@@ -1,18 +1,51 @@
 """Get the app"""
 
-from os import environ
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from os import environ, getcwd, pathsep
+from pathlib import Path
 from fastapi import FastAPI, Response, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.exceptions import HTTPException as StarletteHTTPException
-from ..aws import load_secrets
-from ..logs import logger
+from ..aws import load_secrets, get_secrets
+from ..aws.cloudwatch import get_emitter
+from ..aws.write_behind import drain_write_behind
+from ..logs import logger, AccessLogMiddleware
+from ..utils.metrics import metrics, instrument_botocore
+from .admission import AdmissionMiddleware, admission_options
+from .cache import ResponseCacheMiddleware
+from .metrics import MetricsMiddleware, CONTENT_TYPE
+from .profiling import ProfilingMiddleware, add_profiling, profiling_token
+from .responses import CompressionMiddleware, compression_options, json_response_class
+from .routes import mount_routes
 
 
-def get_app() -> FastAPI:
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:  # pylint: disable=unused-argument
+    """Write the buffered DynamoDb items and metrics before the worker exits"""
+    emitter = get_emitter()
+    if emitter is not None:
+        emitter.start()
+    yield
+    await run_in_threadpool(drain_write_behind)
+    if emitter is not None:
+        await run_in_threadpool(emitter.stop)
+
+
+def get_app() -> FastAPI:  # noqa: C901
     """Get the app"""
     if environ.get("SECRET_NAME"):
-        load_secrets()
-    app: FastAPI = FastAPI()
+        if environ.get("SECRETS_LOADED"):
+            # Loaded by the parent process, the workers only refresh them
+            secrets = get_secrets()
+            secrets.inherit()
+            secrets.start()
+        else:
+            load_secrets()
+    app: FastAPI = FastAPI(default_response_class=json_response_class(), lifespan=lifespan)
+
+    # pylint: disable=unused-argument
 
     if __debug__:
 
@@ -21,19 +54,17 @@ def get_app() -> FastAPI:
             request: Request, exc: StarletteHTTPException
         ) -> Response:
             """Handle starlette exceptions"""
-            logger.error(request.url)
+            # The access line, with the URL, is logged by AccessLogMiddleware
             return Response(content=str(exc), status_code=exc.status_code)
 
     @app.exception_handler(HTTPException)
     async def http_exception_handler(request: Request, exc: HTTPException) -> Response:
         """Handle http exceptions"""
-        logger.error(request.url)
         return Response(content=str(exc), status_code=exc.status_code)
 
     @app.exception_handler(Exception)
     async def exception_handler(request: Request, exc: Exception) -> Response:
         """Handle exceptions"""
-        logger.error(request.url)
         logger.exception(exc)
         return Response(content="Internal Server Error", status_code=500)
 
@@ -42,6 +73,14 @@ def get_app() -> FastAPI:
         """Alive"""
         return Response(status_code=200, content="OK")
 
+    @app.get("/ready", response_model=str, tags=["healthcheck"])
+    async def ready() -> Response:
+        """Ready, once all the routes are loaded"""
+        lazy_routes = getattr(app.state, "lazy_routes", None)
+        if lazy_routes is not None and not lazy_routes.ready.is_set():
+            return Response(status_code=503, content="Loading")
+        return Response(status_code=200, content="OK")
+
     if environ.get("VERSION_NAME"):
 
         @app.get("/version", response_model=str, tags=["healthcheck"])
@@ -49,6 +88,34 @@ def get_app() -> FastAPI:
             """Version"""
             return Response(status_code=200, content=environ["VERSION_NAME"])
 
+    prometheus: bool = environ.get("METRICS", "false").lower().strip() == "true"
+    # Published to CloudWatch, with or without the Prometheus endpoint
+    cloudwatch: bool = get_emitter() is not None
+    if prometheus or cloudwatch:
+        instrument_botocore()
+    if prometheus:
+
+        @app.get("/metrics", response_model=str, tags=["healthcheck"])
+        async def prometheus_metrics() -> Response:
+            """Metrics, in the Prometheus text format"""
+            return Response(
+                status_code=200, content=metrics.render(), media_type=CONTENT_TYPE
+            )
+
+    admission = admission_options()
+    if admission is not None:
+        # Inside the cache, so the cached responses are served even when saturated
+        app.add_middleware(AdmissionMiddleware, **admission)
+    # Inside CORS, so the cached responses get the CORS headers of the request
+    app.add_middleware(ResponseCacheMiddleware)
+    token = profiling_token()
+    if token is not None:
+        add_profiling(app, token)
+        # Outside the cache, so a profiled response is never cached
+        app.add_middleware(ProfilingMiddleware, token=token)
+    compression = compression_options()
+    if compression is not None:
+        app.add_middleware(CompressionMiddleware, **compression)
     app.add_middleware(
         CORSMiddleware,
         allow_origins=[
@@ -58,7 +125,28 @@ def get_app() -> FastAPI:
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    app.add_middleware(AccessLogMiddleware)
+    if prometheus or cloudwatch:
+        app.add_middleware(MetricsMiddleware)
+    return app
+
+
+def create_app() -> FastAPI:
+    """Create the app with the routes in `ROUTES_FOLDERS`.
+
+    This is the app factory every uvicorn worker calls, so each one discovers \
+    its own routes.
+    """
+    app: FastAPI = get_app()
+    routes: list[Path] = [
+        Path(folder)
+        for folder in environ.get("ROUTES_FOLDERS", "").split(pathsep)
+        if len(folder.strip()) > 0
+    ]
+    lazy_routes = mount_routes(app, routes, Path(environ.get("ROUTES_CWD", getcwd())))
+    if lazy_routes is not None:
+        lazy_routes.start()
     return app
 
 
-__all__ = ["get_app"]
+__all__ = ["get_app", "create_app"]
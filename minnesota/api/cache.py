@@ -0,0 +1,284 @@
+"""Response cache"""
+
+from collections import OrderedDict
+from hashlib import sha256
+from os import environ
+from threading import Lock
+from time import monotonic
+from typing import TYPE_CHECKING, Callable, NamedTuple
+from weakref import WeakSet
+from fastapi import Request
+from ..aws.dynamodb import add_write_listener
+
+if TYPE_CHECKING:  # pragma: no cover
+    from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+SCOPE_KEY: str = "minnesota.response_cache"
+
+HTTP_OK: int = 200
+NOT_MODIFIED: int = 304
+
+SAFE_METHODS: tuple[str, ...] = ("GET", "HEAD", "OPTIONS")
+
+# Not sent with a 304, as there is no body
+BODY_HEADERS: tuple[bytes, ...] = (b"content-length", b"content-type", b"etag")
+
+
+class CachedResponse(NamedTuple):
+    """A serialized response"""
+
+    expires: float
+    owner: str
+    etag: bytes
+    headers: list[tuple[bytes, bytes]]
+    body: bytes
+    # The route it was stored by, for the metrics and the access lines of the hits
+    route: object = None
+
+
+class ResponseCache:
+    """Serialized responses, per user, evicted by age and then by least recent use.
+
+    The entries of a user are dropped when the same process writes for that user \
+    through `DynamoDb`, or when the user sends a request that is not a GET.
+    """
+
+    max_size: int
+    _entries: "OrderedDict[tuple[str, str, str], CachedResponse]"
+    _subs: dict[str, set[str]]
+    _lock: Lock
+
+    def __init__(self, max_size: int = 1024) -> None:
+        """Initialize the cache"""
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._subs = {}
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        """Get the number of entries"""
+        return len(self._entries)
+
+    def get(self, key: tuple[str, str, str]) -> CachedResponse | None:
+        """Get a response, if not expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires <= monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: tuple[str, str, str], entry: CachedResponse, sub: str | None) -> None:
+        """Add a response"""
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            if sub is not None:
+                self._subs.setdefault(sub, set()).add(entry.owner)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate_owner(self, owner: str) -> None:
+        """Drop the responses sent with an Authorization header"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == owner]:
+                del self._entries[key]
+
+    def invalidate_user(self, sub: str) -> None:
+        """Drop the responses of a user"""
+        with self._lock:
+            owners: set[str] = self._subs.pop(sub, set())
+            for key in [key for key in self._entries if key[0] in owners]:
+                del self._entries[key]
+
+
+# The caches of the middlewares, rebuilt with the middleware stack of every app
+_caches: "WeakSet[ResponseCache]" = WeakSet()
+
+
+def _on_write(table_name: str, sub: str) -> None:  # pylint: disable=unused-argument
+    """Drop the responses of a user that wrote to DynamoDb"""
+    for cache in list(_caches):
+        cache.invalidate_user(sub)
+
+
+def _owner(scope: "Scope") -> str:
+    """Hash the Authorization header, that identifies the user"""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            return sha256(value).hexdigest()
+    return ""
+
+
+def _if_none_match(scope: "Scope") -> bytes | None:
+    """Get the If-None-Match header"""
+    for name, value in scope["headers"]:
+        if name == b"if-none-match":
+            return bytes(value)
+    return None
+
+
+def _matches(if_none_match: bytes | None, etag: bytes) -> bool:
+    """Check if an If-None-Match header matches an ETag, with the weak comparison"""
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == b"*":
+        return True
+    return any(
+        tag.strip().removeprefix(b"W/") == etag for tag in if_none_match.split(b",")
+    )
+
+
+class ResponseCacheMiddleware:  # pylint: disable=too-few-public-methods
+    """Add strong ETags to the responses of the routes that depend on `cache_response`, \
+    answer 304 when the client already has them, and serve them from the cache \
+    until their TTL expires.
+    """
+
+    def __init__(self, app: "ASGIApp", cache: ResponseCache | None = None) -> None:
+        """Initialize the middleware"""
+        self.app = app
+        self.cache = cache or ResponseCache(
+            int(environ.get("RESPONSE_CACHE_SIZE", "1024"))
+        )
+        # A single listener for the process, that forgets the caches dropped
+        _caches.add(self.cache)
+        add_write_listener(_on_write)
+
+    async def _send_cached(
+        self,
+        entry: CachedResponse,
+        if_none_match: bytes | None,
+        send: "Send",
+    ) -> None:
+        """Send a cached response, or a 304"""
+        if _matches(if_none_match, entry.etag):
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": NOT_MODIFIED,
+                    "headers": [
+                        (name, value)
+                        for name, value in entry.headers
+                        if name not in BODY_HEADERS
+                    ]
+                    + [(b"etag", entry.etag)],
+                }
+            )
+            await send({"type": "http.response.body", "body": b""})
+            return
+        await send(
+            {"type": "http.response.start", "status": HTTP_OK, "headers": entry.headers}
+        )
+        await send({"type": "http.response.body", "body": entry.body})
+
+    async def __call__(  # noqa: C901
+        self, scope: "Scope", receive: "Receive", send: "Send"
+    ) -> None:
+        """Handle a request"""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        owner: str = _owner(scope)
+        if scope["method"] not in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            self.cache.invalidate_owner(owner)
+            return
+        if scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+        key: tuple[str, str, str] = (
+            owner,
+            scope["path"],
+            scope.get("query_string", b"").decode("latin-1"),
+        )
+        if_none_match: bytes | None = _if_none_match(scope)
+        if len(self.cache) > 0:
+            entry = self.cache.get(key)
+            if entry is not None:
+                scope["route"] = entry.route
+                await self._send_cached(entry, if_none_match, send)
+                return
+
+        # Set by the cache_response dependency
+        scope[SCOPE_KEY] = None
+        start: "Message | None" = None
+        chunks: list[bytes] = []
+
+        async def _send(message: "Message") -> None:
+            nonlocal start
+            if message["type"] == "http.response.start":
+                if scope.get(SCOPE_KEY) is None or message["status"] != HTTP_OK:
+                    await send(message)
+                    return
+                start = message
+                return
+            if start is None:
+                await send(message)
+                return
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            body: bytes = b"".join(chunks)
+            etag: bytes = b'"' + sha256(body).hexdigest()[:32].encode() + b'"'
+            headers: list[tuple[bytes, bytes]] = [
+                (name, value)
+                for name, value in start["headers"]
+                if name not in (b"etag", b"content-length")
+            ]
+            if not any(name == b"cache-control" for name, _ in headers):
+                # Per user, and revalidated every time it is not in this cache
+                headers.append((b"cache-control", b"private, no-cache"))
+            headers += [(b"etag", etag), (b"content-length", str(len(body)).encode())]
+            entry = CachedResponse(
+                expires=monotonic() + scope[SCOPE_KEY],
+                owner=owner,
+                etag=etag,
+                headers=headers,
+                body=body,
+                route=scope.get("route"),
+            )
+            if scope[SCOPE_KEY] > 0:
+                sub: object = scope.get("state", {}).get("sub")
+                self.cache.put(key, entry, sub if isinstance(sub, str) else None)
+            await self._send_cached(entry, if_none_match, send)
+
+        await self.app(scope, receive, _send)
+
+
+def cache_response(ttl: float = 0) -> Callable[[Request], None]:
+    """Get a dependency that adds an ETag to the response of a GET route, \
+    and caches it per user for `ttl` seconds
+
+    Example:
+    ```python
+    @router.get("/", dependencies=[Depends(cache_response(ttl=30))])
+    def list_items(user: CognitoUser) -> list[Item]:
+        ...
+    ```
+
+    Args:
+        ttl (float, optional): Seconds to cache the response for. \
+            Defaults to 0, that only adds the ETag.
+
+    Returns:
+        Callable[[Request], None]: The dependency
+    """
+
+    def _cache_response(request: Request) -> None:
+        """Ask `ResponseCacheMiddleware` to cache the response"""
+        if SCOPE_KEY in request.scope:
+            request.scope[SCOPE_KEY] = ttl
+
+    return _cache_response
+
+
+__all__ = (
+    "CachedResponse",
+    "ResponseCache",
+    "ResponseCacheMiddleware",
+    "cache_response",
+)
@@ -0,0 +1,119 @@
+"""Lazy routes"""
+
+from importlib import import_module
+from threading import Event, Lock, Thread
+from typing import TYPE_CHECKING
+from fastapi import FastAPI
+from fastapi.routing import APIRouter
+from starlette.concurrency import run_in_threadpool
+from ..logs import logger
+
+if TYPE_CHECKING:  # pragma: no cover
+    from starlette.types import ASGIApp, Receive, Scope, Send
+
+EXEMPT_PATHS: tuple[str, ...] = ("/alive", "/ready", "/version")
+
+
+class LazyRoutes:
+    """Routers whose modules are imported in the background or on their first request.
+
+    The prefixes come from a discovery manifest, so nothing is imported to know \
+    which requests a router will serve.
+    """
+
+    app: FastAPI
+    ready: Event
+    _pending: dict[tuple[str, str], str]
+    _lock: Lock
+
+    def __init__(self, app: FastAPI) -> None:
+        """Initialize the lazy routes of an app"""
+        self.app = app
+        self.ready = Event()
+        self._pending = {}
+        self._lock = Lock()
+
+    def add(self, module: str, attr: str, prefix: str) -> None:
+        """Add a router to load later"""
+        self._pending[(module, attr)] = prefix
+
+    def load(self, module: str, attr: str) -> None:
+        """Import a router and include it in the app, if not done yet"""
+        if (module, attr) not in self._pending:
+            return
+        # The import lock already serializes imports of the same module
+        router: object = getattr(import_module(module), attr)
+        if not isinstance(router, APIRouter):
+            raise TypeError(f"{module}.{attr} is not an APIRouter")
+        with self._lock:
+            if (module, attr) not in self._pending:
+                return
+            self.app.include_router(router)
+            self.app.openapi_schema = None
+            del self._pending[(module, attr)]
+            logger.debug("Loaded %s.%s", module, attr)
+            if not self._pending:
+                self.ready.set()
+
+    def preload(self, names: list[str]) -> None:
+        """Load now the routers matching a module name or a prefix"""
+        for (module, attr), prefix in list(self._pending.items()):
+            if any(
+                module == name or module.startswith(name + ".") or prefix == name
+                for name in names
+            ):
+                self.load(module, attr)
+
+    def load_path(self, path: str) -> None:
+        """Load the routers that could serve a path"""
+        for (module, attr), prefix in list(self._pending.items()):
+            if path == prefix or path.startswith(prefix.rstrip("/") + "/"):
+                self.load(module, attr)
+
+    def load_all(self) -> None:
+        """Load all the routers"""
+        # pylint: disable=broad-except
+        for module, attr in list(self._pending):
+            try:
+                self.load(module, attr)
+            except Exception as exc:
+                logger.exception(exc)
+        if not self._pending:
+            self.ready.set()
+
+    def start(self) -> None:
+        """Load the routers in a background thread"""
+        if not self._pending:
+            self.ready.set()
+            return
+        Thread(target=self.load_all, name="lazy-routes", daemon=True).start()
+
+    def is_pending(self, path: str) -> bool:
+        """Check if a path could be served by a router not loaded yet"""
+        return any(
+            path == prefix or path.startswith(prefix.rstrip("/") + "/")
+            for prefix in list(self._pending.values())
+        )
+
+
+class LazyRoutesMiddleware:  # pylint: disable=too-few-public-methods
+    """Load the routers that serve a request before routing it"""
+
+    def __init__(self, app: "ASGIApp", routes: LazyRoutes) -> None:
+        """Initialize the middleware"""
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope: "Scope", receive: "Receive", send: "Send") -> None:
+        """Handle a request"""
+        if (
+            scope["type"] in ("http", "websocket")
+            and not self.routes.ready.is_set()
+            and scope["path"] not in EXEMPT_PATHS
+            and self.routes.is_pending(scope["path"])
+        ):
+            await run_in_threadpool(self.routes.load_path, scope["path"])
+        await self.app(scope, receive, send)
+
+
+__all__ = ("LazyRoutes", "LazyRoutesMiddleware")
@@ -0,0 +1,59 @@
+"""Request metrics"""
+
+from time import perf_counter
+from typing import TYPE_CHECKING
+from ..utils.metrics import Metrics, metrics as default_metrics
+
+if TYPE_CHECKING:  # pragma: no cover
+    from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+CONTENT_TYPE: str = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsMiddleware:  # pylint: disable=too-few-public-methods
+    """Record latency, status code and payload sizes of every request, by route"""
+
+    def __init__(self, app: "ASGIApp", metrics: Metrics | None = None) -> None:
+        """Initialize the middleware"""
+        self.app = app
+        self.metrics = metrics or default_metrics
+
+    async def __call__(self, scope: "Scope", receive: "Receive", send: "Send") -> None:
+        """Handle a request"""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started: float = perf_counter()
+        status: int = 500
+        response_size: int = 0
+
+        async def _send(message: "Message") -> None:
+            nonlocal status, response_size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+
+        self.metrics.inc("minnesota_http_requests_in_flight")
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            self.metrics.inc("minnesota_http_requests_in_flight", value=-1)
+            request_size: int = 0
+            for key, value in scope["headers"]:
+                if key == b"content-length":
+                    request_size = int(value) if value.isdigit() else 0
+                    break
+            self.metrics.record_request(
+                scope["method"],
+                # The route template, not the path, to keep the labels bounded
+                getattr(scope.get("route"), "path", "unmatched"),
+                status,
+                perf_counter() - started,
+                request_size,
+                response_size,
+            )
+
+
+__all__ = ("MetricsMiddleware", "CONTENT_TYPE")
@@ -0,0 +1,285 @@
+"""Profiling endpoints"""
+
+import tracemalloc
+from collections import Counter
+from hmac import compare_digest
+from os import environ
+from sys import _current_frames
+from threading import Event, Lock, Thread, enumerate as threads, get_ident
+from time import sleep
+from typing import TYPE_CHECKING, Annotated
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from .responses import get_header
+
+if TYPE_CHECKING:  # pragma: no cover
+    from types import FrameType
+    from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+TOKEN_HEADER: bytes = b"x-profiling-token"
+PROFILE_HEADER: bytes = b"x-profile"
+MAX_SECONDS: float = 60.0
+MIN_INTERVAL: float = 0.001
+
+# Leaves of the threads waiting for work, left out of the profiles
+IDLE_FUNCTIONS: frozenset[str] = frozenset(
+    {
+        "threading:Condition.wait",
+        "threading:Event.wait",
+        "queue:Queue.get",
+        "selectors:EpollSelector.select",
+        "selectors:KqueueSelector.select",
+        "selectors:PollSelector.select",
+        "selectors:SelectSelector.select",
+    }
+)
+
+# One profile at a time, as they sample every thread
+_profiling: Lock = Lock()
+
+
+def _frame_name(frame: "FrameType") -> str:
+    """Get the name of a frame, as `module:function`"""
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_qualname}"
+
+
+class StackSampler:
+    """Sample the stacks of every thread from a background thread, \
+    and count them in the collapsed format of flamegraph.pl and speedscope.
+
+    Nothing is recorded outside of `start` and `stop`.
+    """
+
+    interval: float
+    idle: bool
+    stacks: "Counter[str]"
+    _stop: Event
+    _thread: Thread | None
+
+    def __init__(self, interval: float = 0.005, idle: bool = False) -> None:
+        """Initialize the sampler
+
+        Args:
+            interval (float, optional): Seconds between samples. Defaults to 0.005.
+            idle (bool, optional): Count the threads waiting for work too. \
+                Defaults to False.
+        """
+        self.interval = interval
+        self.idle = idle
+        self.stacks = Counter()
+        self._stop = Event()
+        self._thread = None
+
+    def sample(self) -> None:
+        """Count the current stack of every other thread"""
+        names: dict[int | None, str] = {thread.ident: thread.name for thread in threads()}
+        own: int = get_ident()
+        for ident, leaf in _current_frames().items():
+            if ident == own:
+                continue
+            frames: list[str] = []
+            frame: "FrameType | None" = leaf
+            while frame is not None:
+                frames.append(_frame_name(frame))
+                frame = frame.f_back
+            if not self.idle and frames[0] in IDLE_FUNCTIONS:
+                continue
+            frames.append(names.get(ident, str(ident)))
+            self.stacks[";".join(reversed(frames))] += 1
+
+    def _run(self) -> None:
+        """Sample until stopped"""
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self) -> None:
+        """Start sampling"""
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> str:
+        """Stop sampling, and get the collapsed stacks"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self.collapsed()
+
+    def collapsed(self) -> str:
+        """Get the stacks counted, one `frame;frame;frame count` line each"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def profile_for(seconds: float, interval: float = 0.005, idle: bool = False) -> str:
+    """Sample every thread for some seconds, at most `MAX_SECONDS`, \
+    and get the collapsed stacks"""
+    sampler = StackSampler(min(max(interval, MIN_INTERVAL), MAX_SECONDS), idle)
+    sampler.start()
+    try:
+        sleep(min(max(seconds, 0.0), MAX_SECONDS))
+    finally:
+        stacks: str = sampler.stop()
+    return stacks
+
+
+def _check_token(request: Request, token: str) -> None:
+    """Refuse the requests without the profiling token"""
+    sent: str = request.headers.get(TOKEN_HEADER.decode(), "")
+    if not compare_digest(sent.encode(), token.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+def _memory_stats(
+    snapshot: tracemalloc.Snapshot,
+    previous: tracemalloc.Snapshot | None,
+    group: str,
+    limit: int,
+) -> str:
+    """Format the top allocations of a snapshot, or its growth since the previous one"""
+    total: int = sum(stat.size for stat in snapshot.statistics(group))
+    lines: list[str] = [f"Total: {total / 1024:.1f} KiB"]
+    if previous is None:
+        lines += [str(stat) for stat in snapshot.statistics(group)[:limit]]
+    else:
+        lines += [str(stat) for stat in snapshot.compare_to(previous, group)[:limit]]
+    return "\n".join(lines) + "\n"
+
+
+def add_profiling(app: FastAPI, token: str) -> None:
+    """Add the profiling endpoints, under `/debug/profile`, \
+    answering only the requests with the token in `X-Profiling-Token`"""
+    snapshots: list[tracemalloc.Snapshot] = []
+
+    def _snapshot() -> tracemalloc.Snapshot:
+        """Take a snapshot, without the allocations of tracemalloc itself"""
+        return tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<unknown>"),
+            )
+        )
+
+    @app.get("/debug/profile/cpu", include_in_schema=False)
+    async def cpu_profile(
+        request: Request,
+        seconds: Annotated[float, Query(allow_inf_nan=False)] = 10.0,
+        interval: Annotated[float, Query(allow_inf_nan=False)] = 0.005,
+        idle: bool = False,
+    ) -> Response:
+        """Sample the stacks for some seconds, as collapsed stacks for a flamegraph"""
+        _check_token(request, token)
+        if not _profiling.acquire(blocking=False):  # pylint: disable=consider-using-with
+            raise HTTPException(status_code=409, detail="Already profiling")
+        try:
+            stacks: str = await run_in_threadpool(profile_for, seconds, interval, idle)
+        finally:
+            _profiling.release()
+        return Response(content=stacks, media_type="text/plain")
+
+    @app.post("/debug/profile/memory/start", include_in_schema=False)
+    async def memory_start(request: Request, frames: int = 10) -> Response:
+        """Start tracing the allocations"""
+        _check_token(request, token)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            snapshots.clear()
+        return Response(content="Tracing", media_type="text/plain")
+
+    @app.get("/debug/profile/memory", include_in_schema=False)
+    async def memory_snapshot(
+        request: Request,
+        group: str = "lineno",
+        limit: int = 25,
+        diff: bool = False,
+    ) -> Response:
+        """Get the top allocations since tracing started, or their growth \
+        since the previous snapshot with `diff`"""
+        _check_token(request, token)
+        if group not in ("lineno", "filename", "traceback"):
+            raise HTTPException(status_code=400, detail="Invalid group")
+        if not tracemalloc.is_tracing():
+            raise HTTPException(status_code=409, detail="Not tracing")
+        snapshot: tracemalloc.Snapshot = await run_in_threadpool(_snapshot)
+        previous: tracemalloc.Snapshot | None = snapshots[-1] if diff and snapshots else None
+        snapshots[:] = [snapshot]
+        stats: str = await run_in_threadpool(_memory_stats, snapshot, previous, group, limit)
+        return Response(content=stats, media_type="text/plain")
+
+    @app.post("/debug/profile/memory/stop", include_in_schema=False)
+    async def memory_stop(request: Request) -> Response:
+        """Stop tracing the allocations, and free the traces"""
+        _check_token(request, token)
+        tracemalloc.stop()
+        snapshots.clear()
+        return Response(content="Stopped", media_type="text/plain")
+
+
+class ProfilingMiddleware:  # pylint: disable=too-few-public-methods
+    """Profile a single request, sent with `X-Profile` and the profiling token.
+
+    The response is replaced by the collapsed stacks sampled while it was served, \
+    with its status in `X-Profiled-Status`. The stacks include the other requests \
+    served meanwhile. The other requests only cost a header lookup.
+    """
+
+    token: bytes
+    interval: float
+
+    def __init__(self, app: "ASGIApp", token: str, interval: float = 0.001) -> None:
+        """Initialize the middleware"""
+        self.app = app
+        self.token = token.encode()
+        self.interval = interval
+
+    async def __call__(self, scope: "Scope", receive: "Receive", send: "Send") -> None:
+        """Handle a request"""
+        if scope["type"] != "http" or get_header(scope["headers"], PROFILE_HEADER) is None:
+            await self.app(scope, receive, send)
+            return
+        sent: bytes = get_header(scope["headers"], TOKEN_HEADER) or b""
+        # pylint: disable-next=consider-using-with
+        if not compare_digest(sent, self.token) or not _profiling.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+        status: int = 500
+
+        async def _send(message: "Message") -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        sampler = StackSampler(self.interval)
+        sampler.start()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            stacks: bytes = sampler.stop().encode()
+            _profiling.release()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/plain; charset=utf-8"),
+                    (b"content-length", str(len(stacks)).encode()),
+                    (b"x-profiled-status", str(status).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": stacks})
+
+
+def profiling_token() -> str | None:
+    """Get the token set by `PROFILING_TOKEN`, or None if profiling is disabled"""
+    return environ.get("PROFILING_TOKEN") or None
+
+
+__all__ = (
+    "ProfilingMiddleware",
+    "StackSampler",
+    "add_profiling",
+    "profile_for",
+    "profiling_token",
+)
@@ -0,0 +1,258 @@
+"""Responses"""
+
+from importlib import import_module
+from importlib.metadata import version
+from itertools import takewhile
+from json import dumps
+from os import environ
+from typing import TYPE_CHECKING, Any
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse, Response
+
+if TYPE_CHECKING:  # pragma: no cover
+    from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+def _optional_module(name: str) -> Any:
+    """Import an optional dependency, or get None if not installed"""
+    try:
+        return import_module(name)
+    except ImportError:
+        return None
+
+
+ORJSON: Any = _optional_module("orjson")
+BROTLI: Any = _optional_module("brotli")
+
+# The FastAPI release serializing the return values with Pydantic, in Rust
+PYDANTIC_SERIALIZATION: tuple[int, ...] = (0, 130, 0)
+
+# Not worth compressing, or streamed and needing every chunk as soon as possible
+UNCOMPRESSED_TYPES: tuple[bytes, ...] = (
+    b"text/event-stream",
+    b"image/",
+    b"video/",
+    b"audio/",
+    b"application/zip",
+    b"application/gzip",
+)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response serialized with orjson, if installed, or compact `json` otherwise"""
+
+    def render(self, content: Any) -> bytes:
+        """Serialize the content"""
+        if ORJSON is not None:
+            data: bytes = ORJSON.dumps(content, option=ORJSON.OPT_NON_STR_KEYS)
+            return data
+        return dumps(
+            content,
+            ensure_ascii=False,
+            allow_nan=False,
+            separators=(",", ":"),
+        ).encode("utf-8")
+
+
+class RawJSONResponse(Response):
+    """Response with JSON already serialized, like `DynamoDb.get_items_json_for_user`
+
+    Example:
+    ```python
+    @router.get("/", response_class=RawJSONResponse)
+    def list_items(user: CognitoUser) -> RawJSONResponse:
+        return RawJSONResponse(db.get_items_json_for_user(user["sub"]))
+    ```
+    """
+
+    media_type = "application/json"
+
+
+def _serializes_with_pydantic() -> bool:
+    """Check if FastAPI serializes the return values with Pydantic, \
+    that is faster than a custom class, as it does since `PYDANTIC_SERIALIZATION`"""
+    installed: list[int] = []
+    for part in version("fastapi").split(".")[:3]:
+        digits: str = "".join(takewhile(str.isdigit, part))
+        installed.append(int(digits or 0))
+    return tuple(installed) >= PYDANTIC_SERIALIZATION
+
+
+def json_response_class() -> type[JSONResponse]:
+    """Get the default response class set by `JSON_RESPONSE`: `fast` or `default`.
+
+    Defaults to `fast` when orjson is installed and FastAPI does not serialize \
+    with Pydantic on its own.
+    """
+    name: str = environ.get(
+        "JSON_RESPONSE",
+        "fast" if ORJSON is not None and not _serializes_with_pydantic() else "default",
+    )
+    if name.lower().strip() == "fast":
+        return FastJSONResponse
+    return JSONResponse
+
+
+def get_header(headers: list[tuple[bytes, bytes]], name: bytes) -> bytes | None:
+    """Get a header from the raw headers of a scope or a message"""
+    for key, value in headers:
+        if key == name:
+            return value
+    return None
+
+
+def _accepted_encodings(accept: bytes) -> dict[bytes, float]:
+    """Parse an Accept-Encoding header, into the q-value of every content coding"""
+    encodings: dict[bytes, float] = {}
+    for part in accept.lower().split(b","):
+        coding, *params = part.split(b";")
+        quality: float = 1.0
+        for param in params:
+            name, _, value = param.partition(b"=")
+            if name.strip() == b"q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding.strip():
+            encodings[coding.strip()] = quality
+    return encodings
+
+
+def _quality(encodings: dict[bytes, float], coding: bytes) -> float:
+    """Get the q-value of a content coding, the codings not listed taking the one of `*`"""
+    return encodings.get(coding, encodings.get(b"*", 0.0))
+
+
+class CompressionMiddleware:  # pylint: disable=too-few-public-methods
+    """Compress the responses larger than `minimum_size`, with Brotli when the client \
+    accepts it and the brotli package is installed, or with gzip.
+
+    The ETags of compressed responses become weak, as the bytes sent differ.
+    """
+
+    minimum_size: int
+    quality: int
+
+    def __init__(
+        self,
+        app: "ASGIApp",
+        minimum_size: int = 1000,
+        gzip_level: int = 6,
+        quality: int = 4,
+    ) -> None:
+        """Initialize the middleware"""
+        self.app = app
+        self.minimum_size = minimum_size
+        self.quality = quality
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size, compresslevel=gzip_level)
+
+    async def __call__(self, scope: "Scope", receive: "Receive", send: "Send") -> None:
+        """Handle a request"""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encodings: dict[bytes, float] = _accepted_encodings(
+            get_header(scope["headers"], b"accept-encoding") or b""
+        )
+        brotli: float = _quality(encodings, b"br") if BROTLI is not None else 0.0
+        gzip: float = _quality(encodings, b"gzip")
+        # Brotli unless gzip is preferred, neither when refused with q=0
+        if brotli > 0 and brotli >= gzip:
+            await self.app(scope, receive, self._brotli_send(send))
+            return
+        if gzip > 0:
+            await self.gzip(scope, receive, self._weak_etag_send(send))
+            return
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    def _weak_etag_send(send: "Send") -> "Send":
+        """Weaken the ETag of the responses compressed by gzip"""
+
+        async def _send(message: "Message") -> None:
+            if message["type"] == "http.response.start":
+                headers: list[tuple[bytes, bytes]] = list(message["headers"])
+                etag = get_header(headers, b"etag")
+                if get_header(headers, b"content-encoding") == b"gzip" and (
+                    etag is not None and not etag.startswith(b"W/")
+                ):
+                    headers = [(k, v) for k, v in headers if k != b"etag"]
+                    headers.append((b"etag", b"W/" + etag))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        return _send
+
+    def _brotli_send(self, send: "Send") -> "Send":  # noqa: C901
+        """Compress the response with Brotli, if worth it"""
+        start: "Message | None" = None
+        compressor: Any = None
+        passthrough: bool = False
+
+        async def _send(message: "Message") -> None:  # noqa: C901
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                headers: list[tuple[bytes, bytes]] = list(message["headers"])
+                content_type: bytes = get_header(headers, b"content-type") or b""
+                passthrough = get_header(headers, b"content-encoding") is not None or any(
+                    content_type.startswith(kind) for kind in UNCOMPRESSED_TYPES
+                )
+                if passthrough:
+                    await send(message)
+                else:
+                    start = message
+                return
+            if passthrough or start is None:
+                await send(message)
+                return
+            body: bytes = message.get("body", b"")
+            more_body: bool = message.get("more_body", False)
+            if compressor is None:
+                if not more_body and len(body) < self.minimum_size:
+                    await send(start)
+                    await send(message)
+                    return
+                headers = [
+                    (k, v)
+                    for k, v in start["headers"]
+                    if k not in (b"content-length", b"etag")
+                ]
+                etag = get_header(start["headers"], b"etag")
+                compressor = BROTLI.Compressor(quality=self.quality)
+                headers += [(b"content-encoding", b"br"), (b"vary", b"Accept-Encoding")]
+                if etag is not None:
+                    headers.append((b"etag", etag if etag.startswith(b"W/") else b"W/" + etag))
+                if not more_body:
+                    compressed: bytes = compressor.process(body) + compressor.finish()
+                    headers.append((b"content-length", str(len(compressed)).encode()))
+                    await send({**start, "headers": headers})
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+                await send({**start, "headers": headers})
+            chunk: bytes = compressor.process(body)
+            chunk += compressor.flush() if more_body else compressor.finish()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        return _send
+
+
+def compression_options() -> dict[str, int] | None:
+    """Get the options of `CompressionMiddleware` set by `COMPRESSION`, \
+    `COMPRESSION_MIN_SIZE` and `COMPRESSION_LEVEL`, or None if disabled"""
+    if environ.get("COMPRESSION", "true").lower().strip() != "true":
+        return None
+    return {
+        "minimum_size": int(environ.get("COMPRESSION_MIN_SIZE", "1000")),
+        "gzip_level": int(environ.get("COMPRESSION_LEVEL", "6")),
+    }
+
+
+__all__ = (
+    "CompressionMiddleware",
+    "FastJSONResponse",
+    "RawJSONResponse",
+    "compression_options",
+    "get_header",
+    "json_response_class",
+)
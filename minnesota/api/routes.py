@@ -0,0 +1,93 @@
+"""Mount the routes"""
+
+from os import environ
+from pathlib import Path
+from fastapi import FastAPI
+from fastapi.routing import APIRouter
+from ..logs import logger
+from ..utils import load_cached_types, cache_path, read_manifest
+from .lazy import LazyRoutes, LazyRoutesMiddleware
+
+
+def _load_routes(
+    app: FastAPI,
+    route: Path,
+    cwd: Path,
+    cache_file: Path | None,
+    max_depth: int | None,
+) -> None:
+    """Import the routers of a folder and include them in the app"""
+    logger.info(f"Loading routes from {route}")
+    api_routes, report = load_cached_types(
+        APIRouter,
+        folder_name=str(route),
+        cwd=str(cwd),
+        cache_file=cache_file,
+        max_depth=max_depth,
+    )
+    cached: str = " (cached)" if report["cached"] else ""
+    logger.info(f"Found {len(api_routes)} routes in {report['seconds']:.3f}s{cached}")
+    for timing in report["modules"]:
+        logger.debug(
+            f"Imported {timing['module']} in {timing['seconds']:.3f}s "
+            f"(self {timing['self_seconds']:.3f}s)"
+        )
+    for api_route in api_routes:
+        app.include_router(api_route)
+
+
+def mount_routes(app: FastAPI, routes: list[Path], cwd: Path) -> LazyRoutes | None:
+    """Include the routers found in the routes folders in the app
+
+    With `LAZY_ROUTES`, the folders whose discovery cache is valid are not imported: \
+    their prefixes are registered from the cache, and their modules are imported in \
+    a background thread or on their first request, whatever comes first. \
+    The routers matching `ROUTES_PRELOAD` are still loaded eagerly.
+
+    Returns:
+        LazyRoutes | None: The routers still to load, in lazy mode
+    """
+    lazy: bool = environ.get("LAZY_ROUTES", "false").lower().strip() == "true"
+    cache_dir: str | None = environ.get("ROUTES_CACHE")
+    if lazy and not cache_dir:
+        cache_dir = str(cwd.joinpath(".minnesota"))
+    max_depth: int | None = (
+        int(environ["ROUTES_MAX_DEPTH"]) if environ.get("ROUTES_MAX_DEPTH") else None
+    )
+    lazy_routes: LazyRoutes | None = LazyRoutes(app) if lazy else None
+    for route in routes:
+        cache_file: Path | None = (
+            cache_path(cache_dir, str(route)) if cache_dir else None
+        )
+        entries: list[list[str]] | None = (
+            read_manifest(
+                APIRouter,
+                folder_name=str(route),
+                cwd=str(cwd),
+                cache_file=cache_file,
+                max_depth=max_depth,
+            )
+            if lazy_routes is not None and cache_file is not None
+            else None
+        )
+        if lazy_routes is None or entries is None:
+            _load_routes(app, route, cwd, cache_file, max_depth)
+            continue
+        logger.info(f"Registered {len(entries)} lazy routes from {route}")
+        for module, attr, prefix in entries:
+            lazy_routes.add(module, attr, prefix)
+    if lazy_routes is None:
+        return None
+    preload: list[str] = [
+        name.strip()
+        for name in environ.get("ROUTES_PRELOAD", "").split(",")
+        if len(name.strip()) > 0
+    ]
+    if preload:
+        lazy_routes.preload(preload)
+    app.state.lazy_routes = lazy_routes
+    app.add_middleware(LazyRoutesMiddleware, routes=lazy_routes)
+    return lazy_routes
+
+
+__all__ = ["mount_routes"]
@@ -1,13 +1,64 @@
 """AWS utils"""
 
-from .clients import client
-from .cognito import get_user_from_request, CognitoUser
-from .dynamodb import DynamoDb, DynamoDbItem, T, prepare_get_user_item
-from .secrets import load_secrets
-from .s3 import S3Zip
+from importlib import import_module
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .clients import client
+    from .cloudwatch import CloudWatchEmitter, get_emitter
+    from .cognito import get_user_from_request, CognitoUser
+    from .dynamodb import DynamoDb, DynamoDbItem, T, prepare_get_user_item
+    from .secrets import load_secrets, get_secrets, SecretsCache
+    from .s3 import S3Zip
+    from .storage import StorageBackend, S3Backend, LocalBackend
+    from .lambdas import LambdaHandler
+    from .ses import BulkEmailSender, get_bulk_sender
+    from .write_behind import WriteBehind, drain_write_behind
+
+# Imported on first access: S3Zip users do not need fastapi or the Cognito helpers
+_LAZY: dict[str, str] = {
+    "client": ".clients",
+    "CloudWatchEmitter": ".cloudwatch",
+    "get_emitter": ".cloudwatch",
+    "get_user_from_request": ".cognito",
+    "CognitoUser": ".cognito",
+    "DynamoDb": ".dynamodb",
+    "DynamoDbItem": ".dynamodb",
+    "T": ".dynamodb",
+    "prepare_get_user_item": ".dynamodb",
+    "load_secrets": ".secrets",
+    "get_secrets": ".secrets",
+    "SecretsCache": ".secrets",
+    "S3Zip": ".s3",
+    "StorageBackend": ".storage",
+    "S3Backend": ".storage",
+    "LocalBackend": ".storage",
+    "LambdaHandler": ".lambdas",
+    "BulkEmailSender": ".ses",
+    "get_bulk_sender": ".ses",
+    "WriteBehind": ".write_behind",
+    "drain_write_behind": ".write_behind",
+}
+
+
+def __getattr__(name: str) -> Any:
+    """Import an attribute on first access"""
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_LAZY[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    """List the attributes, imported or not"""
+    return sorted({*globals(), *__all__})
+
 
 __all__ = (
     "client",
+    "CloudWatchEmitter",
+    "get_emitter",
     "get_user_from_request",
     "CognitoUser",
     "DynamoDb",
@@ -15,5 +66,15 @@ __all__ = (
     "T",
     "prepare_get_user_item",
     "load_secrets",
+    "get_secrets",
+    "SecretsCache",
     "S3Zip",
+    "StorageBackend",
+    "S3Backend",
+    "LocalBackend",
+    "LambdaHandler",
+    "BulkEmailSender",
+    "get_bulk_sender",
+    "WriteBehind",
+    "drain_write_behind",
 )
@@ -1,7 +1,6 @@
 """Clients"""
 
-from typing import overload, TYPE_CHECKING
-from boto3 import client as boto3_client
+from typing import overload, Any, Callable, TYPE_CHECKING
 
 if TYPE_CHECKING:  # pragma: no cover
     from typing import Literal, TypeAlias, Unpack, TypedDict, NotRequired
@@ -50,6 +49,15 @@ if TYPE_CHECKING:  # pragma: no cover
         verify: NotRequired[bool | str | None]
 
 
+_client_hooks: list[Callable[[Any], None]] = []
+
+
+def add_client_hook(hook: Callable[[Any], None]) -> None:
+    """Call a function on every client created from now on"""
+    if hook not in _client_hooks:
+        _client_hooks.append(hook)
+
+
 @overload
 def client(
     service: "Literal['cognito']",
@@ -119,7 +127,16 @@ def client(
     **kwargs: "Unpack[Kwargs]",  # type: ignore[misc]
 ) -> "Clients":
     """Get a boto3 client"""
-    return boto3_client(service, **kwargs)
+    # Imported here, as boto3 takes long to import and not every user needs it
+    from boto3 import client as boto3_client  # noqa: PLC0415 # pylint: disable=import-outside-toplevel
+
+    # Cognito user pools are the cognito-idp service
+    boto_client: "Clients" = boto3_client(
+        "cognito-idp" if service == "cognito" else service, **kwargs
+    )
+    for hook in _client_hooks:
+        hook(boto_client)
+    return boto_client
 
 
-__all__ = ("client",)
+__all__ = ("client", "add_client_hook")
@@ -0,0 +1,256 @@
+"""CloudWatch metrics"""
+
+from datetime import datetime, timezone
+from json import dumps
+from logging import INFO, Formatter, Logger, StreamHandler, getLogger
+from os import environ
+from sys import stdout
+from threading import Event, Lock, Thread
+from time import time
+from typing import TYPE_CHECKING, Any, Literal
+from ..utils.metrics import BUCKETS, Metrics, metrics as default_metrics
+from .clients import client
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import TypeAlias
+
+    Key: TypeAlias = tuple[str, tuple[tuple[str, str], ...]]
+
+# Limits of a PutMetricData call
+MAX_DATUMS: int = 1000
+MAX_DIMENSIONS: int = 30
+# Metrics of an embedded metric format document
+MAX_EMF_METRICS: int = 100
+
+# The api logger, without importing minnesota.logs and fastapi with it
+logger: Logger = getLogger("api")
+
+
+def _emf_logger() -> Logger:
+    """Get the logger of the EMF lines, that must be the whole log event"""
+    emf: Logger = getLogger("api.emf")
+    if not emf.handlers:
+        handler = StreamHandler(stdout)
+        handler.setFormatter(Formatter("%(message)s"))
+        emf.addHandler(handler)
+        emf.setLevel(INFO)
+        emf.propagate = False
+    return emf
+
+
+def _unit(name: str) -> str:
+    """Get the CloudWatch unit of a metric"""
+    if name.endswith("_seconds"):
+        return "Seconds"
+    if name.endswith("_bytes_total"):
+        return "Bytes"
+    if name.endswith(("_total", "_in_flight")):
+        return "Count"
+    return "None"
+
+
+class CloudWatchEmitter:  # pylint: disable=too-many-instance-attributes
+    """Publish the in-process metrics to CloudWatch from a background thread.
+
+    Every `interval` seconds, the counters and the latencies recorded since \
+    the last time are sent, either as embedded metric format lines on stdout (`emf`), \
+    that CloudWatch Logs turns into metrics, or with PutMetricData (`api`). \
+    Nothing is sent on the request path.
+
+    With `api`, the latencies are sent as their histogram, so CloudWatch has \
+    their percentiles. With `emf`, they are sent as their mean and their count.
+    """
+
+    mode: Literal["emf", "api"]
+    namespace: str
+    interval: float
+    metrics: Metrics
+    _counters: dict["Key", float]
+    _histograms: dict["Key", tuple[list[int], float, int]]
+    _lock: Lock
+    _stop: Event
+    _thread: Thread | None
+
+    def __init__(
+        self,
+        mode: Literal["emf", "api"] = "emf",
+        namespace: str = "minnesota",
+        interval: float = 60.0,
+        metrics: Metrics | None = None,
+    ) -> None:
+        """Initialize the emitter"""
+        self.mode = mode
+        self.namespace = namespace
+        self.interval = interval
+        self.metrics = metrics or default_metrics
+        self._counters = {}
+        self._histograms = {}
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+
+    def collect(self) -> list[dict[str, Any]]:  # pylint: disable=too-many-locals
+        """Get the PutMetricData datums of what was recorded since the last call"""
+        histograms, counters = self.metrics.merge()
+        timestamp: datetime = datetime.now(timezone.utc)
+        data: list[dict[str, Any]] = []
+
+        def _datum(name: str, labels: tuple[tuple[str, str], ...]) -> dict[str, Any]:
+            return {
+                "MetricName": name,
+                "Dimensions": [
+                    {"Name": key, "Value": value} for key, value in labels[:MAX_DIMENSIONS]
+                ],
+                "Timestamp": timestamp,
+                "Unit": _unit(name),
+            }
+
+        for (name, labels), histogram in histograms.items():
+            counts, total, count = self._histograms.get((name, labels), ([], 0.0, 0))
+            delta: list[int] = [
+                now - (counts[i] if i < len(counts) else 0)
+                for i, now in enumerate(histogram.counts)
+            ]
+            self._histograms[(name, labels)] = (
+                list(histogram.counts),
+                histogram.total,
+                histogram.count,
+            )
+            if histogram.count == count:
+                continue
+            values: list[float] = []
+            weights: list[float] = []
+            # The upper bound of every bucket, and the last one for the overflow
+            for bound, weight in zip((*BUCKETS, BUCKETS[-1]), delta, strict=True):
+                if weight:
+                    values.append(bound)
+                    weights.append(float(weight))
+            data.append(
+                {
+                    **_datum(name, labels),
+                    "Values": values,
+                    "Counts": weights,
+                    "minnesota_sum": histogram.total - total,
+                    "minnesota_count": histogram.count - count,
+                }
+            )
+        for (name, labels), value in counters.items():
+            if name.endswith("_in_flight"):
+                data.append({**_datum(name, labels), "Value": value})
+                continue
+            change: float = value - self._counters.get((name, labels), 0)
+            self._counters[(name, labels)] = value
+            if change:
+                data.append({**_datum(name, labels), "Value": change})
+        for (name, labels), value in self.metrics.gauges().items():
+            data.append({**_datum(name, labels), "Value": value})
+        return data
+
+    def _put(self, data: list[dict[str, Any]]) -> None:
+        """Send the datums with PutMetricData"""
+        cloudwatch = client("cloudwatch")
+        datums: list[dict[str, Any]] = [
+            {key: value for key, value in datum.items() if not key.startswith("minnesota_")}
+            for datum in data
+        ]
+        for start in range(0, len(datums), MAX_DATUMS):
+            cloudwatch.put_metric_data(
+                Namespace=self.namespace, MetricData=datums[start : start + MAX_DATUMS]
+            )
+
+    def emf_documents(self, data: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """Get the embedded metric format documents of the datums, \
+        one per set of dimensions"""
+        groups: dict[tuple[tuple[str, str], ...], list[dict[str, Any]]] = {}
+        for datum in data:
+            dimensions = tuple((d["Name"], d["Value"]) for d in datum["Dimensions"])
+            groups.setdefault(dimensions, []).append(datum)
+        documents: list[dict[str, Any]] = []
+        timestamp: int = int(time() * 1000)
+        for dimensions, datums in groups.items():
+            for start in range(0, len(datums), MAX_EMF_METRICS):
+                document: dict[str, Any] = dict(dimensions)
+                definitions: list[dict[str, str]] = []
+                for datum in datums[start : start + MAX_EMF_METRICS]:
+                    name: str = datum["MetricName"]
+                    if "Values" in datum:
+                        document[name] = datum["minnesota_sum"] / datum["minnesota_count"]
+                        document[f"{name}_count"] = datum["minnesota_count"]
+                        definitions.append({"Name": f"{name}_count", "Unit": "Count"})
+                    else:
+                        document[name] = datum["Value"]
+                    definitions.append({"Name": name, "Unit": datum["Unit"]})
+                document["_aws"] = {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": self.namespace,
+                            "Dimensions": [[key for key, _ in dimensions]],
+                            "Metrics": definitions,
+                        }
+                    ],
+                }
+                documents.append(document)
+        return documents
+
+    def emit(self) -> None:
+        """Publish what was recorded since the last time"""
+        with self._lock:
+            data: list[dict[str, Any]] = self.collect()
+            if not data:
+                return
+            if self.mode == "api":
+                self._put(data)
+                return
+            emf: Logger = _emf_logger()
+            for document in self.emf_documents(data):
+                emf.info(dumps(document, separators=(",", ":")))
+
+    def _run(self) -> None:
+        """Publish every interval, until stopped"""
+        while not self._stop.wait(self.interval):
+            try:
+                self.emit()
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.warning("Could not publish the metrics: %s", exc)
+
+    def start(self) -> None:
+        """Start the background thread, if not started"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = Thread(target=self._run, name="cloudwatch-metrics", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread, publishing what is left"""
+        self._stop.set()
+        self._thread = None
+        try:
+            self.emit()
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.warning("Could not publish the metrics: %s", exc)
+
+
+_emitters: list[CloudWatchEmitter] = []
+
+
+def get_emitter() -> CloudWatchEmitter | None:
+    """Get the emitter configured by `CLOUDWATCH_METRICS` (`emf` or `api`), \
+    `CLOUDWATCH_NAMESPACE` and `METRICS_INTERVAL`, or None if disabled"""
+    mode: str = environ.get("CLOUDWATCH_METRICS", "").lower().strip()
+    if mode not in ("emf", "api"):
+        return None
+    if not _emitters:
+        _emitters.append(
+            CloudWatchEmitter(
+                mode="api" if mode == "api" else "emf",
+                namespace=environ.get("CLOUDWATCH_NAMESPACE", "minnesota"),
+                interval=float(environ.get("METRICS_INTERVAL", "60")),
+            )
+        )
+    return _emitters[0]
+
+
+__all__ = ("CloudWatchEmitter", "get_emitter")
@@ -4,6 +4,7 @@ from os import environ
 from typing import TYPE_CHECKING, Annotated
 from fastapi import Depends, Request, HTTPException
 from botocore.exceptions import ClientError
+from ..utils.metrics import timed
 from .clients import client
 
 if TYPE_CHECKING:  # pragma: no cover
@@ -30,9 +31,25 @@ if TYPE_CHECKING:  # pragma: no cover
         attributes: dict[str, str]
 
 
-def get_user_from_request(request: Request) -> "CognitoUserOutput":  # noqa: C901
-    """Get user from request"""
+def get_user_from_request(request: Request) -> "CognitoUserOutput":
+    """Get user from request, asking Cognito once per request
+
+    The user is kept in `request.state.user`, so the other dependencies \
+    of the request reuse it, and the sub in `request.state.sub`, \
+    for the middlewares that need the user.
+    """
+    user: "CognitoUserOutput | None" = getattr(request.state, "user", None)
+    if user is None:
+        user = get_user(request)
+        request.state.user = user
+    return user
+
+
+@timed("Cognito")
+def get_user(request: Request) -> "CognitoUserOutput":  # noqa: C901
+    """Get the user of the request from Cognito"""
     if __debug__ and environ.get("FIXED_USER"):
+        request.state.sub = environ["FIXED_USER"]
         return {
             "sub": environ["FIXED_USER"],
             "email": environ.get("FIXED_EMAIL", "test@localhost.dev"),
@@ -65,6 +82,7 @@ def get_user_from_request(request: Request) -> "CognitoUserOutput":  # noqa: C90
             raise HTTPException(
                 status_code=401, detail=f"Key {key} not found in user attributes"
             )
+    request.state.sub = attributes["sub"]
     return {
         "sub": attributes["sub"],
         "email": attributes["email"],
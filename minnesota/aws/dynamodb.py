@@ -2,13 +2,14 @@
 
 from contextlib import suppress
 from os import environ
-from typing import TYPE_CHECKING, Callable, Generic, TypeVar, Type, TypedDict
+from typing import TYPE_CHECKING, Awaitable, Callable, Generic, TypeVar, Type, TypedDict
 from uuid import uuid4
-from json import loads
-from fastapi import HTTPException, Query, Request
-from pydantic import BaseModel
+from json import dumps
+from pydantic import BaseModel, TypeAdapter
+from ..utils.metrics import timed
 from .clients import client
-from .cognito import get_user_from_request
+from .errors import http_error
+from .write_behind import WriteBehind, get_write_behind
 
 T = TypeVar("T", bound=BaseModel)
 
@@ -22,25 +23,44 @@ class DynamoDbItem(BaseModel, Generic[T]):
 
 
 if TYPE_CHECKING:  # pragma: no cover
+    from fastapi import Request
     from .cognito import CognitoUserOutput
 
     with suppress(ImportError, ModuleNotFoundError):
         from boto3_type_annotations.dynamodb import Client as DynamoClient
 
 
-class DynamoDb(Generic[T]):
+_write_listeners: list[Callable[[str, str], None]] = []
+
+
+def add_write_listener(listener: Callable[[str, str], None]) -> None:
+    """Call a function with the table name and the user after every write"""
+    if listener not in _write_listeners:
+        _write_listeners.append(listener)
+
+
+def _notify_write(table_name: str, sub: str) -> None:
+    """Call the write listeners"""
+    for listener in _write_listeners:
+        listener(table_name, sub)
+
+
+class DynamoDb(Generic[T]):  # pylint: disable=too-many-instance-attributes
     """Class for DynamoDB."""
 
     table_name: str
     _dynamodb: "DynamoClient | None"
     _secondary_index: str
     _type: Type[T]
+    _adapter: TypeAdapter[T]
+    _item_adapter: "TypeAdapter[DynamoDbItem[T]]"
+    _write_behind: WriteBehind | None
 
     @property
     def dynamodb(self) -> "DynamoClient":
         """Get the DynamoDb."""
         if self._dynamodb is None:
-            raise HTTPException(
+            raise http_error(
                 status_code=500, detail="DynamoDb not initialized"
             )  # pragma: no cover
         return self._dynamodb
@@ -50,19 +70,35 @@ class DynamoDb(Generic[T]):
         value_type: Type[T],
         secondary_index: str = "id",
         table_name: str | None = None,
+        write_behind: bool | None = None,
     ) -> None:
-        """Initialize the DynamoDB class."""
+        """Initialize the DynamoDB class.
+
+        Args:
+            value_type (Type[T]): The model of the data.
+            secondary_index (str, optional): The hash key. Defaults to "id".
+            table_name (str | None, optional): The table. Defaults to `DYNAMO_TABLE_NAME`.
+            write_behind (bool | None, optional): Buffer the writes and send them \
+                in batches in the background, see `WriteBehind`. \
+                Defaults to `DYNAMO_WRITE_BEHIND`.
+        """
 
         if table_name is None:
             table_name = environ.get("DYNAMO_TABLE_NAME")
         if table_name is None:
-            raise HTTPException(
+            raise http_error(
                 status_code=500, detail="DYNAMO_TABLE_NAME not set"
             )  # pragma: no cover
         self._type = value_type
+        # Resolved once, instead of for every item
+        self._adapter = TypeAdapter(value_type)
+        self._item_adapter = TypeAdapter(DynamoDbItem[value_type])  # type: ignore[valid-type]
         self._secondary_index = secondary_index
         self.table_name = table_name
         self._dynamodb = client("dynamodb")
+        if write_behind is None:
+            write_behind = environ.get("DYNAMO_WRITE_BEHIND", "false").lower().strip() == "true"
+        self._write_behind = get_write_behind(table_name) if write_behind else None
 
     def convert(self, data: dict[str, dict[str, str]]) -> "DynamoDbItem[T]":
         """Convert an item to a model.
@@ -73,12 +109,16 @@ class DynamoDb(Generic[T]):
         Returns:
             dict: The converted model.
         """
-        return DynamoDbItem[T](
-            id=data[self._secondary_index]["S"],
-            user_id=data["userId"]["S"],
-            data=self._type(**loads(data["data"]["S"])),
+        # Parsed and validated in one pass by pydantic-core, then not validated again
+        return self._item_adapter.validate_python(
+            {
+                "id": data[self._secondary_index]["S"],
+                "user_id": data["userId"]["S"],
+                "data": self._adapter.validate_json(data["data"]["S"]),
+            }
         )
 
+    @timed("DynamoDb")
     def add_item(self, sub: str, data: T) -> str:
         """Add an item to the table and returns the ID.
 
@@ -87,25 +127,39 @@ class DynamoDb(Generic[T]):
             data (dict): The item to add.
         """
         new_id: str = str(uuid4())
+        if self._write_behind is not None:
+            self._write_behind.put(
+                self._secondary_index, new_id, sub, data.model_dump_json(warnings=False)
+            )
+            _notify_write(self.table_name, sub)
+            return new_id
         item = {
             self._secondary_index: {"S": new_id},
             "userId": {"S": sub},
             "data": {"S": data.model_dump_json(warnings=False)},
         }
         self.dynamodb.put_item(TableName=self.table_name, Item=item)
+        _notify_write(self.table_name, sub)
         return new_id
 
+    @timed("DynamoDb")
     def delete_item(self, item_id: str, sub: str) -> None:
         """Delete an item from the table.
 
         Args:
             item (dict): The item to delete.
         """
+        if self._write_behind is not None:
+            self._write_behind.delete(self._secondary_index, str(item_id), sub)
+            _notify_write(self.table_name, sub)
+            return
         self.dynamodb.delete_item(
             TableName=self.table_name,
             Key={self._secondary_index: {"S": str(item_id)}, "userId": {"S": sub}},
         )
+        _notify_write(self.table_name, sub)
 
+    @timed("DynamoDb")
     def update_item(
         self,
         item_id: str,
@@ -117,6 +171,13 @@ class DynamoDb(Generic[T]):
         Args:
             item (dict): The item to update.
         """
+        if self._write_behind is not None:
+            # Coalesced with the other pending updates of the item
+            self._write_behind.update(
+                self._secondary_index, str(item_id), sub, data.model_dump_json(warnings=False)
+            )
+            _notify_write(self.table_name, sub)
+            return
         self.dynamodb.update_item(
             TableName=self.table_name,
             Key={self._secondary_index: {"S": str(item_id)}, "userId": {"S": sub}},
@@ -126,7 +187,9 @@ class DynamoDb(Generic[T]):
             },
             ExpressionAttributeNames={"#data": "data"},
         )
+        _notify_write(self.table_name, sub)
 
+    @timed("DynamoDb")
     def get_item(self, item_id: str, sub: str) -> "DynamoDbItem[T]":
         """Get an item from the table.
 
@@ -139,15 +202,11 @@ class DynamoDb(Generic[T]):
         datas = self.get_items_for_user(sub=sub)
         found_datas = [data for data in datas if data.id == item_id]
         if len(found_datas) == 0:
-            raise HTTPException(status_code=404, detail="Not found")
+            raise http_error(status_code=404, detail="Not found")
         return found_datas[0]
 
-    def get_items_for_user(self, sub: str) -> "list[DynamoDbItem[T]]":
-        """Get all items from the table where user is equal to user_id.
-
-        Returns:
-            list[dict]: The items.
-        """
+    def _scan_user(self, sub: str) -> list[dict[str, dict[str, str]]]:
+        """Get the raw items of a user"""
         outputs: list[dict[str, dict[str, str]]] = []
         with suppress(Exception):
             outputs = self.dynamodb.scan(
@@ -155,7 +214,62 @@ class DynamoDb(Generic[T]):
                 FilterExpression="userId = :val",
                 ExpressionAttributeValues={":val": {"S": sub}},
             )["Items"]
-        return [self.convert(data) for data in outputs]
+        if self._write_behind is not None:
+            outputs = self._write_behind.overlay(self._secondary_index, sub, outputs)
+        return outputs
+
+    def flush(self) -> None:
+        """Write the buffered writes now, when in write-behind mode"""
+        if self._write_behind is not None:
+            self._write_behind.flush()
+
+    def wait_durable(self, timeout: float | None = None) -> bool:
+        """Wait until the writes so far are in DynamoDb, when in write-behind mode
+
+        Returns:
+            bool: False if they were not written in `timeout` seconds
+        """
+        if self._write_behind is None:
+            return True
+        return self._write_behind.wait_durable(timeout)
+
+    @timed("DynamoDb")
+    def get_items_for_user(self, sub: str) -> "list[DynamoDbItem[T]]":
+        """Get all items from the table where user is equal to user_id.
+
+        Returns:
+            list[dict]: The items.
+        """
+        return [self.convert(data) for data in self._scan_user(sub)]
+
+    def items_json(self, outputs: list[dict[str, dict[str, str]]]) -> bytes:
+        """Serialize raw items as a JSON list of `DynamoDbItem`, without validating them
+
+        The data was serialized by the model when written, so it is copied as it is.
+        """
+        return (
+            b"["
+            + b",".join(
+                b'{"id":'
+                + dumps(data[self._secondary_index]["S"]).encode()
+                + b',"user_id":'
+                + dumps(data["userId"]["S"]).encode()
+                + b',"data":'
+                + data["data"]["S"].encode()
+                + b"}"
+                for data in outputs
+            )
+            + b"]"
+        )
+
+    @timed("DynamoDb")
+    def get_items_json_for_user(self, sub: str) -> bytes:
+        """Get all items of a user, as JSON bytes to send with `RawJSONResponse`
+
+        Returns:
+            bytes: The items, serialized like `get_items_for_user` would be.
+        """
+        return self.items_json(self._scan_user(sub))
 
     def __del__(self) -> None:
         """Cleanup"""
@@ -174,23 +288,37 @@ def prepare_get_user_item(
     item_type: Type[T],
     secondary_key: str = "id",
     table_name: str | None = None,
-) -> Callable[[Request, str], UserItem[T]]:
-    """Get user and item dependency"""
+) -> "Callable[[Request, str], Awaitable[UserItem[T]]]":
+    """Get user and item dependency
+
+    The user is authenticated by Cognito before the table is read, \
+    so the requests with a forged token never reach it.
+    """
+    # pylint: disable=import-outside-toplevel
+    from fastapi import Query, Request  # noqa: PLC0415
+    from fastapi.concurrency import run_in_threadpool  # noqa: PLC0415
+    from .cognito import get_user_from_request  # noqa: PLC0415
 
     dynamodb: DynamoDb[T] = DynamoDb(
         value_type=item_type, secondary_index=secondary_key, table_name=table_name
     )
 
-    def get_user_item(
+    async def get_user_item(
         request: Request,
         id: str = Query(...),  # pylint: disable=redefined-builtin
     ) -> UserItem[T]:
         """Get user and item"""
-        user = get_user_from_request(request)
-        item = dynamodb.get_item(item_id=id, sub=user["sub"])
+        user = await run_in_threadpool(get_user_from_request, request)
+        item = await run_in_threadpool(dynamodb.get_item, id, user["sub"])
         return {"user": user, "item": item, "db": dynamodb}
 
     return get_user_item
 
 
-__all__ = ["DynamoDb", "DynamoDbItem", "T", "prepare_get_user_item"]
+__all__ = [
+    "DynamoDb",
+    "DynamoDbItem",
+    "T",
+    "prepare_get_user_item",
+    "add_write_listener",
+]
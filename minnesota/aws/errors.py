@@ -0,0 +1,11 @@
+"""Errors"""
+
+
+def http_error(status_code: int, detail: str) -> Exception:
+    """Get an HTTPException, importing fastapi only when there is an error to raise"""
+    from fastapi import HTTPException  # noqa: PLC0415 # pylint: disable=import-outside-toplevel
+
+    return HTTPException(status_code=status_code, detail=detail)
+
+
+__all__ = ("http_error",)
@@ -1 +1,384 @@
-"""Lambdas"""
+"""Lambdas
+
+Serve a minnesota app from AWS Lambda, behind API Gateway (REST or HTTP APIs) \
+or a function URL. The app, the routes, the secrets and the clients are prepared \
+in the init phase, and reused by the warm invocations.
+
+Use `minnesota.aws.lambdas.handler` as the handler, with the routes in `ROUTES_FOLDERS`, \
+or a handler of your own:
+```python
+from minnesota.aws.lambdas import LambdaHandler
+
+handler = LambdaHandler()
+```
+
+Invoke it locally with recorded events:
+```sh
+python -m minnesota.aws.lambdas event.json --routes-folder routes
+```
+"""
+
+from asyncio import (
+    AbstractEventLoop,
+    Event,
+    Future,
+    Queue,
+    all_tasks,
+    current_task,
+    gather,
+    new_event_loop,
+)
+from atexit import register
+from base64 import b64decode, b64encode
+from json import dumps, loads
+from os import environ, pathsep
+from pathlib import Path
+from time import perf_counter
+from typing import TYPE_CHECKING, Any
+from urllib.parse import urlencode
+from ..logs import logger
+from .clients import client
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import Callable
+    from starlette.types import ASGIApp, Message, Scope
+
+# Sent as they are, the others base64 encoded
+TEXT_TYPES: tuple[str, ...] = (
+    "text/",
+    "application/json",
+    "application/xml",
+    "application/javascript",
+    "application/x-www-form-urlencoded",
+)
+
+# Scheduled events that only keep the function warm
+WARMUP_SOURCES: tuple[str, ...] = ("aws.events", "serverless-plugin-warmup")
+
+
+def _elapsed_ms(started: float) -> float:
+    """Get the milliseconds since a perf_counter"""
+    return round((perf_counter() - started) * 1000, 3)
+
+
+def event_kind(event: dict[str, Any]) -> str:
+    """Get the kind of an event: `v1` for REST APIs, `v2` for HTTP APIs, \
+    `url` for function URLs, or `warmup`"""
+    if event.get("version") == "2.0" and "http" in event.get("requestContext", {}):
+        domain: str = event["requestContext"].get("domainName", "")
+        return "url" if ".lambda-url." in domain else "v2"
+    if "httpMethod" in event:
+        return "v1"
+    if event.get("source") in WARMUP_SOURCES:
+        return "warmup"
+    raise ValueError("Not an API Gateway or function URL event")
+
+
+def to_scope(  # pylint: disable=too-many-locals
+    event: dict[str, Any], context: Any = None
+) -> tuple["Scope", bytes]:
+    """Get the ASGI scope and the body of an API Gateway or function URL event"""
+    kind: str = event_kind(event)
+    headers: list[tuple[bytes, bytes]] = []
+    request_context: dict[str, Any] = event.get("requestContext") or {}
+    if kind == "v1":
+        method: str = event["httpMethod"]
+        path: str = event.get("path") or "/"
+        multi_headers: dict[str, list[str]] = event.get("multiValueHeaders") or {
+            name: [value] for name, value in (event.get("headers") or {}).items()
+        }
+        for name, values in multi_headers.items():
+            headers += [(name.lower().encode(), value.encode()) for value in values]
+        query: str = urlencode(
+            event.get("multiValueQueryStringParameters")
+            or event.get("queryStringParameters")
+            or {},
+            doseq=True,
+        )
+        source_ip: str = request_context.get("identity", {}).get("sourceIp", "")
+    else:
+        method = request_context["http"]["method"]
+        path = event.get("rawPath") or "/"
+        stage: str = request_context.get("stage", "$default")
+        if stage != "$default" and path.startswith(f"/{stage}/"):
+            path = path[len(stage) + 1 :]
+        for name, value in (event.get("headers") or {}).items():
+            headers.append((name.lower().encode(), value.encode()))
+        if event.get("cookies"):
+            headers.append((b"cookie", "; ".join(event["cookies"]).encode()))
+        query = event.get("rawQueryString", "")
+        source_ip = request_context["http"].get("sourceIp", "")
+    host: str = next((v.decode() for k, v in headers if k == b"host"), "localhost")
+    proto: str = next((v.decode() for k, v in headers if k == b"x-forwarded-proto"), "https")
+    body: bytes = (event.get("body") or "").encode()
+    if event.get("isBase64Encoded"):
+        body = b64decode(body)
+    scope: "Scope" = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.3"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": proto,
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": headers,
+        "client": (source_ip, 0),
+        "server": (host, 443 if proto == "https" else 80),
+        "aws.event": event,
+        "aws.context": context,
+    }
+    return scope, body
+
+
+def to_response(
+    event: dict[str, Any],
+    status: int,
+    headers: list[tuple[bytes, bytes]],
+    body: bytes,
+) -> dict[str, Any]:
+    """Get the Lambda response to an event"""
+    content_type: str = next(
+        (v.decode() for k, v in headers if k.lower() == b"content-type"), ""
+    )
+    binary: bool = any(k.lower() == b"content-encoding" for k, _ in headers) or (
+        bool(body) and not content_type.startswith(TEXT_TYPES)
+    )
+    response: dict[str, Any] = {
+        "statusCode": status,
+        "body": b64encode(body).decode() if binary else body.decode("utf-8"),
+        "isBase64Encoded": binary,
+    }
+    if event_kind(event) == "v1":
+        multi_headers: dict[str, list[str]] = {}
+        for name, value in headers:
+            multi_headers.setdefault(name.decode(), []).append(value.decode())
+        response["multiValueHeaders"] = multi_headers
+        return response
+    joined: dict[str, str] = {}
+    cookies: list[str] = []
+    for name, value in headers:
+        if name.lower() == b"set-cookie":
+            cookies.append(value.decode())
+        elif name.decode() in joined:
+            joined[name.decode()] += "," + value.decode()
+        else:
+            joined[name.decode()] = value.decode()
+    response["headers"] = joined
+    if cookies:
+        response["cookies"] = cookies
+    return response
+
+
+class LambdaHandler:
+    """A Lambda handler serving an ASGI app.
+
+    Created in the init phase, it imports the app, loads the secrets, discovers \
+    the routes, creates the clients in `LAMBDA_WARM_CLIENTS` (comma separated, \
+    `dynamodb,s3` by default) and runs the startup of the app. The event loop \
+    and the app are kept for the warm invocations.
+
+    `timings` holds the milliseconds of every step of the cold start.
+    """
+
+    app: "ASGIApp"
+    timings: dict[str, float]
+    cold: bool
+    _loop: AbstractEventLoop
+    _lifespan: "Queue[Message]"
+    _state: dict[str, Any]
+
+    def __init__(self, app_factory: "Callable[[], ASGIApp] | None" = None) -> None:
+        """Initialize the handler
+
+        Args:
+            app_factory (Callable[[], ASGIApp] | None, optional): Creates the app. \
+                Defaults to `create_app`, with the routes in `ROUTES_FOLDERS`.
+        """
+        started: float = perf_counter()
+        self.timings = {}
+        self.cold = True
+        step: float = perf_counter()
+        if app_factory is None:
+            # Timed, as it is most of the cold start
+            from ..api.app import create_app  # noqa: PLC0415 # pylint: disable=import-outside-toplevel
+
+            app_factory = create_app
+        self.timings["imports_ms"] = _elapsed_ms(step)
+
+        step = perf_counter()
+        if environ.get("SECRET_NAME") and not environ.get("SECRETS_LOADED"):
+            from .secrets import load_secrets  # noqa: PLC0415 # pylint: disable=import-outside-toplevel
+
+            load_secrets(refresh=False)
+        self.timings["secrets_ms"] = _elapsed_ms(step)
+
+        step = perf_counter()
+        self.app = app_factory()
+        lazy_routes = getattr(getattr(self.app, "state", None), "lazy_routes", None)
+        if lazy_routes is not None:
+            lazy_routes.ready.wait()
+        self.timings["app_ms"] = _elapsed_ms(step)
+
+        step = perf_counter()
+        for service in environ.get("LAMBDA_WARM_CLIENTS", "dynamodb,s3").split(","):
+            if service.strip():
+                client(service.strip())  # type: ignore[call-overload]
+        self.timings["clients_ms"] = _elapsed_ms(step)
+
+        step = perf_counter()
+        self._loop = new_event_loop()
+        self._state = {}
+        self._lifespan = Queue()
+        self._loop.run_until_complete(self._startup())
+        register(self.close)
+        self.timings["startup_ms"] = _elapsed_ms(step)
+        self.timings["total_ms"] = _elapsed_ms(started)
+        logger.info("Cold start: %s", dumps(self.timings))
+
+    async def _startup(self) -> None:
+        """Run the startup of the app, leaving its lifespan waiting for the shutdown"""
+        started: Future[bool] = self._loop.create_future()
+
+        async def _receive() -> "Message":
+            return await self._lifespan.get()
+
+        async def _send(message: "Message") -> None:
+            if message["type"] == "lifespan.startup.complete" and not started.done():
+                started.set_result(True)
+            elif message["type"] == "lifespan.startup.failed" and not started.done():
+                started.set_exception(RuntimeError(message.get("message", "Startup failed")))
+
+        async def _run() -> None:
+            try:
+                await self.app(
+                    {"type": "lifespan", "asgi": {"version": "3.0"}, "state": self._state},
+                    _receive,
+                    _send,
+                )
+            except Exception:  # pylint: disable=broad-except
+                # Apps without a lifespan
+                pass
+            if not started.done():
+                started.set_result(False)
+
+        self._loop.create_task(_run())
+        await self._lifespan.put({"type": "lifespan.startup"})
+        await started
+
+    def close(self) -> None:
+        """Run the shutdown of the app, like writing the buffered items"""
+        if self._loop.is_closed():
+            return
+        self._loop.run_until_complete(self._lifespan.put({"type": "lifespan.shutdown"}))
+        # Let the lifespan run its shutdown
+        self._loop.run_until_complete(self._drain())
+        self._loop.close()
+
+    async def _drain(self) -> None:
+        """Wait for the tasks still running"""
+        tasks = [task for task in all_tasks(self._loop) if task is not current_task()]
+        await gather(*tasks, return_exceptions=True)
+
+    async def _call(self, scope: "Scope", body: bytes) -> tuple[int, list[Any], bytes]:
+        """Run a request through the app"""
+        status: int = 500
+        headers: list[tuple[bytes, bytes]] = []
+        chunks: list[bytes] = []
+        done: Event = Event()
+        received: bool = False
+
+        async def _receive() -> "Message":
+            nonlocal received
+            if not received:
+                received = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await done.wait()
+            return {"type": "http.disconnect"}
+
+        async def _send(message: "Message") -> None:
+            nonlocal status, headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    done.set()
+
+        try:
+            await self.app({**scope, "state": dict(self._state)}, _receive, _send)
+        finally:
+            done.set()
+        return status, headers, b"".join(chunks)
+
+    def __call__(self, event: dict[str, Any], context: Any = None) -> dict[str, Any]:
+        """Handle an invocation"""
+        started: float = perf_counter()
+        if event_kind(event) == "warmup":
+            return {"warm": True}
+        scope, body = to_scope(event, context)
+        status, headers, content = self._loop.run_until_complete(self._call(scope, body))
+        if self.cold:
+            self.cold = False
+            logger.info(
+                "First invocation in %.3f ms, after a cold start of %.3f ms",
+                _elapsed_ms(started),
+                self.timings["total_ms"],
+            )
+        return to_response(event, status, headers, content)
+
+
+_handlers: list[LambdaHandler] = []
+
+
+def get_handler() -> LambdaHandler:
+    """Get the handler of `create_app`, created once"""
+    if not _handlers:
+        _handlers.append(LambdaHandler())
+    return _handlers[0]
+
+
+def __getattr__(name: str) -> Any:
+    """Create `handler` on first access, that the Lambda runtime does in the init phase"""
+    if name == "handler":
+        return get_handler()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def main() -> None:
+    """Invoke the handler with recorded events"""
+    from argparse import ArgumentParser  # noqa: PLC0415 # pylint: disable=import-outside-toplevel
+
+    parser = ArgumentParser(description="Invoke the Lambda handler with event files")
+    parser.add_argument("events", nargs="+", type=Path, help="Event JSON files")
+    parser.add_argument("--routes-folder", action="append", default=[], dest="routes")
+    parser.add_argument("--repeat", type=int, default=1, help="Invocations of every event")
+    args = parser.parse_args()
+    if args.routes:
+        # Relative to the working directory, like for `python -m minnesota`
+        environ["ROUTES_FOLDERS"] = pathsep.join(args.routes)
+    handler: LambdaHandler = get_handler()
+    print(dumps({"cold_start": handler.timings}))
+    for event_file in args.events:
+        event: dict[str, Any] = loads(event_file.read_text(encoding="utf-8"))
+        for _ in range(args.repeat):
+            started: float = perf_counter()
+            response: dict[str, Any] = handler(event)
+            print(
+                dumps({"event": str(event_file), "ms": _elapsed_ms(started), "response": response})
+            )
+    handler.close()
+
+
+__all__ = (
+    "LambdaHandler",
+    "event_kind",
+    "get_handler",
+    "to_response",
+    "to_scope",
+)
+
+if __name__ == "__main__":
+    main()
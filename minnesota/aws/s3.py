@@ -3,18 +3,22 @@
 from io import BytesIO, StringIO
 from os import environ
 from contextlib import suppress
-from typing import Union, cast, Literal, overload
+from typing import IO, TYPE_CHECKING, Union, cast, Literal, overload
 from zipfile import ZipFile
-from fastapi import HTTPException
-from .clients import client
+from ..utils.metrics import timed
+from .storage import S3Backend, StorageBackend, get_backend
 
-with suppress(ImportError):
+if TYPE_CHECKING:  # pragma: no cover
     from boto3_type_annotations.s3 import Client as S3Client
+    from .storage import Source
 
 
-class S3Zip:
+class S3Zip:  # pylint: disable=too-many-instance-attributes
     """Common utilities for S3.
 
+    The archives are in S3, or in a local folder with `STORAGE_BACKEND=local` \
+    or another `backend`.
+
     Example:
     ```python
     with S3("testId/test1.zip") as s3:
@@ -23,57 +27,96 @@ class S3Zip:
     ```
     """
 
-    s3: "S3Client"
+    backend: StorageBackend
     key: str
+    bucket_name: Union[str, None]
     _buffer: BytesIO
-    _files: list[tuple[str, BytesIO]]
+    # None until read from the archive
+    _files: list[tuple[str, Union[BytesIO, None]]]
+    _source: "Source | None"
+    _archive: Union[ZipFile, None]
+    _size: int
 
-    def __init__(self, key: str, bucket_name: Union[str, None] = None) -> None:
+    def __init__(
+        self,
+        key: str,
+        bucket_name: Union[str, None] = None,
+        backend: Union[StorageBackend, None] = None,
+    ) -> None:
         """Initialize the S3 object.
 
         Args:
+            key (str): The key of the archive.
             bucket_name (str): The name of the bucket.
+            backend (StorageBackend | None, optional): Where the archive is. \
+                Defaults to the one set by `STORAGE_BACKEND`.
         """
         self.key = key
         if bucket_name is None:
             bucket_name = environ.get("S3_BUCKET_NAME")
-        if bucket_name is None:
-            raise HTTPException(status_code=500, detail="S3_BUCKET_NAME not set")
         self.bucket_name = bucket_name
+        self.backend = backend or get_backend(bucket_name)
         self._buffer = BytesIO()
         self._files = []
-        self.s3 = client("s3")
+        self._source = None
+        self._archive = None
+        self._size = 0
 
+    @property
+    def s3(self) -> "S3Client":
+        """The S3 client, with the S3 backend"""
+        if not isinstance(self.backend, S3Backend):
+            raise AttributeError("No S3 client with a local backend")
+        return self.backend.s3
+
+    @timed("S3Zip")
     def delete_object(self) -> None:
         """Delete a bucket."""
-        self.s3.delete_object(Bucket=self.bucket_name, Key=self.key)
+        self.backend.delete(self.key)
 
+    @timed("S3Zip")
     def download(self) -> None:
         """Download a file from S3."""
-        self._buffer = BytesIO()
-        value: bytes = cast(
-            BytesIO,
-            self.s3.get_object(
-                Bucket=self.bucket_name,
-                Key=self.key,
-            )["Body"],
-        ).read()
-        self._buffer.write(value)
+        self._close()
+        self._source = self.backend.open(self.key)
+        self._source.seek(0, 2)
+        self._size = self._source.tell()
+        self._source.seek(0)
 
     def unzip(self) -> None:
-        """Unzip a file from S3."""
-        with ZipFile(self._buffer, "r") as zip_obj:
-            for filename in zip_obj.namelist():
-                self._files.append((filename, BytesIO(zip_obj.read(filename))))
-
+        """Unzip a file from S3, reading the files only when asked for."""
+        if self._source is None:
+            return
+        # Closed with the source, by _close
+        self._archive = ZipFile(  # pylint: disable=consider-using-with
+            cast(IO[bytes], self._source), "r"
+        )
+        for filename in self._archive.namelist():
+            self._files.append((filename, None))
+
+    def _load(self, index: int) -> BytesIO:
+        """Read a file from the archive, once"""
+        filename, file_buffer = self._files[index]
+        if file_buffer is None:
+            if self._archive is None:
+                raise FileNotFoundError(filename)
+            file_buffer = BytesIO(self._archive.read(filename))
+            self._files[index] = (filename, file_buffer)
+        return file_buffer
+
+    def _close(self) -> None:
+        """Close the archive read"""
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+        if self._source is not None:
+            self._source.close()
+            self._source = None
+
+    @timed("S3Zip")
     def upload(self) -> None:
         """Upload a file to S3."""
-        data = self._buffer.getvalue()
-        self.s3.put_object(
-            Bucket=self.bucket_name,
-            Key=self.key,
-            Body=data,
-        )
+        self.backend.write(self.key, self._buffer.getvalue())
 
     def zip(self) -> None:
         """Zip a file."""
@@ -82,11 +125,12 @@ class S3Zip:
             buffer,
             "w",
         ) as zip_obj:
-            for filename, file_buffer in self._files:
-                zip_obj.writestr(filename, file_buffer.getvalue())
+            for i, (filename, _) in enumerate(self._files):
+                zip_obj.writestr(filename, self._load(i).getvalue())
 
-        self._buffer = BytesIO()
-        self._buffer.write(buffer.getvalue())
+        self._close()
+        self._buffer = buffer
+        self._size = len(buffer.getbuffer())
 
     def __enter__(self) -> "S3Zip":
         """Enter the context."""
@@ -125,11 +169,11 @@ class S3Zip:
         encoding: Union[Literal["utf-8"], None] = None,
     ) -> Union[BytesIO, StringIO]:
         """Read a file from the zip file"""
-        for file in self._files:
+        for i, file in enumerate(self._files):
             if file[0] == filename:
                 if encoding:
-                    return StringIO(file[1].read().decode(encoding))
-                return file[1]
+                    return StringIO(self._load(i).read().decode(encoding))
+                return self._load(i)
         raise FileNotFoundError
 
     def file_exists(self, filename: str) -> bool:
@@ -142,17 +186,12 @@ class S3Zip:
     @property
     def exists(self) -> bool:
         """Check if the file exists."""
-        # pylint: disable=broad-except
-        try:
-            self.s3.head_object(Bucket=self.bucket_name, Key=self.key)
-            return True
-        except Exception:
-            return False
+        return self.backend.exists(self.key)
 
     @property
     def empty(self) -> bool:
         """Check if the file is empty."""
-        return len(self._buffer.getvalue()) == 0
+        return self._size == 0
 
 
 __all__ = ("S3Zip",)
@@ -1,21 +1,284 @@
 """Secretsmanager"""
 
-from os import environ
-from json import loads
+from concurrent.futures import ThreadPoolExecutor
+from json import dumps, loads
+from os import O_CREAT, O_TRUNC, O_WRONLY, environ, fdopen, open as os_open, replace
+from pathlib import Path
+from random import uniform
+from stat import S_IMODE
+from threading import Event, Lock, Thread
+from time import time
+from typing import Any, Callable, TypeVar
+from ..logs import logger
 from .clients import client
 
+V = TypeVar("V")
 
-def load_secrets() -> None:
-    """Load secrets from secretsmanager"""
-    secretname: str | None = environ.get("SECRET_NAME")
-    if secretname is None:
-        raise KeyError("SECRET_NAME not set")
-    secrets: dict[str, str] = client("secretsmanager").get_secret_value(
-        SecretId=secretname
-    )
-    secrets = loads(secrets["SecretString"])
-    for key, value in secrets.items():
-        environ[key] = value
+SNAPSHOT_MODE: int = 0o600
+TRUE_VALUES: tuple[str, ...] = ("1", "true", "yes", "on")
 
+_MISSING: object = object()
 
-__all__ = ["load_secrets"]
+
+class SecretsCache:  # pylint: disable=too-many-instance-attributes
+    """Secrets of one or more Secrets Manager secrets, kept in memory.
+
+    The secrets are written to `environ` too, for the code that reads them from there. \
+    With a snapshot file, a process starting while the snapshot is younger than the TTL \
+    reads it instead of calling Secrets Manager. With a TTL, a background thread \
+    fetches the secrets again, so rotated values are picked up without a restart.
+
+    Example:
+    ```python
+    secrets = get_secrets()
+    secrets.load()
+    secrets.start()
+    timeout = secrets.get_int("TIMEOUT", 30)
+    ```
+    """
+
+    names: list[str]
+    ttl: float
+    snapshot: Path | None
+    fetched_at: float
+    _values: dict[str, str]
+    _parsed: dict[tuple[str, Callable[[str], Any]], Any]
+    _lock: Lock
+    _stop: Event
+    _thread: Thread | None
+
+    def __init__(
+        self,
+        names: list[str],
+        ttl: float = 3600,
+        snapshot: str | Path | None = None,
+    ) -> None:
+        """Initialize the cache
+
+        Args:
+            names (list[str]): The secrets, merged in order.
+            ttl (float, optional): Seconds between refreshes, and max age of \
+                the snapshot. 0 disables both. Defaults to 3600.
+            snapshot (str | Path | None, optional): The snapshot file, readable \
+                only by the owner. Defaults to None.
+        """
+        self.names = names
+        self.ttl = ttl
+        self.snapshot = Path(snapshot) if snapshot else None
+        self.fetched_at = 0.0
+        self._values = {}
+        self._parsed = {}
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+
+    @classmethod
+    def from_env(cls) -> "SecretsCache":
+        """Get the cache configured by `SECRET_NAME` (comma separated), `SECRETS_TTL` \
+        and `SECRETS_SNAPSHOT`"""
+        names: str | None = environ.get("SECRET_NAME")
+        if names is None:
+            raise KeyError("SECRET_NAME not set")
+        return cls(
+            names=[name.strip() for name in names.split(",") if name.strip()],
+            ttl=float(environ.get("SECRETS_TTL", "3600")),
+            snapshot=environ.get("SECRETS_SNAPSHOT") or None,
+        )
+
+    def _fetch(self) -> dict[str, str]:
+        """Get the secrets from Secrets Manager, all the names at once"""
+        secretsmanager = client("secretsmanager")
+
+        def _get(name: str) -> dict[str, str]:
+            value: dict[str, str] = loads(
+                secretsmanager.get_secret_value(SecretId=name)["SecretString"]
+            )
+            return value
+
+        if len(self.names) == 1:
+            return _get(self.names[0])
+        values: dict[str, str] = {}
+        with ThreadPoolExecutor(max_workers=len(self.names)) as executor:
+            for secret in executor.map(_get, self.names):
+                values.update(secret)
+        return values
+
+    def _read_snapshot(self) -> dict[str, str] | None:
+        """Read the snapshot, if fresh and not readable by others"""
+        if self.snapshot is None or self.ttl <= 0:
+            return None
+        try:
+            if S_IMODE(self.snapshot.stat().st_mode) & ~SNAPSHOT_MODE:
+                logger.warning("Ignoring %s, readable by others", self.snapshot)
+                return None
+            data: dict[str, Any] = loads(self.snapshot.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if data.get("names") != self.names or time() - data["fetched_at"] >= self.ttl:
+            return None
+        self.fetched_at = float(data["fetched_at"])
+        values: dict[str, str] = data["values"]
+        return values
+
+    def _write_snapshot(self) -> None:
+        """Write the snapshot atomically, readable only by the owner"""
+        if self.snapshot is None:
+            return
+        self.snapshot.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file: Path = self.snapshot.with_suffix(self.snapshot.suffix + ".tmp")
+        with fdopen(
+            os_open(tmp_file, O_WRONLY | O_CREAT | O_TRUNC, SNAPSHOT_MODE),
+            "w",
+            encoding="utf-8",
+        ) as file:
+            file.write(
+                dumps(
+                    {
+                        "names": self.names,
+                        "fetched_at": self.fetched_at,
+                        "values": self._values,
+                    }
+                )
+            )
+        replace(tmp_file, self.snapshot)
+
+    def _set(self, values: dict[str, str]) -> None:
+        """Replace the secrets"""
+        with self._lock:
+            self._values = values
+            self._parsed = {}
+        for key, value in values.items():
+            environ[key] = value
+
+    def load(self) -> None:
+        """Load the secrets from a fresh snapshot, or else from Secrets Manager"""
+        values = self._read_snapshot()
+        if values is not None:
+            logger.debug("Secrets loaded from %s", self.snapshot)
+            self._set(values)
+            return
+        self.refresh()
+
+    def inherit(self) -> None:
+        """Take the secrets loaded by the parent process, as the time they were \
+        fetched at is in `SECRETS_LOADED`, so the first refresh waits for the TTL"""
+        if self.fetched_at:
+            return
+        try:
+            self.fetched_at = float(environ.get("SECRETS_LOADED", ""))
+        except ValueError:
+            # No time recorded: as fresh as can be told
+            self.fetched_at = time()
+
+    def refresh(self) -> None:
+        """Get the secrets from Secrets Manager, and update the snapshot"""
+        values = self._fetch()
+        self.fetched_at = time()
+        self._set(values)
+        try:
+            self._write_snapshot()
+        except OSError as exc:
+            logger.warning("Could not write the secrets snapshot: %s", exc)
+
+    def _run(self) -> None:
+        """Refresh the secrets every TTL, until stopped"""
+        # pylint: disable=broad-except
+        # A snapshot is already as old as it is, so the first refresh may come sooner
+        delay: float = max(0.0, self.fetched_at + self.ttl - time())
+        # Jitter, so the workers of a server do not refresh all at once
+        while not self._stop.wait(delay * uniform(0.9, 1.0)):  # nosec
+            try:
+                self.refresh()
+            except Exception as exc:
+                logger.warning("Could not refresh the secrets, keeping the old ones: %s", exc)
+            delay = self.ttl
+
+    def start(self) -> None:
+        """Refresh the secrets in a background thread, if there is a TTL"""
+        if self.ttl <= 0 or self._thread is not None:
+            return
+        self._thread = Thread(target=self._run, name="secrets-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop refreshing the secrets"""
+        self._stop.set()
+        self._thread = None
+
+    def get(self, key: str, default: str | None = None) -> str | None:
+        """Get a secret, or an environment variable if no secret has that name"""
+        value: str | None = self._values.get(key)
+        if value is None:
+            value = environ.get(key, default)
+        return value
+
+    def require(self, key: str) -> str:
+        """Get a secret, raising a KeyError if not set"""
+        value: str | None = self.get(key)
+        if value is None:
+            raise KeyError(f"{key} not set")
+        return value
+
+    def _get_parsed(self, key: str, parse: Callable[[str], V], default: V) -> V:
+        """Get a secret parsed, caching the parsed value until the next refresh"""
+        parsed = self._parsed.get((key, parse), _MISSING)
+        if parsed is not _MISSING:
+            return parsed  # type: ignore[no-any-return]
+        value: str | None = self.get(key)
+        if value is None:
+            return default
+        result: V = parse(value)
+        self._parsed[(key, parse)] = result
+        return result
+
+    def get_int(self, key: str, default: int = 0) -> int:
+        """Get a secret as an int"""
+        return self._get_parsed(key, int, default)
+
+    def get_float(self, key: str, default: float = 0.0) -> float:
+        """Get a secret as a float"""
+        return self._get_parsed(key, float, default)
+
+    def get_bool(self, key: str, default: bool = False) -> bool:
+        """Get a secret as a bool, true for 1, true, yes and on"""
+        return self._get_parsed(key, _parse_bool, default)
+
+    def get_json(self, key: str, default: Any = None) -> Any:
+        """Get a secret holding JSON"""
+        return self._get_parsed(key, loads, default)
+
+
+def _parse_bool(value: str) -> bool:
+    """Parse a bool"""
+    return value.lower().strip() in TRUE_VALUES
+
+
+_caches: dict[str, SecretsCache] = {}
+_caches_lock: Lock = Lock()
+
+
+def get_secrets() -> SecretsCache:
+    """Get the secrets cache of the process, configured by the environment"""
+    with _caches_lock:
+        names: str = environ.get("SECRET_NAME", "")
+        if names not in _caches:
+            _caches[names] = SecretsCache.from_env()
+        return _caches[names]
+
+
+def load_secrets(refresh: bool = True) -> None:
+    """Load secrets from secretsmanager
+
+    Args:
+        refresh (bool, optional): Keep refreshing them in the background, \
+            every `SECRETS_TTL` seconds. Defaults to True.
+    """
+    secrets: SecretsCache = get_secrets()
+    secrets.load()
+    # Read back by the workers, that inherit the secrets in their environment
+    environ["SECRETS_LOADED"] = repr(secrets.fetched_at)
+    if refresh:
+        secrets.start()
+
+
+__all__ = ["load_secrets", "get_secrets", "SecretsCache"]
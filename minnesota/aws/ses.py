@@ -1 +1,360 @@
 """SES"""
+
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from json import dumps
+from logging import Logger, getLogger
+from os import environ
+from queue import Full
+from random import uniform
+from threading import BoundedSemaphore, Condition, Lock
+from time import monotonic, sleep
+from typing import TYPE_CHECKING, Any
+from .clients import client
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import NotRequired, TypedDict
+    from boto3_type_annotations.ses import Client as SESClient
+
+    class Recipient(TypedDict):
+        """A recipient of a bulk send"""
+
+        to: str | list[str]
+        data: NotRequired[dict[str, Any]]
+
+    class CampaignResult(TypedDict):
+        """Outcome of a bulk send"""
+
+        sent: int
+        failed: int
+        message_ids: list[str]
+        # Address and status, or error, of the failed sends
+        failures: list[tuple[str, str]]
+
+
+# Max destinations of a SendBulkTemplatedEmail call
+CHUNK_SIZE: int = 50
+MAX_ATTEMPTS: int = 6
+
+# The api logger, without importing minnesota.logs and fastapi with it
+logger: Logger = getLogger("api")
+
+# Statuses and error codes worth sending again
+RETRY_STATUSES: tuple[str, ...] = (
+    "AccountThrottled",
+    "TransientFailure",
+    "Throttling",
+    "ThrottlingException",
+    "ServiceUnavailable",
+)
+
+
+class TokenBucket:  # pylint: disable=too-few-public-methods
+    """Rate limiter shared by threads, allowing `rate` tokens per second \
+    and bursts of `burst` tokens"""
+
+    rate: float
+    burst: float
+    _tokens: float
+    _updated: float
+    _lock: Lock
+
+    def __init__(self, rate: float, burst: float | None = None) -> None:
+        """Initialize the bucket, full"""
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self._tokens = self.burst
+        self._updated = monotonic()
+        self._lock = Lock()
+
+    def acquire(self, tokens: float = 1) -> float:
+        """Take tokens, waiting until they are available
+
+        Returns:
+            float: The seconds waited
+        """
+        with self._lock:
+            now: float = monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Reserved now, so the waiters are served in order
+            self._tokens -= tokens
+            delay: float = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if delay > 0:
+            sleep(delay)
+        return delay
+
+
+class Campaign:
+    """The chunks of a bulk send, sent in the background"""
+
+    futures: "list[Future[CampaignResult]]"
+
+    def __init__(self, futures: "list[Future[CampaignResult]]") -> None:
+        """Initialize the campaign"""
+        self.futures = futures
+
+    def done(self) -> bool:
+        """Check if every chunk was sent, or failed"""
+        return all(future.done() for future in self.futures)
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Wait until every chunk was sent, or failed
+
+        Returns:
+            bool: False on timeout
+        """
+        return not wait(self.futures, timeout).not_done
+
+    def result(self, timeout: float | None = None) -> "CampaignResult":
+        """Wait for the campaign, and get its outcome"""
+        result: "CampaignResult" = {"sent": 0, "failed": 0, "message_ids": [], "failures": []}
+        for future in self.futures:
+            chunk: "CampaignResult" = future.result(timeout)
+            result["sent"] += chunk["sent"]
+            result["failed"] += chunk["failed"]
+            result["message_ids"] += chunk["message_ids"]
+            result["failures"] += chunk["failures"]
+        return result
+
+
+class BulkEmailSender:  # pylint: disable=too-many-instance-attributes
+    """Send templated emails in chunks of 50 recipients, from a bounded pool of threads, \
+    no faster than the send rate of the account.
+
+    Example:
+    ```python
+    sender = BulkEmailSender("news@example.com", "Newsletter")
+    campaign = sender.enqueue(
+        [{"to": "a@example.com", "data": {"name": "A"}}], default_data={"name": "you"}
+    )
+    print(campaign.result())
+    ```
+    """
+
+    source: str
+    template: str
+    configuration_set: str | None
+    capacity: int
+    ses: "SESClient"
+    _bucket: TokenBucket
+    _pool: ThreadPoolExecutor
+    _slots: BoundedSemaphore
+    _freed: Condition
+
+    def __init__(  # noqa: PLR0913, PLR0917
+        # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        source: str,
+        template: str,
+        rate: float | None = None,
+        max_workers: int = 8,
+        max_queue: int = 2000,
+        configuration_set: str | None = None,
+    ) -> None:
+        """Initialize the sender
+
+        Args:
+            source (str): The sender address.
+            template (str): The SES template.
+            rate (float | None, optional): Emails per second. \
+                Defaults to the MaxSendRate of the account.
+            max_workers (int, optional): Chunks sent at once. Defaults to 8.
+            max_queue (int, optional): Chunks waiting to be sent, past which \
+                `enqueue` blocks or raises `queue.Full`. Defaults to 2000.
+            configuration_set (str | None, optional): The configuration set. \
+                Defaults to None.
+        """
+        self.source = source
+        self.template = template
+        self.configuration_set = configuration_set
+        self.ses = client("ses")
+        if rate is None:
+            rate = float(self.ses.get_send_quota()["MaxSendRate"])
+        self._bucket = TokenBucket(rate)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ses")
+        # Chunks sent or waiting to be sent at once
+        self.capacity = max_workers + max_queue
+        self._slots = BoundedSemaphore(self.capacity)
+        self._freed = Condition()
+
+    def _call(self, chunk: "list[Recipient]", default_data: str, template: str) -> Any:
+        """Send a chunk, once"""
+        kwargs: dict[str, Any] = {}
+        if self.configuration_set is not None:
+            kwargs["ConfigurationSetName"] = self.configuration_set
+        return self.ses.send_bulk_templated_email(
+            Source=self.source,
+            Template=template,
+            DefaultTemplateData=default_data,
+            Destinations=[
+                {
+                    "Destination": {
+                        "ToAddresses": [recipient["to"]]
+                        if isinstance(recipient["to"], str)
+                        else recipient["to"]
+                    },
+                    "ReplacementTemplateData": dumps(recipient.get("data", {})),
+                }
+                for recipient in chunk
+            ],
+            **kwargs,
+        )
+
+    def send_chunk(
+        self,
+        chunk: "list[Recipient]",
+        default_data: str = "{}",
+        template: str | None = None,
+    ) -> "CampaignResult":
+        """Send up to 50 recipients, retrying the throttled ones with backoff"""
+        result: "CampaignResult" = {"sent": 0, "failed": 0, "message_ids": [], "failures": []}
+        pending: "list[Recipient]" = chunk
+        for attempt in range(MAX_ATTEMPTS):
+            self._bucket.acquire(len(pending))
+            retry: "list[Recipient]" = []
+            try:
+                statuses = self._call(pending, default_data, template or self.template)["Status"]
+            except Exception as exc:  # pylint: disable=broad-except
+                code: str = getattr(exc, "response", {}).get("Error", {}).get("Code", "")
+                if code not in RETRY_STATUSES:
+                    result["failed"] += len(pending)
+                    result["failures"] += [(str(r["to"]), code or str(exc)) for r in pending]
+                    return result
+                retry = pending
+            else:
+                for recipient, status in zip(pending, statuses, strict=False):
+                    outcome: str = status.get("Status", "Success")
+                    if outcome == "Success":
+                        result["sent"] += 1
+                        result["message_ids"].append(status.get("MessageId", ""))
+                    elif outcome in RETRY_STATUSES:
+                        retry.append(recipient)
+                    else:
+                        result["failed"] += 1
+                        result["failures"].append((str(recipient["to"]), outcome))
+            if not retry:
+                return result
+            pending = retry
+            # Full jitter, so the workers do not retry all at once
+            sleep(uniform(0, min(20.0, 0.2 * 2**attempt)))  # nosec
+        logger.warning("Could not send %d emails, still throttled", len(pending))
+        result["failed"] += len(pending)
+        result["failures"] += [(str(r["to"]), "Throttled") for r in pending]
+        return result
+
+    def _submit(
+        self,
+        chunk: "list[Recipient]",
+        default_data: str,
+        template: str | None,
+    ) -> "Future[CampaignResult]":
+        """Queue a chunk, with a slot already taken"""
+        try:
+            future = self._pool.submit(self.send_chunk, chunk, default_data, template)
+        except BaseException:
+            self._release(1)
+            raise
+        future.add_done_callback(lambda _: self._release(1))
+        return future
+
+    def _take(self, count: int) -> bool:
+        """Take slots for every chunk of a campaign, or none, without waiting"""
+        for taken in range(count):
+            if not self._slots.acquire(blocking=False):  # pylint: disable=consider-using-with
+                for _ in range(taken):
+                    self._slots.release()
+                return False
+        return True
+
+    def _release(self, count: int) -> None:
+        """Free slots, waking the blocked campaigns"""
+        with self._freed:
+            for _ in range(count):
+                self._slots.release()
+            self._freed.notify_all()
+
+    def enqueue(
+        self,
+        recipients: "list[Recipient]",
+        default_data: dict[str, Any] | None = None,
+        template: str | None = None,
+        block: bool = False,
+    ) -> Campaign:
+        """Queue a bulk send, without waiting for it
+
+        Args:
+            recipients (list[Recipient]): The addresses, with their template data.
+            default_data (dict[str, Any] | None, optional): The template data \
+                of every recipient. Defaults to None.
+            template (str | None, optional): Another template. Defaults to None.
+            block (bool, optional): Wait for room in the queue, instead of \
+                raising `queue.Full`. Defaults to False.
+
+        Raises:
+            ValueError: If the campaign has more chunks than the sender can hold
+            Full: If the queue has no room for every chunk, and not blocking
+
+        Returns:
+            Campaign: The campaign, to wait for
+        """
+        chunks: "list[list[Recipient]]" = [
+            recipients[start : start + CHUNK_SIZE]
+            for start in range(0, len(recipients), CHUNK_SIZE)
+        ]
+        if len(chunks) > self.capacity:
+            # Never enough slots at once, so blocking would wait forever
+            raise ValueError(
+                f"{len(recipients)} recipients exceed the {self.capacity * CHUNK_SIZE} "
+                "a sender can hold"
+            )
+        # All or nothing, so that a campaign is never sent in part, nor holds part
+        # of the slots while waiting: the lock is only held to try, not to wait
+        with self._freed:
+            while not self._take(len(chunks)):
+                if not block:
+                    raise Full("Too many emails queued")
+                self._freed.wait()
+        data: str = dumps(default_data or {})
+        futures: "list[Future[CampaignResult]]" = []
+        for index, chunk in enumerate(chunks):
+            try:
+                futures.append(self._submit(chunk, data, template))
+            except BaseException:
+                # The slots of the chunks not queued yet
+                self._release(len(chunks) - index - 1)
+                raise
+        return Campaign(futures)
+
+    def shutdown(self, wait_sent: bool = True) -> None:
+        """Stop the sender, sending the queued chunks first if waiting"""
+        self._pool.shutdown(wait=wait_sent, cancel_futures=not wait_sent)
+
+
+_senders: dict[tuple[str, str], BulkEmailSender] = {}
+_senders_lock: Lock = Lock()
+
+
+def get_bulk_sender(source: str | None = None, template: str | None = None) -> BulkEmailSender:
+    """Get a sender shared by the process, configured by `SES_SOURCE`, `SES_TEMPLATE`, \
+    `SES_SEND_RATE`, `SES_WORKERS` and `SES_QUEUE_SIZE`"""
+    source = source or environ["SES_SOURCE"]
+    template = template or environ["SES_TEMPLATE"]
+    with _senders_lock:
+        if (source, template) not in _senders:
+            _senders[(source, template)] = BulkEmailSender(
+                source,
+                template,
+                rate=float(environ["SES_SEND_RATE"]) if environ.get("SES_SEND_RATE") else None,
+                max_workers=int(environ.get("SES_WORKERS", "8")),
+                max_queue=int(environ.get("SES_QUEUE_SIZE", "2000")),
+                configuration_set=environ.get("SES_CONFIGURATION_SET") or None,
+            )
+        return _senders[(source, template)]
+
+
+__all__ = (
+    "BulkEmailSender",
+    "Campaign",
+    "TokenBucket",
+    "get_bulk_sender",
+)
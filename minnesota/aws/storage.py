@@ -0,0 +1,160 @@
+"""Storage backends of S3Zip"""
+
+from abc import ABC, abstractmethod
+from contextlib import suppress
+from io import BytesIO
+from mmap import ACCESS_READ, mmap
+from os import environ, fsync, replace, unlink
+from pathlib import Path
+from tempfile import mkstemp
+from typing import IO, TYPE_CHECKING, Union, cast
+from .clients import client
+from .errors import http_error
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import TypeAlias
+    from boto3_type_annotations.s3 import Client as S3Client
+
+    # A seekable, readable archive
+    Source: TypeAlias = Union[IO[bytes], mmap]
+
+
+class MappedFile(mmap):
+    """A read-only memory-mapped file, usable by ZipFile"""
+
+    def seekable(self) -> bool:
+        """Always seekable, as ZipFile asks before Python 3.13 maps have it"""
+        return True
+
+
+class StorageBackend(ABC):
+    """Where the archives of S3Zip are kept"""
+
+    @abstractmethod
+    def open(self, key: str) -> "Source":
+        """Open an archive for reading
+
+        Raises:
+            FileNotFoundError: If there is no archive
+        """
+
+    @abstractmethod
+    def write(self, key: str, data: bytes) -> None:
+        """Write an archive, replacing it"""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Delete an archive, if it exists"""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """Check if an archive exists"""
+
+
+class S3Backend(StorageBackend):
+    """Archives in a S3 bucket"""
+
+    bucket_name: str
+    s3: "S3Client"
+
+    def __init__(self, bucket_name: str) -> None:
+        """Initialize the backend"""
+        self.bucket_name = bucket_name
+        self.s3 = client("s3")
+
+    def open(self, key: str) -> "Source":
+        """Download an archive"""
+        try:
+            response = self.s3.get_object(Bucket=self.bucket_name, Key=key)
+        except Exception as exc:
+            if getattr(exc, "response", {}).get("Error", {}).get("Code") == "NoSuchKey":
+                raise FileNotFoundError(key) from exc
+            raise
+        return BytesIO(cast(BytesIO, response["Body"]).read())
+
+    def write(self, key: str, data: bytes) -> None:
+        """Upload an archive"""
+        self.s3.put_object(Bucket=self.bucket_name, Key=key, Body=data)
+
+    def delete(self, key: str) -> None:
+        """Delete an archive"""
+        self.s3.delete_object(Bucket=self.bucket_name, Key=key)
+
+    def exists(self, key: str) -> bool:
+        """Check if an archive exists"""
+        # pylint: disable=broad-except
+        try:
+            self.s3.head_object(Bucket=self.bucket_name, Key=key)
+            return True
+        except Exception:
+            return False
+
+
+class LocalBackend(StorageBackend):
+    """Archives in a local folder, the keys being their paths in it.
+
+    The archives are memory-mapped, so only the members read are loaded, \
+    and written to a temporary file renamed over the old one, so readers \
+    never see a partial archive.
+    """
+
+    root: Path
+
+    def __init__(self, root: Union[str, Path]) -> None:
+        """Initialize the backend"""
+        self.root = Path(root).resolve()
+
+    def path(self, key: str) -> Path:
+        """Get the path of an archive"""
+        path: Path = (self.root / key).resolve()
+        if not path.is_relative_to(self.root) or path == self.root:
+            raise http_error(status_code=400, detail="Invalid key")
+        return path
+
+    def open(self, key: str) -> "Source":
+        """Map an archive in memory"""
+        with self.path(key).open("rb") as file:
+            # An empty file cannot be mapped
+            if not file.seek(0, 2):
+                return BytesIO()
+            return MappedFile(file.fileno(), 0, access=ACCESS_READ)
+
+    def write(self, key: str, data: bytes) -> None:
+        """Write an archive, atomically"""
+        path: Path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        descriptor, temporary = mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        try:
+            with open(descriptor, "wb") as file:
+                file.write(data)
+                file.flush()
+                fsync(file.fileno())
+            replace(temporary, path)
+        except BaseException:
+            with suppress(FileNotFoundError):
+                unlink(temporary)
+            raise
+
+    def delete(self, key: str) -> None:
+        """Delete an archive"""
+        self.path(key).unlink(missing_ok=True)
+
+    def exists(self, key: str) -> bool:
+        """Check if an archive exists"""
+        return self.path(key).is_file()
+
+
+def get_backend(bucket_name: Union[str, None] = None) -> StorageBackend:
+    """Get the backend set by `STORAGE_BACKEND` (`s3` or `local`).
+
+    The local archives are in `STORAGE_ROOT`, in a folder per bucket.
+    """
+    if environ.get("STORAGE_BACKEND", "s3").lower().strip() == "local":
+        root: Path = Path(environ.get("STORAGE_ROOT", "storage"))
+        return LocalBackend(root / bucket_name if bucket_name else root)
+    if bucket_name is None:
+        raise http_error(status_code=500, detail="S3_BUCKET_NAME not set")
+    return S3Backend(bucket_name)
+
+
+__all__ = ("StorageBackend", "S3Backend", "LocalBackend", "MappedFile", "get_backend")
@@ -0,0 +1,363 @@
+"""DynamoDb write-behind buffer"""
+
+from atexit import register
+from collections import OrderedDict
+from contextlib import suppress
+from logging import Logger, getLogger
+from os import environ
+from threading import Condition, Event, Lock, Thread
+from time import sleep
+from typing import TYPE_CHECKING, Any, NamedTuple
+from ..utils.metrics import metrics
+from .clients import client
+
+if TYPE_CHECKING:  # pragma: no cover
+    with suppress(ImportError, ModuleNotFoundError):
+        from boto3_type_annotations.dynamodb import Client as DynamoClient
+
+# Max requests of a BatchWriteItem call
+BATCH_SIZE: int = 25
+MAX_ATTEMPTS: int = 8
+# Flushes a write is sent with, before it is dropped
+MAX_FLUSHES: int = 5
+
+# Error codes worth sending again
+RETRY_CODES: tuple[str, ...] = (
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "InternalServerError",
+    "ServiceUnavailable",
+)
+
+# The api logger, without importing minnesota.logs and fastapi with it
+logger: Logger = getLogger("api")
+
+
+class PendingWrite(NamedTuple):
+    """A write not yet sent to DynamoDb"""
+
+    seq: int
+    # A request of BatchWriteItem, or the arguments of UpdateItem under "Update"
+    request: dict[str, Any]
+    # None for a delete
+    item: dict[str, dict[str, str]] | None
+    # Flushes it failed in
+    attempts: int = 0
+
+
+class WriteBehind:  # pylint: disable=too-many-instance-attributes
+    """Writes to a DynamoDb table, kept in memory and coalesced per item, \
+    and written with BatchWriteItem by a background thread.
+
+    The writes are sent every `flush_interval` seconds, or as soon as \
+    `flush_size` items are pending. Only the last write of an item is sent, \
+    and reads through `overlay` see the writes not sent yet.
+
+    Until flushed, the writes are lost if the process dies: \
+    `wait_durable` waits until they are written. A write that DynamoDb rejects, \
+    or that fails in `MAX_FLUSHES` flushes, is dropped, logged and counted \
+    in `minnesota_write_behind_dropped_total`.
+    """
+
+    table_name: str
+    flush_interval: float
+    flush_size: int
+    max_pending: int
+    _dynamodb: "DynamoClient"
+    _pending: "OrderedDict[tuple[str, str, str], PendingWrite]"
+    _inflight: dict[tuple[str, str, str], PendingWrite]
+    _seq: int
+    _lock: Lock
+    _durable: Condition
+    _flush_lock: Lock
+    _wake: Event
+    _stop: Event
+    _thread: Thread | None
+
+    def __init__(
+        self,
+        table_name: str,
+        flush_interval: float = 1.0,
+        flush_size: int = BATCH_SIZE,
+        max_pending: int = 1000,
+    ) -> None:
+        """Initialize the buffer
+
+        Args:
+            table_name (str): The table.
+            flush_interval (float, optional): Seconds between flushes. Defaults to 1.0.
+            flush_size (int, optional): Pending items that start a flush. Defaults to 25.
+            max_pending (int, optional): Pending items past which the writer \
+                flushes itself, waiting for it. Defaults to 1000.
+        """
+        self.table_name = table_name
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_pending = max_pending
+        self._dynamodb = client("dynamodb")
+        self._pending = OrderedDict()
+        self._inflight = {}
+        self._seq = 0
+        self._lock = Lock()
+        self._durable = Condition(self._lock)
+        self._flush_lock = Lock()
+        self._wake = Event()
+        self._stop = Event()
+        self._thread = None
+
+    def _add(self, key: tuple[str, str, str], request: dict[str, Any], item: Any) -> None:
+        """Buffer a write, replacing the pending one of the same item"""
+        with self._lock:
+            self._seq += 1
+            self._pending[key] = PendingWrite(self._seq, request, item)
+            self._pending.move_to_end(key)
+            pending: int = len(self._pending)
+        self.start()
+        if pending >= self.max_pending:
+            # Backpressure, when DynamoDb cannot keep up
+            self.flush()
+        elif pending >= self.flush_size:
+            self._wake.set()
+
+    def put(self, key_name: str, item_id: str, sub: str, data: str) -> None:
+        """Buffer the write of an item"""
+        item: dict[str, dict[str, str]] = {
+            key_name: {"S": item_id},
+            "userId": {"S": sub},
+            "data": {"S": data},
+        }
+        self._add((key_name, item_id, sub), {"PutRequest": {"Item": item}}, item)
+
+    def update(self, key_name: str, item_id: str, sub: str, data: str) -> None:
+        """Buffer the update of the data of an item, keeping its other attributes"""
+        with self._lock:
+            pending = self._pending.get((key_name, item_id, sub))
+        if pending is not None and "PutRequest" in pending.request:
+            # Still to be created, so written whole
+            self.put(key_name, item_id, sub, data)
+            return
+        key: dict[str, dict[str, str]] = {key_name: {"S": item_id}, "userId": {"S": sub}}
+        request: dict[str, Any] = {
+            "Update": {
+                "Key": key,
+                "UpdateExpression": "SET #data = :data",
+                "ExpressionAttributeValues": {":data": {"S": data}},
+                "ExpressionAttributeNames": {"#data": "data"},
+            }
+        }
+        self._add((key_name, item_id, sub), request, {**key, "data": {"S": data}})
+
+    def delete(self, key_name: str, item_id: str, sub: str) -> None:
+        """Buffer the delete of an item"""
+        key: dict[str, dict[str, str]] = {key_name: {"S": item_id}, "userId": {"S": sub}}
+        self._add((key_name, item_id, sub), {"DeleteRequest": {"Key": key}}, None)
+
+    def overlay(
+        self,
+        key_name: str,
+        sub: str,
+        items: list[dict[str, dict[str, str]]],
+    ) -> list[dict[str, dict[str, str]]]:
+        """Apply the writes not yet in DynamoDb to the items of a user read from it"""
+        with self._lock:
+            writes: dict[tuple[str, str, str], PendingWrite] = {
+                key: write
+                for key, write in (*self._inflight.items(), *self._pending.items())
+                if key[0] == key_name and key[2] == sub
+            }
+        if not writes:
+            return items
+        merged: list[dict[str, dict[str, str]]] = []
+        for item in items:
+            write = writes.pop((key_name, item[key_name]["S"], sub), None)
+            if write is None:
+                merged.append(item)
+            elif "Update" in write.request:
+                merged.append({**item, **(write.item or {})})
+            elif write.item is not None:
+                merged.append(write.item)
+        merged += [write.item for write in writes.values() if write.item is not None]
+        return merged
+
+    def _watermark(self) -> int:
+        """Get the last write such that it and all the ones before are in DynamoDb"""
+        seqs = [write.seq for write in (*self._inflight.values(), *self._pending.values())]
+        return min(seqs) - 1 if seqs else self._seq
+
+    def _send(self, request: dict[str, Any]) -> None:
+        """Send a single write, without batching it"""
+        if "Update" in request:
+            self._dynamodb.update_item(TableName=self.table_name, **request["Update"])
+        elif "PutRequest" in request:
+            self._dynamodb.put_item(TableName=self.table_name, **request["PutRequest"])
+        else:
+            self._dynamodb.delete_item(TableName=self.table_name, **request["DeleteRequest"])
+
+    def _drop(self, key: tuple[str, str, str], reason: object) -> None:
+        """Give up on the write of an item"""
+        logger.error("Dropped the write of %s to %s: %s", key[1], self.table_name, reason)
+        metrics.inc("minnesota_write_behind_dropped_total", (("table", self.table_name),))
+
+    def _write_each(
+        self, writes: list[tuple[tuple[str, str, str], PendingWrite]]
+    ) -> list[tuple[tuple[str, str, str], PendingWrite]]:
+        """Write the items one by one, dropping the ones rejected
+
+        Returns:
+            list: The writes to send again
+        """
+        failed: list[tuple[tuple[str, str, str], PendingWrite]] = []
+        for key, write in writes:
+            try:
+                self._send(write.request)
+            except Exception as exc:  # pylint: disable=broad-except
+                if _code(exc) in RETRY_CODES or not _code(exc):
+                    failed.append((key, write))
+                else:
+                    self._drop(key, exc)
+        return failed
+
+    def _write_batch(
+        self, writes: list[tuple[tuple[str, str, str], PendingWrite]]
+    ) -> list[tuple[tuple[str, str, str], PendingWrite]]:
+        """Write up to 25 items, retrying the unprocessed ones with backoff
+
+        Returns:
+            list: The writes to send again
+        """
+        requests: list[dict[str, Any]] = [write.request for _, write in writes]
+        try:
+            for attempt in range(MAX_ATTEMPTS):
+                if not requests:
+                    break
+                response = self._dynamodb.batch_write_item(
+                    RequestItems={self.table_name: requests}
+                )
+                requests = response.get("UnprocessedItems", {}).get(self.table_name, [])
+                if requests:
+                    sleep(min(0.05 * 2**attempt, 2.0))
+        except Exception as exc:  # pylint: disable=broad-except
+            if _code(exc) and _code(exc) not in RETRY_CODES:
+                # A single invalid item fails the whole batch
+                return self._write_each(
+                    [(key, write) for key, write in writes if write.request in requests]
+                )
+            logger.warning(
+                "Could not write %d items to %s: %s", len(requests), self.table_name, exc
+            )
+        return [(key, write) for key, write in writes if write.request in requests]
+
+    def _write(self, chunk: list[tuple[tuple[str, str, str], PendingWrite]]) -> None:
+        """Write up to 25 items, the updates with UpdateItem as they cannot be batched"""
+        failed: list[tuple[tuple[str, str, str], PendingWrite]] = self._write_batch(
+            [(key, write) for key, write in chunk if "Update" not in write.request]
+        ) + self._write_each([(key, write) for key, write in chunk if "Update" in write.request])
+        with self._lock:
+            for key, _ in chunk:
+                self._inflight.pop(key, None)
+            # Sent again with the next flush, unless written again meanwhile
+            for key, write in failed:
+                if key in self._pending:
+                    continue
+                if write.attempts + 1 >= MAX_FLUSHES:
+                    self._drop(key, f"still failing after {MAX_FLUSHES} flushes")
+                else:
+                    self._pending[key] = write._replace(attempts=write.attempts + 1)
+            self._durable.notify_all()
+
+    def flush(self) -> None:
+        """Write the pending items now"""
+        with self._flush_lock:
+            with self._lock:
+                writes = list(self._pending.items())
+                self._inflight = dict(writes)
+                self._pending.clear()
+            for start in range(0, len(writes), BATCH_SIZE):
+                self._write(writes[start : start + BATCH_SIZE])
+
+    def wait_durable(self, timeout: float | None = None) -> bool:
+        """Wait until the items written so far are in DynamoDb
+
+        Returns:
+            bool: False if they were not written in `timeout` seconds
+        """
+        with self._lock:
+            target: int = self._seq
+        self._wake.set()
+        with self._durable:
+            return self._durable.wait_for(lambda: self._watermark() >= target, timeout)
+
+    def _run(self) -> None:
+        """Flush on time or on size, until stopped"""
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.warning("Write-behind flush of %s failed: %s", self.table_name, exc)
+
+    def start(self) -> None:
+        """Start the background thread, if not started"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = Thread(
+                    target=self._run, name=f"write-behind-{self.table_name}", daemon=True
+                )
+                self._thread.start()
+
+    def close(self, timeout: float | None = None) -> bool:
+        """Stop the background thread, and write the pending items
+
+        Returns:
+            bool: False if some items could not be written
+        """
+        self._stop.set()
+        self._wake.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+        self.flush()
+        with self._lock:
+            return not self._pending
+
+
+def _code(exc: Exception) -> str:
+    """Get the error code of a boto3 exception"""
+    return str(getattr(exc, "response", {}).get("Error", {}).get("Code", ""))
+
+
+_buffers: dict[str, WriteBehind] = {}
+_buffers_lock: Lock = Lock()
+
+
+def get_write_behind(table_name: str) -> WriteBehind:
+    """Get the buffer of a table, configured by `DYNAMO_FLUSH_INTERVAL`, \
+    `DYNAMO_FLUSH_SIZE` and `DYNAMO_MAX_PENDING`"""
+    with _buffers_lock:
+        if table_name not in _buffers:
+            if not _buffers:
+                register(drain_write_behind)
+            _buffers[table_name] = WriteBehind(
+                table_name,
+                flush_interval=float(environ.get("DYNAMO_FLUSH_INTERVAL", "1.0")),
+                flush_size=int(environ.get("DYNAMO_FLUSH_SIZE", str(BATCH_SIZE))),
+                max_pending=int(environ.get("DYNAMO_MAX_PENDING", "1000")),
+            )
+        return _buffers[table_name]
+
+
+def drain_write_behind(timeout: float | None = None) -> None:
+    """Write the pending items of every table, as on shutdown"""
+    with _buffers_lock:
+        buffers: list[WriteBehind] = list(_buffers.values())
+    for buffer in buffers:
+        if not buffer.close(timeout):
+            logger.error("Write-behind items of %s lost on shutdown", buffer.table_name)
+
+
+__all__ = ("WriteBehind", "PendingWrite", "get_write_behind", "drain_write_behind")
@@ -3,6 +3,8 @@
 from os import environ
 from datetime import datetime
 from stripe._stripe_client import StripeClient
+from stripe._http_client import new_default_http_client
+from ..utils.metrics import timed_http_client
 
 IS_TEST: bool = environ.get("IS_TEST", "false").lower().strip() == "true"
 
@@ -20,6 +22,12 @@ def get_stripe_client() -> StripeClient:
             "api": environ["STRIPE_ENDPOINT_URL"],
         }
 
+    if environ.get("METRICS", "false").lower().strip() == "true":
+        return StripeClient(
+            environ["STRIPE_API_KEY"],
+            base_addresses=endpoint,  # type: ignore[arg-type]
+            http_client=timed_http_client(new_default_http_client()),
+        )
     return StripeClient(
         environ["STRIPE_API_KEY"],
         base_addresses=endpoint,  # type: ignore[arg-type]
@@ -1,6 +1,7 @@
 """Logger"""
 
 from .logger import logger, Log
+from .access import access_logger, AccessLogMiddleware
 
 
-__all__ = ["logger", "Log"]
+__all__ = ["logger", "Log", "access_logger", "AccessLogMiddleware"]
@@ -0,0 +1,196 @@
+"""Access logs"""
+
+from collections import OrderedDict
+from os import environ
+from random import random
+from threading import Lock
+from time import monotonic, perf_counter
+from logging import Filter, Logger, LogRecord, getLogger, INFO, WARNING, ERROR
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:  # pragma: no cover
+    from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+SCOPE_KEY: str = "minnesota.access_log"
+
+CLIENT_ERROR: int = 400
+SERVER_ERROR: int = 500
+
+access_logger: Logger = getLogger("api.access")
+
+
+class RateLimitFilter(Filter):  # pylint: disable=too-few-public-methods
+    """Token bucket per repeated message: the records over the rate are suppressed, \
+    and counted in the next record that gets through.
+
+    Records are grouped by their `rate_key` extra, or by call site. \
+    Past `max_keys` groups, the least recently seen one is dropped.
+    """
+
+    rate: float
+    burst: float
+    max_keys: int
+    _buckets: "OrderedDict[object, list[float]]"
+    _lock: Lock
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 1024) -> None:
+        """Initialize the filter, with the rate in records per second"""
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def filter(self, record: LogRecord) -> bool:
+        """Check if a record is within the rate"""
+        if self.rate <= 0:
+            return True
+        now: float = monotonic()
+        with self._lock:
+            key: object = getattr(record, "rate_key", (record.pathname, record.lineno))
+            # tokens, last refill, suppressed
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now, 0]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            suppressed: int = int(bucket[2])
+            bucket[2] = 0
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+class AccessLogSampler:
+    """Decide which requests get an access line.
+
+    Errors (5xx) and requests slower than `slow_ms` are always logged, \
+    the others with the sample rate of their route, matched by prefix.
+    """
+
+    rate: float
+    rates: list[tuple[str, float]]
+    slow: float
+
+    def __init__(
+        self,
+        rate: float = 1.0,
+        rates: dict[str, float] | None = None,
+        slow_ms: float = 1000,
+    ) -> None:
+        """Initialize the sampler"""
+        self.rate = rate
+        # Longest prefix first
+        self.rates = sorted((rates or {}).items(), key=lambda kv: len(kv[0]), reverse=True)
+        self.slow = slow_ms / 1000
+
+    @classmethod
+    def from_env(cls) -> "AccessLogSampler":
+        """Get the sampler configured by `LOG_SAMPLE_RATE`, `LOG_SAMPLE_RATES` \
+        (like `/items=0.1,/health=0`) and `LOG_SLOW_MS`"""
+        rates: dict[str, float] = {}
+        for pair in environ.get("LOG_SAMPLE_RATES", "").split(","):
+            if "=" in pair:
+                route, value = pair.rsplit("=", 1)
+                rates[route.strip()] = float(value)
+        return cls(
+            rate=float(environ.get("LOG_SAMPLE_RATE", "1")),
+            rates=rates,
+            slow_ms=float(environ.get("LOG_SLOW_MS", "1000")),
+        )
+
+    def level(self, path: str, status: int, seconds: float, requested: bool) -> int | None:
+        """Get the level of the access line, or None to skip it"""
+        if status >= SERVER_ERROR:
+            return ERROR
+        if seconds >= self.slow:
+            return WARNING
+        if status < CLIENT_ERROR and not requested:
+            return None
+        rate: float = self.rate
+        for prefix, prefix_rate in self.rates:
+            if path.startswith(prefix):
+                rate = prefix_rate
+                break
+        if rate < 1 and random() >= rate:  # nosec
+            return None
+        return INFO if status < CLIENT_ERROR else WARNING
+
+
+class AccessLogMiddleware:  # pylint: disable=too-few-public-methods
+    """Log method, URL, status and duration of the requests.
+
+    Requests that depend on `Log` are sampled, 4xx are sampled too, \
+    5xx and slow requests are always logged.
+    """
+
+    def __init__(self, app: "ASGIApp", sampler: AccessLogSampler | None = None) -> None:
+        """Initialize the middleware"""
+        self.app = app
+        self.sampler = sampler or AccessLogSampler.from_env()
+
+    async def __call__(self, scope: "Scope", receive: "Receive", send: "Send") -> None:
+        """Handle a request"""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started: float = perf_counter()
+        status: int = 500
+
+        async def _send(message: "Message") -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        # Set to True by the Log dependency
+        scope[SCOPE_KEY] = False
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            seconds: float = perf_counter() - started
+            level = self.sampler.level(scope["path"], status, seconds, scope[SCOPE_KEY])
+            if level is not None and access_logger.isEnabledFor(level):
+                query: bytes = scope.get("query_string", b"")
+                access_logger.log(
+                    level,
+                    "[%s] %s%s %d %.1fms",
+                    scope["method"],
+                    scope["path"],
+                    "?" + query.decode("latin-1") if query else "",
+                    status,
+                    seconds * 1000,
+                    # The route template, not the path, to keep the keys bounded
+                    extra={
+                        "rate_key": (
+                            scope["method"],
+                            getattr(scope.get("route"), "path", "unmatched"),
+                            status,
+                        )
+                    },
+                )
+
+
+access_logger.addFilter(
+    RateLimitFilter(
+        rate=float(environ.get("LOG_RATE_LIMIT", "10")),
+        burst=float(environ.get("LOG_RATE_BURST", "50")),
+    )
+)
+
+__all__ = (
+    "access_logger",
+    "AccessLogMiddleware",
+    "AccessLogSampler",
+    "RateLimitFilter",
+    "SCOPE_KEY",
+)
@@ -0,0 +1,297 @@
+"""CloudWatch Logs"""
+
+from collections import deque
+from os import environ, getpid
+from random import uniform
+from socket import gethostname
+from sys import stderr
+from threading import Condition, Event, Thread
+from time import sleep, time
+from logging import Handler, LogRecord
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:  # pragma: no cover
+    from boto3_type_annotations.logs.client import Client as LogsClient
+
+# Limits of a PutLogEvents call
+MAX_BATCH_EVENTS: int = 10_000
+MAX_BATCH_BYTES: int = 1_048_576
+# Bytes counted for every event, besides its message
+EVENT_OVERHEAD: int = 26
+MAX_EVENT_BYTES: int = 262_144 - EVENT_OVERHEAD
+# A batch cannot span more than 24 hours
+MAX_BATCH_SPAN: int = 24 * 60 * 60 * 1000
+MAX_ATTEMPTS: int = 6
+
+# Error codes worth sending again
+RETRY_CODES: tuple[str, ...] = (
+    "ThrottlingException",
+    "ServiceUnavailableException",
+    "InternalFailure",
+)
+
+
+class CloudWatchLogsHandler(Handler):  # pylint: disable=too-many-instance-attributes
+    """Handler that ships the records to a CloudWatch Logs stream.
+
+    The records are formatted and buffered in memory, and a background thread \
+    sends them with PutLogEvents every `interval` seconds, or as soon as a full \
+    batch is buffered, in time order and within the limits of the call.
+
+    The buffer holds at most `max_buffer` records: past that, the newest \
+    records are dropped, or the oldest if `drop_oldest`, and the count of the \
+    dropped records is shipped with the next batch.
+    """
+
+    log_group: str
+    log_stream: str
+    interval: float
+    max_buffer: int
+    drop_oldest: bool
+    dropped: int
+    _logs: "LogsClient | None"
+    _events: deque[tuple[int, str]]
+    _bytes: int
+    _reported: int
+    _token: str | None
+    _ready: bool
+    _changed: Condition
+    _wake: Event
+    _stop: Event
+    _thread: Thread | None
+
+    def __init__(  # noqa: PLR0913, PLR0917
+        # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        log_group: str,
+        log_stream: str | None = None,
+        interval: float = 5.0,
+        max_buffer: int = 10_000,
+        drop_oldest: bool = False,
+        logs: "LogsClient | None" = None,
+    ) -> None:
+        """Initialize the handler
+
+        Args:
+            log_group (str): The log group, created if missing.
+            log_stream (str | None, optional): The log stream, created if missing. \
+                Defaults to the host name and the process id.
+            interval (float, optional): Seconds between batches. Defaults to 5.0.
+            max_buffer (int, optional): Records kept in memory. Defaults to 10000.
+            drop_oldest (bool, optional): Drop the oldest records, not the newest, \
+                when the buffer is full. Defaults to False.
+            logs (LogsClient | None, optional): The client. Defaults to a new one.
+        """
+        super().__init__()
+        self.log_group = log_group
+        self.log_stream = log_stream or f"{gethostname()}-{getpid()}"
+        self.interval = interval
+        self.max_buffer = max_buffer
+        self.drop_oldest = drop_oldest
+        self.dropped = 0
+        self._logs = logs
+        self._events = deque()
+        self._bytes = 0
+        self._reported = 0
+        self._token = None
+        self._ready = False
+        self._changed = Condition()
+        self._wake = Event()
+        self._stop = Event()
+        self._thread = None
+
+    @property
+    def logs(self) -> "LogsClient":
+        """The client, created on the first batch"""
+        if self._logs is None:
+            # Imported here, so that importing the loggers does not import boto3
+            from ..aws.clients import client  # noqa: PLC0415 # pylint: disable=import-outside-toplevel
+
+            self._logs = client("logs")
+        return self._logs
+
+    def emit(self, record: LogRecord) -> None:
+        """Buffer a record"""
+        try:
+            message: str = self.format(record)
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+            return
+        encoded: bytes = message.encode("utf-8")
+        if len(encoded) > MAX_EVENT_BYTES:
+            message = encoded[:MAX_EVENT_BYTES].decode("utf-8", "ignore")
+        size: int = len(message.encode("utf-8")) + EVENT_OVERHEAD
+        with self._changed:
+            if len(self._events) >= self.max_buffer:
+                self.dropped += 1
+                if not self.drop_oldest:
+                    return
+                self._bytes -= len(self._events.popleft()[1].encode("utf-8")) + EVENT_OVERHEAD
+            self._events.append((int(record.created * 1000), message))
+            self._bytes += size
+            full: bool = (
+                len(self._events) >= MAX_BATCH_EVENTS or self._bytes >= MAX_BATCH_BYTES
+            )
+        self.start()
+        if full:
+            self._wake.set()
+
+    def _batch(self) -> list[dict[str, Any]]:
+        """Take the next batch from the buffer, sorted by time"""
+        with self._changed:
+            events: list[tuple[int, str]] = []
+            size: int = 0
+            while self._events and len(events) < MAX_BATCH_EVENTS:
+                timestamp, message = self._events[0]
+                event_size: int = len(message.encode("utf-8")) + EVENT_OVERHEAD
+                if size + event_size > MAX_BATCH_BYTES:
+                    break
+                self._events.popleft()
+                size += event_size
+                events.append((timestamp, message))
+            self._bytes -= size
+            if self.dropped > self._reported and len(events) < MAX_BATCH_EVENTS:
+                events.append(
+                    (
+                        int(time() * 1000),
+                        f"{self.dropped - self._reported} log records dropped, "
+                        "the CloudWatch buffer was full",
+                    )
+                )
+                self._reported = self.dropped
+        # The threads log out of order by a few milliseconds
+        events.sort(key=lambda event: event[0])
+        batch: list[dict[str, Any]] = []
+        for timestamp, message in events:
+            if batch and timestamp - batch[0]["timestamp"] > MAX_BATCH_SPAN:
+                # Sent with the next batch
+                with self._changed:
+                    for later in reversed(events[len(batch) :]):
+                        self._events.appendleft(later)
+                        self._bytes += len(later[1].encode("utf-8")) + EVENT_OVERHEAD
+                break
+            batch.append({"timestamp": timestamp, "message": message})
+        return batch
+
+    def _create(self) -> None:
+        """Create the log group and the log stream, if missing"""
+        for call, kwargs in (
+            (self.logs.create_log_group, {"logGroupName": self.log_group}),
+            (
+                self.logs.create_log_stream,
+                {"logGroupName": self.log_group, "logStreamName": self.log_stream},
+            ),
+        ):
+            try:
+                call(**kwargs)
+            except Exception as exc:  # pylint: disable=broad-except
+                if _code(exc) != "ResourceAlreadyExistsException":
+                    raise
+        self._ready = True
+
+    def _put(self, batch: list[dict[str, Any]]) -> None:
+        """Send a batch, retrying on throttling and on sequence errors"""
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                if not self._ready:
+                    self._create()
+                kwargs: dict[str, Any] = {
+                    "logGroupName": self.log_group,
+                    "logStreamName": self.log_stream,
+                    "logEvents": batch,
+                }
+                if self._token is not None:
+                    kwargs["sequenceToken"] = self._token
+                response = self.logs.put_log_events(**kwargs)
+                self._token = response.get("nextSequenceToken")
+                return
+            except Exception as exc:  # pylint: disable=broad-except
+                code: str = _code(exc)
+                if code == "DataAlreadyAcceptedException":
+                    self._token = _expected_token(exc)
+                    return
+                if code == "InvalidSequenceTokenException":
+                    self._token = _expected_token(exc)
+                    continue
+                if code == "ResourceNotFoundException":
+                    self._ready = False
+                    continue
+                if code not in RETRY_CODES or attempt == MAX_ATTEMPTS - 1:
+                    # Not to the api logger, that would ship it here again
+                    print(
+                        f"Could not ship {len(batch)} log records to CloudWatch: {exc}",
+                        file=stderr,
+                    )
+                    return
+            # Full jitter, so the workers do not retry all at once
+            sleep(uniform(0, min(10.0, 0.2 * 2**attempt)))  # nosec
+
+    def flush(self) -> None:
+        """Ship the buffered records now"""
+        while True:
+            batch: list[dict[str, Any]] = self._batch()
+            if not batch:
+                return
+            self._put(batch)
+
+    def _run(self) -> None:
+        """Ship on time or on size, until stopped"""
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as exc:  # pylint: disable=broad-except
+                print(f"Could not ship the log records to CloudWatch: {exc}", file=stderr)
+
+    def start(self) -> None:
+        """Start the background thread, if not started"""
+        if self._thread is not None:
+            return
+        with self._changed:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = Thread(target=self._run, name="cloudwatch-logs", daemon=True)
+                self._thread.start()
+
+    def close(self) -> None:
+        """Stop the background thread, and ship the buffered records"""
+        self._stop.set()
+        self._wake.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+        try:
+            self.flush()
+        finally:
+            super().close()
+
+
+def _code(exc: Exception) -> str:
+    """Get the error code of a boto3 exception"""
+    return str(getattr(exc, "response", {}).get("Error", {}).get("Code", ""))
+
+
+def _expected_token(exc: Exception) -> str | None:
+    """Get the sequence token expected by a stream, from a sequence error"""
+    token = getattr(exc, "response", {}).get("expectedSequenceToken")
+    return str(token) if token else None
+
+
+def get_cloudwatch_handler() -> CloudWatchLogsHandler | None:
+    """Get a handler configured by `CLOUDWATCH_LOG_GROUP`, `CLOUDWATCH_LOG_STREAM`, \
+    `CLOUDWATCH_LOG_INTERVAL`, `CLOUDWATCH_LOG_BUFFER` and `LOG_DROP_POLICY`, \
+    or None if no log group is set"""
+    log_group: str = environ.get("CLOUDWATCH_LOG_GROUP", "").strip()
+    if not log_group:
+        return None
+    return CloudWatchLogsHandler(
+        log_group,
+        log_stream=environ.get("CLOUDWATCH_LOG_STREAM") or None,
+        interval=float(environ.get("CLOUDWATCH_LOG_INTERVAL", "5")),
+        max_buffer=int(environ.get("CLOUDWATCH_LOG_BUFFER", "10000")),
+        drop_oldest=environ.get("LOG_DROP_POLICY", "newest").lower() == "oldest",
+    )
+
+
+__all__ = ("CloudWatchLogsHandler", "get_cloudwatch_handler")
@@ -1,22 +1,233 @@
 """Loggers"""
 
-from os import getcwd
-from logging import Logger, getLogger, StreamHandler, INFO, DEBUG, Formatter
-from logging.handlers import RotatingFileHandler
+from atexit import register
+from io import TextIOWrapper
+from json import dumps
+from os import environ, getcwd
+from logging import (
+    Logger,
+    LogRecord,
+    Handler,
+    getLogger,
+    makeLogRecord,
+    StreamHandler,
+    INFO,
+    DEBUG,
+    WARNING,
+    Formatter,
+)
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from pathlib import Path
-from typing import Annotated, TextIO
+from queue import Queue, Full, Empty
+from threading import Lock
+from typing import Annotated, TextIO, cast
 
 from fastapi import Depends, Request
+from .access import SCOPE_KEY
+from .cloudwatch import CloudWatchLogsHandler, get_cloudwatch_handler
 
-cwd: Path = Path(getcwd())
+LOG_QUEUE_SIZE: int = int(environ.get("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE: int = int(environ.get("LOG_BATCH_SIZE", "256"))
+LOG_DROP_OLDEST: bool = environ.get("LOG_DROP_POLICY", "newest").lower() == "oldest"
+LOG_FORMAT: str = environ.get("LOG_FORMAT", "text").lower().strip()
 
-if not cwd.exists():
-    cwd.mkdir()
 
-log_dir: Path = cwd.joinpath("logs")
+class JsonFormatter(Formatter):
+    """Format records as one JSON object per line.
+
+    The message is only interpolated here, on the listener thread, \
+    so records of disabled levels are never formatted.
+    """
+
+    def format(self, record: LogRecord) -> str:
+        """Format a record"""
+        data: dict[str, object] = {
+            "time": self.formatTime(record),
+            "name": record.name,
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            data["stack_info"] = self.formatStack(record.stack_info)
+        return dumps(data, default=str)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """Queue handler that never blocks: when the queue is full, a record is dropped"""
+
+    dropped: int
+    drop_oldest: bool
+    _records: "Queue[LogRecord]"
+
+    def __init__(self, queue: "Queue[LogRecord]", drop_oldest: bool = False) -> None:
+        """Initialize the handler"""
+        super().__init__(queue)
+        self._records = queue
+        self.dropped = 0
+        self.drop_oldest = drop_oldest
+
+    def prepare(self, record: LogRecord) -> LogRecord:
+        """Leave the formatting to the listener thread"""
+        return record
+
+    def enqueue(self, record: LogRecord) -> None:
+        """Enqueue a record, or drop one if the queue is full"""
+        try:
+            self._records.put_nowait(record)
+            return
+        except Full:
+            pass
+        if self.drop_oldest:
+            try:
+                self._records.get_nowait()
+                self._records.put_nowait(record)
+            except (Empty, Full):
+                pass
+        self.dropped += 1
+
+
+def _emit_batch(target: Handler, records: list[LogRecord]) -> None:
+    """Write a batch of records to a handler, with a single write for streams"""
+    if not isinstance(target, StreamHandler):
+        for record in records:
+            if record.levelno >= target.level:
+                target.handle(record)
+        return
+    # pylint: disable=broad-except
+    lines: list[str] = []
+    for record in records:
+        if record.levelno < target.level or not target.filter(record):
+            continue
+        try:
+            lines.append(target.format(record) + target.terminator)
+        except Exception:
+            target.handleError(record)
+    if not lines:
+        return
+    target.acquire()
+    try:
+        # Checked once per batch, so a file can exceed maxBytes by one batch
+        if isinstance(target, RotatingFileHandler) and target.shouldRollover(
+            records[0]
+        ):
+            target.doRollover()
+        cast(TextIO, target.stream).write("".join(lines))
+        target.flush()
+    except Exception:
+        target.handleError(records[-1])
+    finally:
+        target.release()
+
+
+class BatchQueueListener(QueueListener):
+    """Queue listener that drains the queue in batches"""
+
+    batch_size: int
+    source: BoundedQueueHandler | None
+    _records: "Queue[LogRecord | None]"
+    _reported: int
+
+    def __init__(
+        self,
+        queue: "Queue[LogRecord]",
+        *handlers: Handler,
+        batch_size: int = 256,
+        source: BoundedQueueHandler | None = None,
+    ) -> None:
+        """Initialize the listener"""
+        super().__init__(queue, *handlers, respect_handler_level=True)
+        self._records = cast("Queue[LogRecord | None]", queue)
+        self.batch_size = batch_size
+        self.source = source
+        self._reported = 0
+
+    def enqueue_sentinel(self) -> None:
+        """Wait for room for the sentinel, as the queue is bounded"""
+        self._records.put(None)
+
+    def handle_batch(self, records: list[LogRecord]) -> None:
+        """Handle a batch of records"""
+        if self.source is not None and self.source.dropped > self._reported:
+            records.append(
+                makeLogRecord(
+                    {
+                        "name": "api",
+                        "levelno": WARNING,
+                        "levelname": "WARNING",
+                        "msg": "%d log records dropped, the queue was full",
+                        "args": (self.source.dropped - self._reported,),
+                    }
+                )
+            )
+            self._reported = self.source.dropped
+        for target in self.handlers:
+            _emit_batch(target, records)
+
+    def _monitor(self) -> None:
+        """Drain the queue in batches until the sentinel"""
+        stop: bool = False
+        while not stop:
+            batch: list[LogRecord | None] = [self._records.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._records.get_nowait())
+                except Empty:
+                    break
+            records: list[LogRecord] = []
+            for record in batch:
+                if record is None:  # The sentinel
+                    stop = True
+                else:
+                    records.append(record)
+            if records:
+                self.handle_batch(records)
+            for _ in batch:
+                self._records.task_done()
+
+
+class LogFileHandler(RotatingFileHandler):
+    """Rotating file handler that creates the file, and its folder, on the first record"""
 
-if not log_dir.exists():
-    log_dir.mkdir()
+    def __init__(self, filename: Path, max_bytes: int) -> None:
+        """Initialize the handler, without opening the file"""
+        super().__init__(filename, maxBytes=max_bytes, delay=True)
+
+    def _open(self) -> TextIOWrapper:
+        """Create the folder and open the file"""
+        Path(self.baseFilename).parent.mkdir(parents=True, exist_ok=True)
+        return super()._open()
+
+
+class LazyQueueHandler(BoundedQueueHandler):
+    """Bounded queue handler that starts its listener on the first record"""
+
+    listener: "BatchQueueListener | None"
+    _started: bool
+    _start_lock: Lock
+
+    def __init__(self, queue: "Queue[LogRecord]", drop_oldest: bool = False) -> None:
+        """Initialize the handler"""
+        super().__init__(queue, drop_oldest)
+        self.listener = None
+        self._started = False
+        self._start_lock = Lock()
+
+    def enqueue(self, record: LogRecord) -> None:
+        """Start the listener if needed, and enqueue a record"""
+        if not self._started and self.listener is not None:
+            with self._start_lock:
+                if not self._started:
+                    self.listener.start()
+                    register(self.listener.stop)
+                    self._started = True
+        super().enqueue(record)
+
+
+cwd: Path = Path(getcwd())
+
+log_dir: Path = cwd.joinpath("logs")
 
 log_file: Path = log_dir.joinpath("api.log")
 
@@ -26,27 +237,55 @@ logger.setLevel(DEBUG if __debug__ else INFO)
 handler: StreamHandler[TextIO] = StreamHandler()
 handler.setLevel(DEBUG if __debug__ else INFO)
 
-formatter: Formatter = Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+formatter: Formatter = (
+    JsonFormatter()
+    if LOG_FORMAT == "json"
+    else Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+)
 
 handler.setFormatter(formatter)
 
-logger.addHandler(handler)
-
-file_handler: RotatingFileHandler = RotatingFileHandler(
-    log_file, maxBytes=1024 * 1024 * 10
-)
+file_handler: RotatingFileHandler = LogFileHandler(log_file, max_bytes=1024 * 1024 * 10)
 file_handler.setLevel(DEBUG if __debug__ else INFO)
 file_handler.setFormatter(formatter)
 
-logger.addHandler(file_handler)
+targets: list[Handler] = [handler, file_handler]
+
+# Shipped by its own thread, so a slow PutLogEvents does not hold the listener
+cloudwatch_handler: CloudWatchLogsHandler | None = get_cloudwatch_handler()
+if cloudwatch_handler is not None:
+    cloudwatch_handler.setLevel(DEBUG if __debug__ else INFO)
+    cloudwatch_handler.setFormatter(formatter)
+    targets.append(cloudwatch_handler)
+
+log_queue: "Queue[LogRecord]" = Queue(maxsize=LOG_QUEUE_SIZE)
+
+queue_handler: LazyQueueHandler = LazyQueueHandler(
+    log_queue, drop_oldest=LOG_DROP_OLDEST
+)
+
+logger.addHandler(queue_handler)
+
+# Started by the first record, so importing the package starts no thread
+listener: BatchQueueListener = BatchQueueListener(
+    log_queue,
+    *targets,
+    batch_size=LOG_BATCH_SIZE,
+    source=queue_handler,
+)
+queue_handler.listener = listener
 
 
 def _get_logger(request: Request) -> Logger:
-    """Get logger"""
-    logger.info(f"[{request.method}] {request.url}")
+    """Get logger, and ask for an access line"""
+    if SCOPE_KEY in request.scope:
+        # AccessLogMiddleware logs it, sampled and with the duration
+        request.scope[SCOPE_KEY] = True
+    else:
+        logger.info("[%s] %s", request.method, request.url)
     return logger
 
 
 Log = Annotated[Logger, Depends(_get_logger)]
 
-__all__ = ["logger", "Log"]
+__all__ = ["logger", "Log", "JsonFormatter"]
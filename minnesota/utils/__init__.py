@@ -1,7 +1,60 @@
 """Utils"""
 
-from .args import get_args
-from .shell import run_command
-from .loader import load_types
+from importlib import import_module
+from typing import TYPE_CHECKING, Any
 
-__all__ = ("get_args", "run_command", "load_types")
+if TYPE_CHECKING:  # pragma: no cover
+    from .args import get_args, get_server_options
+    from .shell import (
+        run_command,
+        run_command_async,
+        stream_command,
+        CommandExecutor,
+        get_executor,
+    )
+    from .loader import load_types
+    from .registry import load_cached_types, cache_path, read_manifest
+
+# Imported on first access: the metrics, used by the AWS helpers, do not need the others
+_LAZY: dict[str, str] = {
+    "get_args": ".args",
+    "get_server_options": ".args",
+    "run_command": ".shell",
+    "run_command_async": ".shell",
+    "stream_command": ".shell",
+    "CommandExecutor": ".shell",
+    "get_executor": ".shell",
+    "load_types": ".loader",
+    "load_cached_types": ".registry",
+    "cache_path": ".registry",
+    "read_manifest": ".registry",
+}
+
+
+def __getattr__(name: str) -> Any:
+    """Import an attribute on first access"""
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_LAZY[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    """List the attributes, imported or not"""
+    return sorted({*globals(), *__all__})
+
+
+__all__ = (
+    "get_args",
+    "get_server_options",
+    "run_command",
+    "run_command_async",
+    "stream_command",
+    "CommandExecutor",
+    "get_executor",
+    "load_types",
+    "load_cached_types",
+    "cache_path",
+    "read_manifest",
+)
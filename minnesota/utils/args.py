@@ -1,11 +1,24 @@
 """Args utils"""
 
-from os import environ, getcwd
+from os import environ, getcwd, pathsep
 from argparse import ArgumentParser
 from pathlib import Path
+from typing import TYPE_CHECKING
 
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import Literal, TypedDict
 
-def get_args() -> (  # noqa: C901, PLR0915 # pylint: disable=too-many-locals
+    class ServerOptions(TypedDict):
+        """Uvicorn options"""
+
+        workers: int
+        loop: Literal["auto", "asyncio", "uvloop"]
+        http: Literal["auto", "h11", "httptools"]
+        backlog: int
+        limit_concurrency: int | None
+
+
+def get_args() -> (  # noqa: C901, PLR0912, PLR0915 # pylint: disable=too-many-locals
     tuple[list[Path], Path, str, int, bool]
 ):  # pragma: no cover
     """Get args"""
@@ -120,9 +133,25 @@ def get_args() -> (  # noqa: C901, PLR0915 # pylint: disable=too-many-locals
         type=str,
         required=False,
         default=None,
-        help="Secretsmanager name",
+        help="Secretsmanager name, or comma separated names",
         dest="secrets",
     )
+    parser.add_argument(
+        "--secrets-ttl",
+        type=float,
+        required=False,
+        default=None,
+        help="Seconds between refreshes of the secrets, 0 to disable",
+        dest="secrets_ttl",
+    )
+    parser.add_argument(
+        "--secrets-snapshot",
+        type=str,
+        required=False,
+        default=None,
+        help="File to cache the secrets in, readable only by the owner",
+        dest="secrets_snapshot",
+    )
     parser.add_argument(
         "--allowed-origins",
         type=str,
@@ -131,6 +160,225 @@ def get_args() -> (  # noqa: C901, PLR0915 # pylint: disable=too-many-locals
         help="Allowed CORS origins",
         dest="origins",
     )
+    parser.add_argument(
+        "--routes-cache",
+        type=str,
+        required=False,
+        default=None,
+        help="Folder for the route discovery cache",
+        dest="routes_cache",
+    )
+    parser.add_argument(
+        "--routes-depth",
+        type=int,
+        required=False,
+        default=None,
+        help="How many levels of submodules to search for routes",
+        dest="routes_depth",
+    )
+    parser.add_argument(
+        "--lazy",
+        required=False,
+        default=False,
+        action="store_true",
+        dest="lazy",
+        help="Import the routes after the server starts listening",
+    )
+    parser.add_argument(
+        "--preload",
+        type=str,
+        required=False,
+        nargs="+",
+        default=None,
+        help="Modules or prefixes of the routes to import eagerly in lazy mode",
+        dest="preload",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        required=False,
+        default=None,
+        help="Number of worker processes",
+        dest="workers",
+    )
+    parser.add_argument(
+        "--loop",
+        type=str,
+        required=False,
+        default=None,
+        choices=["auto", "asyncio", "uvloop"],
+        help="Event loop implementation",
+        dest="loop",
+    )
+    parser.add_argument(
+        "--http",
+        type=str,
+        required=False,
+        default=None,
+        choices=["auto", "h11", "httptools"],
+        help="HTTP protocol implementation",
+        dest="http",
+    )
+    parser.add_argument(
+        "--backlog",
+        type=int,
+        required=False,
+        default=None,
+        help="Maximum number of connections waiting to be accepted",
+        dest="backlog",
+    )
+    parser.add_argument(
+        "--limit-concurrency",
+        type=int,
+        required=False,
+        default=None,
+        help="Maximum number of concurrent connections or tasks before answering 503",
+        dest="limit_concurrency",
+    )
+    parser.add_argument(
+        "--metrics",
+        required=False,
+        default=False,
+        action="store_true",
+        dest="metrics",
+        help="Record request and client metrics, served on /metrics",
+    )
+    parser.add_argument(
+        "--json-response",
+        type=str,
+        required=False,
+        default=None,
+        choices=["fast", "default"],
+        help="Default JSON response class, fast needs orjson",
+        dest="json_response",
+    )
+    parser.add_argument(
+        "--no-compression",
+        required=False,
+        default=False,
+        action="store_true",
+        dest="no_compression",
+        help="Do not compress the responses",
+    )
+    parser.add_argument(
+        "--compression-min-size",
+        type=int,
+        required=False,
+        default=None,
+        help="Smallest response to compress, in bytes",
+        dest="compression_min_size",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        required=False,
+        default=None,
+        help="Requests served at once by each worker, past which they wait in a queue",
+        dest="max_concurrency",
+    )
+    parser.add_argument(
+        "--max-queue",
+        type=int,
+        required=False,
+        default=None,
+        help="Requests waiting for a slot, past which they get a 503",
+        dest="max_queue",
+    )
+    parser.add_argument(
+        "--max-queue-wait",
+        type=float,
+        required=False,
+        default=None,
+        help="Seconds a request waits for a slot, before getting a 503",
+        dest="max_queue_wait",
+    )
+    parser.add_argument(
+        "--route-limit",
+        action="append",
+        required=False,
+        default=None,
+        help="Requests served at once under a path prefix, as /prefix=limit",
+        dest="route_limits",
+    )
+    parser.add_argument(
+        "--log-sample-rate",
+        type=float,
+        required=False,
+        default=None,
+        help="Fraction of the requests that get an access line",
+        dest="log_sample_rate",
+    )
+    parser.add_argument(
+        "--log-slow-ms",
+        type=float,
+        required=False,
+        default=None,
+        help="Requests slower than this always get an access line",
+        dest="log_slow_ms",
+    )
+    parser.add_argument(
+        "--command-workers",
+        type=int,
+        required=False,
+        default=None,
+        help="Background commands run at once",
+        dest="command_workers",
+    )
+    parser.add_argument(
+        "--command-queue-size",
+        type=int,
+        required=False,
+        default=None,
+        help="Background commands waiting to run, before run_command blocks",
+        dest="command_queue_size",
+    )
+    parser.add_argument(
+        "--command-async-limit",
+        type=int,
+        required=False,
+        default=None,
+        help="Async commands run at once, per event loop",
+        dest="command_async_limit",
+    )
+    parser.add_argument(
+        "--dynamo-write-behind",
+        required=False,
+        default=False,
+        action="store_true",
+        dest="dynamo_write_behind",
+        help="Buffer the DynamoDb writes and send them in batches in the background",
+    )
+    parser.add_argument(
+        "--dynamo-flush-interval",
+        type=float,
+        required=False,
+        default=None,
+        help="Seconds between the batches of the DynamoDb writes",
+        dest="dynamo_flush_interval",
+    )
+    parser.add_argument(
+        "--cloudwatch-metrics",
+        choices=["emf", "api"],
+        required=False,
+        default=None,
+        help="Publish the metrics to CloudWatch, as EMF log lines or with PutMetricData",
+        dest="cloudwatch_metrics",
+    )
+    parser.add_argument(
+        "--cloudwatch-namespace",
+        required=False,
+        default=None,
+        help="Namespace of the CloudWatch metrics",
+        dest="cloudwatch_namespace",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        required=False,
+        default=None,
+        help="Seconds between the publications of the CloudWatch metrics",
+        dest="metrics_interval",
+    )
     args = parser.parse_args()
     cwd: Path = Path(args.cwd)
     port: int = args.port
@@ -165,6 +413,67 @@ def get_args() -> (  # noqa: C901, PLR0915 # pylint: disable=too-many-locals
         environ["STRIPE_ENDPOINT_URL"] = stripe_endpoint
     if secrets:
         environ["SECRET_NAME"] = secrets
+    if args.secrets_ttl is not None:
+        environ["SECRETS_TTL"] = str(args.secrets_ttl)
+    if args.secrets_snapshot:
+        environ["SECRETS_SNAPSHOT"] = args.secrets_snapshot
+    if args.routes_cache:
+        environ["ROUTES_CACHE"] = args.routes_cache
+    if args.routes_depth is not None:
+        environ["ROUTES_MAX_DEPTH"] = str(args.routes_depth)
+    if args.lazy:
+        environ["LAZY_ROUTES"] = "true"
+    if args.preload:
+        environ["ROUTES_PRELOAD"] = ",".join(args.preload)
+    if args.workers is not None:
+        environ["UVICORN_WORKERS"] = str(args.workers)
+    if args.loop:
+        environ["UVICORN_LOOP"] = args.loop
+    if args.http:
+        environ["UVICORN_HTTP"] = args.http
+    if args.backlog is not None:
+        environ["UVICORN_BACKLOG"] = str(args.backlog)
+    if args.limit_concurrency is not None:
+        environ["UVICORN_LIMIT_CONCURRENCY"] = str(args.limit_concurrency)
+    if args.metrics:
+        environ["METRICS"] = "true"
+    if args.json_response:
+        environ["JSON_RESPONSE"] = args.json_response
+    if args.no_compression:
+        environ["COMPRESSION"] = "false"
+    if args.compression_min_size is not None:
+        environ["COMPRESSION_MIN_SIZE"] = str(args.compression_min_size)
+    if args.max_concurrency is not None:
+        environ["MAX_CONCURRENCY"] = str(args.max_concurrency)
+    if args.max_queue is not None:
+        environ["MAX_QUEUE"] = str(args.max_queue)
+    if args.max_queue_wait is not None:
+        environ["MAX_QUEUE_WAIT"] = str(args.max_queue_wait)
+    if args.route_limits:
+        environ["ROUTE_LIMITS"] = ",".join(args.route_limits)
+    if args.log_sample_rate is not None:
+        environ["LOG_SAMPLE_RATE"] = str(args.log_sample_rate)
+    if args.log_slow_ms is not None:
+        environ["LOG_SLOW_MS"] = str(args.log_slow_ms)
+    if args.command_workers is not None:
+        environ["COMMAND_WORKERS"] = str(args.command_workers)
+    if args.command_queue_size is not None:
+        environ["COMMAND_QUEUE_SIZE"] = str(args.command_queue_size)
+    if args.command_async_limit is not None:
+        environ["COMMAND_ASYNC_LIMIT"] = str(args.command_async_limit)
+    if args.dynamo_write_behind:
+        environ["DYNAMO_WRITE_BEHIND"] = "true"
+    if args.dynamo_flush_interval is not None:
+        environ["DYNAMO_FLUSH_INTERVAL"] = str(args.dynamo_flush_interval)
+    if args.cloudwatch_metrics:
+        environ["CLOUDWATCH_METRICS"] = args.cloudwatch_metrics
+    if args.cloudwatch_namespace:
+        environ["CLOUDWATCH_NAMESPACE"] = args.cloudwatch_namespace
+    if args.metrics_interval is not None:
+        environ["METRICS_INTERVAL"] = str(args.metrics_interval)
+    # Read back by the app factory, in every worker
+    environ["ROUTES_FOLDERS"] = pathsep.join(str(route) for route in routes)
+    environ["ROUTES_CWD"] = str(cwd)
     if sub is not None and __debug__:
         environ["FIXED_USER"] = sub
     if email is not None and __debug__:
@@ -180,4 +489,16 @@ def get_args() -> (  # noqa: C901, PLR0915 # pylint: disable=too-many-locals
     return routes, cwd, host, port, is_mock
 
 
-__all__ = ["get_args"]
+def get_server_options() -> "ServerOptions":
+    """Get the uvicorn options set by `get_args`"""
+    limit_concurrency: str | None = environ.get("UVICORN_LIMIT_CONCURRENCY")
+    return {
+        "workers": int(environ.get("UVICORN_WORKERS", "1")),
+        "loop": environ.get("UVICORN_LOOP", "auto"),  # type: ignore[typeddict-item]
+        "http": environ.get("UVICORN_HTTP", "auto"),  # type: ignore[typeddict-item]
+        "backlog": int(environ.get("UVICORN_BACKLOG", "2048")),
+        "limit_concurrency": int(limit_concurrency) if limit_concurrency else None,
+    }
+
+
+__all__ = ["get_args", "get_server_options"]
@@ -6,13 +6,10 @@ from typing import (
     Type,
     TypeVar,
     Literal,
+    cast,
     overload,
 )
 from importlib import import_module
-from importlib.util import (
-    spec_from_file_location,
-    module_from_spec,
-)
 from sys import modules
 from types import ModuleType
 from inspect import isclass
@@ -26,9 +23,117 @@ class ModuleLoadingError(Exception):
 T = TypeVar("T")
 
 
+def _package_name(cwd: str | None, folder_name: str) -> tuple[Path, str]:
+    """Validate the routes folder and get its dotted package name"""
+    if cwd is None:
+        cwd = getcwd()
+    if isfile(cwd):
+        cwd = dirname(cwd)
+    cwd = str(Path(cwd).absolute())
+    if not cwd.endswith(sep):
+        cwd += sep
+    if not isdir(cwd + folder_name):
+        raise ModuleLoadingError(
+            f"Folder '{cwd + folder_name}' not found",
+        )
+    if not isfile(cwd + folder_name + sep + "__init__.py"):
+        raise ModuleLoadingError(
+            "No __init__.py in folder",
+        )
+    folder = Path(cwd + folder_name)
+    return folder, str(folder.relative_to(getcwd())).replace(sep, ".")
+
+
+def _import_package(package: str, folder_name: str) -> ModuleType:
+    """Import the package once and alias it by folder name"""
+    try:
+        mod: ModuleType = import_module(package)
+    except ImportError as err:  # pragma: no cover
+        raise ModuleLoadingError(
+            "Could not load modules",
+        ) from err
+    modules[folder_name] = mod
+    return mod
+
+
+def _in_package(mod: ModuleType, package: str) -> bool:
+    """Check if a module is the package or one of its submodules"""
+    return mod.__name__ == package or mod.__name__.startswith(package + ".")
+
+
+def _find_in_module(  # noqa: C901
+    mod: ModuleType,
+    find_type: Type[T],
+    instance: bool,
+    max_depth: int | None = None,
+) -> list[tuple[str, str, object]]:
+    """Find the types in a package, with the module and attribute they were found in
+
+    Only the package and its submodules are walked, each one once, in `dir()` order: \
+    modules re-exported from the standard library or third party packages are skipped, \
+    and an object reachable from more than one module is returned only the first time.
+    """
+    found: list[tuple[str, str, object]] = []
+    seen: set[int] = set()
+    visited: set[int] = set()
+    package: str = mod.__name__
+
+    def _recursive_load(
+        obj: object | None,
+        name: str,
+        owner: str,
+        depth: int,
+    ) -> None:
+        if isinstance(obj, ModuleType):
+            if (
+                id(obj) in visited
+                or not _in_package(obj, package)
+                or (max_depth is not None and depth > max_depth)
+            ):
+                return
+            visited.add(id(obj))
+            for mod_var in dir(obj):
+                _recursive_load(
+                    getattr(obj, mod_var, None),
+                    mod_var,
+                    obj.__name__,
+                    depth + 1,
+                )
+        elif obj is not None:
+            if name.startswith("_") and __debug__ is False:  # pragma: no cover
+                return
+            if id(obj) in seen:
+                return
+            if instance is False and obj is find_type:
+                return
+            if (
+                instance is False
+                and isclass(
+                    obj,
+                )
+                and issubclass(
+                    obj,
+                    find_type,
+                )
+            ) or (
+                instance is True
+                and isinstance(
+                    obj,
+                    find_type,
+                )
+            ):
+                seen.add(id(obj))
+                found.append((owner, name, obj))
+
+    _recursive_load(mod, package, package, 0)
+    return found
+
+
 @overload
 def load_types(
     find_type: Type[T],
+    *,
+    max_depth: int | None = ...,
 ) -> list[T]:  # pragma: no cover
     """Load types"""
 
@@ -38,6 +143,7 @@ def load_types(
     find_type: Type[T],
     *,
     cwd: str | None,
+    max_depth: int | None = ...,
 ) -> list[T]:  # pragma: no cover
     """Load types"""
 
@@ -47,6 +153,7 @@ def load_types(
     find_type: Type[T],
     *,
     folder_name: str,
+    max_depth: int | None = ...,
 ) -> list[T]:  # pragma: no cover
     """Load types"""
 
@@ -57,6 +164,7 @@ def load_types(
     *,
     cwd: str | None,
     folder_name: str,
+    max_depth: int | None = ...,
 ) -> list[T]:  # pragma: no cover
     """Load types"""
 
@@ -66,6 +174,7 @@ def load_types(
     find_type: Type[T],
     *,
     instance: Literal[True],
+    max_depth: int | None = ...,
 ) -> list[T]:  # pragma: no cover
     """Load types"""
 
@@ -76,6 +185,7 @@ def load_types(
     *,
     instance: Literal[True],
     cwd: str | None,
+    max_depth: int | None = ...,
 ) -> list[T]:  # pragma: no cover
     """Load types"""
 
@@ -86,6 +196,7 @@ def load_types(
     *,
     instance: Literal[True],
     folder_name: str,
+    max_depth: int | None = ...,
 ) -> list[T]:  # pragma: no cover
     """Load types"""
 
@@ -97,6 +208,7 @@ def load_types(
     instance: Literal[True],
     cwd: str | None,
     folder_name: str,
+    max_depth: int | None = ...,
 ) -> list[T]:  # pragma: no cover
     """Load types"""
 
@@ -106,6 +218,7 @@ def load_types(
     find_type: Type[T],
     *,
     instance: Literal[False],
+    max_depth: int | None = ...,
 ) -> list[Type[T]]:  # pragma: no cover
     """Load types"""
 
@@ -116,6 +229,7 @@ def load_types(
     *,
     instance: Literal[False],
     cwd: str | None,
+    max_depth: int | None = ...,
 ) -> list[Type[T]]:  # pragma: no cover
     """Load types"""
 
@@ -126,6 +240,7 @@ def load_types(
     *,
     instance: Literal[False],
     folder_name: str,
+    max_depth: int | None = ...,
 ) -> list[Type[T]]:  # pragma: no cover
     """Load types"""
 
@@ -137,16 +252,18 @@ def load_types(
     instance: Literal[False],
     cwd: str | None,
     folder_name: str,
+    max_depth: int | None = ...,
 ) -> list[Type[T]]:  # pragma: no cover
     """Load types"""
 
 
-def load_types(  # noqa: C901
+def load_types(
     find_type: Type[T],
     *,
     instance: bool = True,
     cwd: str | None = None,
     folder_name: str = "src",
+    max_depth: int | None = None,
 ) -> list[Type[T]] | list[T]:
     """Load all instances or classes found in a module \
     in the current working directory
@@ -159,92 +276,23 @@ def load_types(  # noqa: C901
             directory. Defaults to None.
         folder_name (str, optional): The name of the module\
             to load. Defaults to "src".
+        max_depth (int | None, optional): How many levels of \
+            submodules to walk, 0 being only the package itself. \
+            Defaults to None, that walks all of them.
 
     Raises:
         ModuleLoadingError: If it cannot load the modules
 
     Returns:
-        list[Type[T]] | list[T]: The classes or instances found
+        list[Type[T]] | list[T]: The classes or instances found, \
+            each once, in a deterministic order
     """
-    _types: list[Type[T]] = []
-    _instances: list[T] = []
-    if cwd is None:
-        cwd = getcwd()
-    if isfile(cwd):
-        cwd = dirname(cwd)
-
-    def _recursive_load(
-        mod: object | None,
-        name: str,
-    ) -> None:
-        if isinstance(mod, ModuleType):
-            for mod_var in dir(mod):
-                _recursive_load(
-                    getattr(mod, mod_var, None),
-                    mod_var,
-                )
-        elif mod is not None:
-            if name.startswith("_") and __debug__ is False:  # pragma: no cover
-                return
-            if (
-                instance is False
-                and isclass(
-                    mod,
-                )
-                and issubclass(
-                    mod,
-                    find_type,
-                )
-            ):
-                _types.append(mod)
-            elif instance is True and isinstance(
-                mod,
-                find_type,
-            ):
-                _instances.append(mod)
-
-    cwd = str(Path(cwd).absolute())
-    if not cwd.endswith(sep):
-        cwd += sep
-    if not isdir(cwd + folder_name):
-        raise ModuleLoadingError(
-            f"Folder '{cwd + folder_name}' not found",
-        )
-        # Trying to load files dynamically
-    if not isfile(cwd + folder_name + sep + "__init__.py"):
-        raise ModuleLoadingError(
-            "No __init__.py in folder",
-        )
-    # if folder_name in modules:
-    #     return  # It's already loaded
-    relative = str(Path(cwd + folder_name).relative_to(getcwd())).replace(sep, ".")
-    import_module(relative)
-    # Modules loaded correctly
-
-    init_py = Path(cwd + folder_name + sep + "__init__.py")
-
-    spec = spec_from_file_location(relative, init_py)
-    if spec is None:  # pragma: no cover
-        raise ModuleLoadingError(
-            "Could not load modules",
-        )
-    mod: ModuleType = module_from_spec(spec)
-
-    modules[folder_name] = mod
-    if spec.loader is None:  # pragma: no cover
-        raise ModuleLoadingError(
-            "Could not load modules",
-        )
-    spec.loader.exec_module(mod)
-    # Load all modules
-    for mod_var in dir(mod):
-        _recursive_load(
-            getattr(mod, mod_var, None),
-            mod_var,
-        )
+    _, package = _package_name(cwd, folder_name)
+    mod = _import_package(package, folder_name)
+    found = _find_in_module(mod, find_type, instance, max_depth)
     if instance is True:
-        return _instances
-    return list({_t for _t in _types if _t is not find_type})
+        return [cast(T, obj) for _, _, obj in found]
+    return [cast(Type[T], obj) for _, _, obj in found]
 
 
-__all__ = ("load_types",)
+__all__ = ("load_types", "ModuleLoadingError")
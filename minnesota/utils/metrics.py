@@ -0,0 +1,368 @@
+"""In-process metrics"""
+
+from bisect import bisect_left
+from functools import wraps
+from threading import Lock, Thread, current_thread, local
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, Callable, ParamSpec, TypeVar
+from urllib.parse import urlsplit
+from ..aws.clients import add_client_hook
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import TypeAlias
+
+    Labels: TypeAlias = tuple[tuple[str, str], ...]
+    Key: TypeAlias = tuple[str, Labels]
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+HTTP_ERROR: int = 400
+
+BUCKETS: tuple[float, ...] = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+HELP: dict[str, str] = {
+    "minnesota_http_request_duration_seconds": "Request latency by route",
+    "minnesota_http_requests_total": "Requests by route and status code",
+    "minnesota_http_requests_in_flight": "Requests being served",
+    "minnesota_http_request_size_bytes_total": "Request payload bytes by route",
+    "minnesota_http_response_size_bytes_total": "Response payload bytes by route",
+    "minnesota_http_requests_shed_total": "Requests refused with a 503 by admission control",
+    "minnesota_outbound_request_duration_seconds": "Latency of AWS and Stripe calls",
+    "minnesota_outbound_errors_total": "Failed AWS and Stripe calls",
+    "minnesota_helper_duration_seconds": "Latency of the DynamoDb, S3Zip and Cognito helpers",
+    "minnesota_helper_errors_total": "Failed calls of the DynamoDb, S3Zip and Cognito helpers",
+    "minnesota_write_behind_dropped_total": "DynamoDb writes given up by the write-behind buffer",
+}
+
+
+class _Histogram:  # pylint: disable=too-few-public-methods
+    """Histogram with the fixed buckets"""
+
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self) -> None:
+        """Initialize an empty histogram"""
+        self.counts: list[int] = [0] * (len(BUCKETS) + 1)
+        self.total: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float) -> None:
+        """Add a value"""
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class _Shard:  # pylint: disable=too-few-public-methods
+    """Metrics written by a single thread"""
+
+    __slots__ = ("histograms", "counters")
+
+    def __init__(self) -> None:
+        """Initialize an empty shard"""
+        self.histograms: dict["Key", _Histogram] = {}
+        self.counters: dict["Key", float] = {}
+
+    def add(self, shard: "_Shard") -> None:
+        """Add up the metrics of another shard"""
+        # Copying a dict or a list holds the GIL, so the owner cannot resize it meanwhile
+        for key, histogram in dict(shard.histograms).items():
+            merged = self.histograms.get(key)
+            if merged is None:
+                merged = self.histograms[key] = _Histogram()
+            for i, count in enumerate(list(histogram.counts)):
+                merged.counts[i] += count
+            merged.total += histogram.total
+            merged.count += histogram.count
+        for key, value in dict(shard.counters).items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+class Metrics:
+    """Metrics registry.
+
+    Every thread writes to its own shard, so recording takes no lock: \
+    the shards are only merged when the metrics are rendered. The shards \
+    of the threads that exited, like the idle workers of the threadpool, \
+    are folded into a single one.
+    """
+
+    _local: local
+    _shards: dict[Thread, _Shard]
+    _exited: _Shard
+    _lock: Lock
+    _gauges: dict["Key", float]
+
+    def __init__(self) -> None:
+        """Initialize the registry"""
+        self._local = local()
+        self._shards = {}
+        self._exited = _Shard()
+        self._lock = Lock()
+        # Set, not added up, so shared by the threads
+        self._gauges = {}
+
+    def _shard(self) -> _Shard:
+        """Get the shard of the current thread"""
+        try:
+            shard: _Shard = self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._fold()
+                self._shards[current_thread()] = shard
+        return shard
+
+    def _fold(self) -> None:
+        """Fold the shards of the threads that exited, with the lock held"""
+        for thread in [thread for thread in self._shards if not thread.is_alive()]:
+            # Not written anymore, so added up at once
+            self._exited.add(self._shards.pop(thread))
+
+    def observe(self, name: str, labels: "Labels", value: float) -> None:
+        """Add a value to a histogram"""
+        histograms = self._shard().histograms
+        histogram = histograms.get((name, labels))
+        if histogram is None:
+            histogram = histograms[(name, labels)] = _Histogram()
+        histogram.observe(value)
+
+    def inc(self, name: str, labels: "Labels" = (), value: float = 1) -> None:
+        """Increment a counter, or a gauge if the value is negative"""
+        counters = self._shard().counters
+        counters[(name, labels)] = counters.get((name, labels), 0) + value
+
+    def set(self, name: str, labels: "Labels" = (), value: float = 0) -> None:
+        """Set a gauge"""
+        self._gauges[(name, labels)] = value
+
+    def gauges(self) -> dict["Key", float]:
+        """Get the gauges set"""
+        return dict(self._gauges)
+
+    def record_request(  # noqa: PLR0913, PLR0917 # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        method: str,
+        route: str,
+        status: int,
+        seconds: float,
+        request_size: int,
+        response_size: int,
+    ) -> None:
+        """Record a served request"""
+        labels: "Labels" = (("method", method), ("route", route))
+        self.observe("minnesota_http_request_duration_seconds", labels, seconds)
+        self.inc(
+            "minnesota_http_requests_total",
+            (*labels, ("status", str(status))),
+        )
+        if request_size:
+            self.inc("minnesota_http_request_size_bytes_total", labels, request_size)
+        if response_size:
+            self.inc("minnesota_http_response_size_bytes_total", labels, response_size)
+
+    def record_outbound(
+        self,
+        client: str,
+        operation: str,
+        seconds: float,
+        failed: bool = False,
+    ) -> None:
+        """Record a call to AWS or Stripe"""
+        labels: "Labels" = (("client", client), ("operation", operation))
+        self.observe("minnesota_outbound_request_duration_seconds", labels, seconds)
+        if failed:
+            self.inc("minnesota_outbound_errors_total", labels)
+
+    def merge(self) -> tuple[dict["Key", _Histogram], dict["Key", float]]:
+        """Merge the shards of all the threads"""
+        merged = _Shard()
+        with self._lock:
+            self._fold()
+            merged.add(self._exited)
+            for shard in self._shards.values():
+                merged.add(shard)
+        return merged.histograms, merged.counters
+
+    def render(self) -> str:
+        """Render the metrics in the Prometheus text format"""
+        histograms, counters = self.merge()
+        lines: list[str] = []
+        typed: set[str] = set()
+
+        def _header(name: str, kind: str) -> None:
+            if name in typed:
+                return
+            typed.add(name)
+            if name in HELP:
+                lines.append(f"# HELP {name} {HELP[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), histogram in sorted(histograms.items()):
+            _header(name, "histogram")
+            cumulative: int = 0
+            for bound, count in zip((*BUCKETS, "+Inf"), histogram.counts, strict=True):
+                cumulative += count
+                lines.append(
+                    f"{name}_bucket{_labels((*labels, ('le', str(bound))))} {cumulative}"
+                )
+            lines.append(f"{name}_sum{_labels(labels)} {histogram.total}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        for (name, labels), value in sorted(counters.items()):
+            _header(name, "gauge" if name.endswith("_in_flight") else "counter")
+            lines.append(f"{name}{_labels(labels)} {value:.15g}")
+        for (name, labels), value in sorted(self.gauges().items()):
+            _header(name, "gauge")
+            lines.append(f"{name}{_labels(labels)} {value:.15g}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: "Labels") -> str:
+    """Format labels"""
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            f'{key}="'
+            + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            + '"'
+            for key, value in labels
+        )
+        + "}"
+    )
+
+
+metrics: Metrics = Metrics()
+
+
+def timed(helper: str) -> Callable[[Callable[P, R]], Callable[P, R]]:
+    """Record the latency and the failures of a helper method, in memory only
+
+    Example:
+    ```python
+    class DynamoDb:
+        @timed("DynamoDb")
+        def get_item(self, item_id: str, sub: str) -> DynamoDbItem[T]:
+            ...
+    ```
+    """
+
+    def _decorator(func: Callable[P, R]) -> Callable[P, R]:
+        labels: "Labels" = (("helper", helper), ("operation", func.__name__))
+
+        @wraps(func)
+        def _timed(*args: P.args, **kwargs: P.kwargs) -> R:
+            started: float = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                metrics.inc("minnesota_helper_errors_total", labels)
+                raise
+            finally:
+                metrics.observe(
+                    "minnesota_helper_duration_seconds", labels, perf_counter() - started
+                )
+
+        return _timed
+
+    return _decorator
+
+
+def _before_call(context: dict[str, Any], **_: Any) -> None:
+    """Start timing an AWS call"""
+    context["minnesota_started"] = perf_counter()
+
+
+def _after_call(
+    model: Any,
+    context: dict[str, Any],
+    http_response: Any = None,
+    **_: Any,
+) -> None:
+    """Stop timing an AWS call"""
+    started: float | None = context.pop("minnesota_started", None)
+    if started is None:
+        return
+    status: int = getattr(http_response, "status_code", 500)
+    metrics.record_outbound(
+        f"aws.{model.service_model.service_name}",
+        model.name,
+        perf_counter() - started,
+        failed=status >= HTTP_ERROR,
+    )
+
+
+def _after_call_error(model: Any, context: dict[str, Any], **_: Any) -> None:
+    """Stop timing a failed AWS call"""
+    started: float | None = context.pop("minnesota_started", None)
+    if started is None:
+        return
+    metrics.record_outbound(
+        f"aws.{model.service_model.service_name}",
+        model.name,
+        perf_counter() - started,
+        failed=True,
+    )
+
+
+def _instrument_client(boto_client: Any) -> None:
+    """Time the calls of a boto3 client"""
+    events = boto_client.meta.events
+    events.register("before-call", _before_call, unique_id="minnesota-before-call")
+    events.register("after-call", _after_call, unique_id="minnesota-after-call")
+    events.register(
+        "after-call-error", _after_call_error, unique_id="minnesota-after-call-error"
+    )
+
+
+def instrument_botocore() -> None:
+    """Time the calls of all the boto3 clients created through `client`"""
+    add_client_hook(_instrument_client)
+
+
+def timed_http_client(http_client: Any) -> Any:
+    """Time the requests of a Stripe http client"""
+    request: Callable[..., Any] = http_client.request_with_retries
+
+    def request_with_retries(method: str, url: str, *args: Any, **kwargs: Any) -> Any:
+        """Time a Stripe request"""
+        # /v1/customers/cus_123 -> customers, to keep the ids out of the labels
+        resource: str = "".join(urlsplit(url).path.split("/")[2:3])
+        operation: str = f"{method.upper()} {resource}"
+        started: float = perf_counter()
+        try:
+            response = request(method, url, *args, **kwargs)
+        except Exception:
+            metrics.record_outbound("stripe", operation, perf_counter() - started, True)
+            raise
+        metrics.record_outbound(
+            "stripe", operation, perf_counter() - started, response[1] >= HTTP_ERROR
+        )
+        return response
+
+    http_client.request_with_retries = request_with_retries
+    return http_client
+
+
+__all__ = (
+    "BUCKETS",
+    "Metrics",
+    "metrics",
+    "instrument_botocore",
+    "timed",
+    "timed_http_client",
+)
@@ -0,0 +1,384 @@
+"""Cached registry of discovered types"""
+
+from contextlib import suppress
+from hashlib import sha256
+from importlib import import_module
+from importlib.abc import Loader, MetaPathFinder
+from importlib.machinery import ModuleSpec
+from json import dumps, loads
+from os import replace, sep, unlink
+from pathlib import Path
+from sys import meta_path
+from tempfile import mkstemp
+from time import perf_counter
+from types import ModuleType
+from typing import TYPE_CHECKING, Sequence, Type, TypeVar, cast
+
+from .loader import (
+    _find_in_module,
+    _import_package,
+    _package_name,
+)
+
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import TypedDict
+
+    class FileFingerprint(TypedDict):
+        """Fingerprint of a source file"""
+
+        mtime_ns: int
+        sha256: str
+
+    class ModuleTiming(TypedDict):
+        """Import time of a module"""
+
+        module: str
+        seconds: float
+        self_seconds: float
+
+    class LoadReport(TypedDict):
+        """Startup timing report"""
+
+        package: str
+        cached: bool
+        seconds: float
+        modules: list[ModuleTiming]
+
+
+T = TypeVar("T")
+
+CACHE_VERSION: int = 2
+
+
+class _TimingLoader(Loader):
+    """Loader wrapper that times the execution of a module"""
+
+    def __init__(self, loader: Loader, timer: "ImportTimer") -> None:
+        """Wrap a loader"""
+        self._loader = loader
+        self._timer = timer
+
+    def create_module(self, spec: ModuleSpec) -> ModuleType | None:
+        """Create the module with the wrapped loader"""
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module: ModuleType) -> None:
+        """Execute and time the module"""
+        # Put the original loader back, so nothing else sees the wrapper
+        module.__loader__ = self._loader
+        if module.__spec__ is not None:
+            module.__spec__.loader = self._loader
+        self._timer.start(module.__name__)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._timer.stop(module.__name__)
+
+
+class _TimingFinder(MetaPathFinder):
+    """Finder that wraps the loaders of the modules of a package"""
+
+    def __init__(self, timer: "ImportTimer") -> None:
+        """Initialize the finder"""
+        self._timer = timer
+
+    def find_spec(
+        self,
+        fullname: str,
+        path: Sequence[str] | None,
+        target: ModuleType | None = None,
+    ) -> ModuleSpec | None:
+        """Find the spec with the other finders and wrap its loader"""
+        if not self._timer.watches(fullname):
+            return None
+        for finder in meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec: ModuleSpec | None = finder.find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                spec.loader = _TimingLoader(spec.loader, self._timer)
+            return spec
+        return None
+
+
+class ImportTimer:
+    """Time the imports of the modules in a package.
+
+    Example:
+    ```python
+    with ImportTimer("routes") as timer:
+        import_module("routes")
+    print(timer.report())
+    ```
+    """
+
+    package: str
+    _finder: _TimingFinder
+    _stack: list[tuple[str, float, float]]
+    _timings: dict[str, tuple[float, float]]
+
+    def __init__(self, package: str) -> None:
+        """Initialize the timer for a package"""
+        self.package = package
+        self._finder = _TimingFinder(self)
+        self._stack = []
+        self._timings = {}
+
+    def watches(self, name: str) -> bool:
+        """Check if a module belongs to the package"""
+        return name == self.package or name.startswith(self.package + ".")
+
+    def start(self, name: str) -> None:
+        """Start timing a module"""
+        self._stack.append((name, perf_counter(), 0.0))
+
+    def stop(self, name: str) -> None:
+        """Stop timing a module"""
+        _, started, children = self._stack.pop()
+        elapsed: float = perf_counter() - started
+        self._timings[name] = (elapsed, elapsed - children)
+        if self._stack:
+            parent, parent_started, parent_children = self._stack[-1]
+            self._stack[-1] = (parent, parent_started, parent_children + elapsed)
+
+    def report(self) -> "list[ModuleTiming]":
+        """Get the timings, slowest first"""
+        return sorted(
+            (
+                {"module": name, "seconds": total, "self_seconds": own}
+                for name, (total, own) in self._timings.items()
+            ),
+            key=lambda timing: timing["seconds"],
+            reverse=True,
+        )
+
+    def __enter__(self) -> "ImportTimer":
+        """Install the finder"""
+        meta_path.insert(0, self._finder)
+        return self
+
+    # pylint: disable=unused-argument
+    def __exit__(self, exc_type, exc_value, traceback) -> None:  # type: ignore[no-untyped-def]
+        """Remove the finder"""
+        meta_path.remove(self._finder)
+
+
+def _fingerprint(
+    folder: Path,
+    previous: "dict[str, FileFingerprint] | None" = None,
+) -> "dict[str, FileFingerprint]":
+    """Fingerprint the sources in a folder, hashing only the files whose mtime changed"""
+    previous = previous or {}
+    files: dict[str, "FileFingerprint"] = {}
+    for path in sorted(folder.rglob("*.py")):
+        name: str = path.relative_to(folder).as_posix()
+        mtime_ns: int = path.stat().st_mtime_ns
+        known = previous.get(name)
+        if known is not None and known["mtime_ns"] == mtime_ns:
+            files[name] = known
+            continue
+        files[name] = {
+            "mtime_ns": mtime_ns,
+            "sha256": sha256(path.read_bytes()).hexdigest(),
+        }
+    return files
+
+
+def _same_sources(
+    files: "dict[str, FileFingerprint]",
+    cached: "dict[str, FileFingerprint]",
+) -> bool:
+    """Check if the sources did not change since they were cached"""
+    if files.keys() != cached.keys():
+        return False
+    return all(files[name]["sha256"] == cached[name]["sha256"] for name in files)
+
+
+def _type_name(find_type: type) -> str:
+    """Get the qualified name of a type"""
+    return f"{find_type.__module__}.{find_type.__qualname__}"
+
+
+def _read_cache(cache_file: Path) -> dict[str, object] | None:
+    """Read a cache file, if valid"""
+    try:
+        data: object = loads(cache_file.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get("version") != CACHE_VERSION:
+        return None
+    return data
+
+
+def _write_cache(cache_file: Path, data: dict[str, object]) -> None:
+    """Write the cache file atomically, through a temporary file of its own, \
+    as the workers starting together write it at once"""
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    descriptor, tmp_file = mkstemp(
+        dir=cache_file.parent, prefix=f".{cache_file.name}.", suffix=".tmp"
+    )
+    try:
+        with open(descriptor, "w", encoding="utf-8") as file:
+            file.write(dumps(data, indent=2))
+        replace(tmp_file, cache_file)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            unlink(tmp_file)
+        raise
+
+
+def _load_from_cache(
+    find_type: Type[T],
+    entries: list[list[str]],
+) -> list[T] | None:
+    """Import only the cached modules and get the cached attributes"""
+    found: list[T] = []
+    for module_name, attr, *_ in entries:
+        try:
+            obj: object = getattr(import_module(module_name), attr)
+        except (ImportError, AttributeError):
+            return None
+        if not isinstance(obj, find_type):
+            return None
+        found.append(obj)
+    return found
+
+
+def _cached_entries(
+    cached: dict[str, object] | None,
+    files: "dict[str, FileFingerprint]",
+    key: list[object],
+) -> list[list[str]] | None:
+    """Get the entries of a cache, if it is still valid"""
+    if (
+        cached is None
+        or cached.get("key") != key
+        or not _same_sources(files, cast("dict[str, FileFingerprint]", cached["files"]))
+    ):
+        return None
+    return cast(list[list[str]], cached["entries"])
+
+
+def _open_cache(
+    cache_file: Path,
+    folder: Path,
+) -> "tuple[dict[str, object] | None, dict[str, FileFingerprint]]":
+    """Read a cache and fingerprint the current sources"""
+    cached = _read_cache(cache_file)
+    previous = cast("dict[str, FileFingerprint]", cached["files"]) if cached else None
+    return cached, _fingerprint(folder, previous)
+
+
+def read_manifest(
+    find_type: type,
+    *,
+    cwd: str | None = None,
+    folder_name: str = "src",
+    cache_file: str | Path,
+    max_depth: int | None = None,
+) -> list[list[str]] | None:
+    """Read the entries of a discovery cache without importing anything
+
+    Args:
+        find_type (type): The type the cache was built for.
+        cwd (str | None, optional): The current working \
+            directory. Defaults to None.
+        folder_name (str, optional): The name of the module\
+            to load. Defaults to "src".
+        cache_file (str | Path): The cache file.
+        max_depth (int | None, optional): How many levels of \
+            submodules were walked. Defaults to None.
+
+    Returns:
+        list[list[str]] | None: The `[module, attribute, prefix]` entries, \
+            or None if there is no cache or a source changed since it was written
+    """
+    folder, package = _package_name(cwd, folder_name)
+    cached, files = _open_cache(Path(cache_file), folder)
+    return _cached_entries(cached, files, [package, _type_name(find_type), max_depth])
+
+
+def cache_path(cache_dir: str | Path, folder_name: str) -> Path:
+    """Get the cache file for a routes folder"""
+    return Path(cache_dir).joinpath(
+        folder_name.strip(sep).replace(sep, "_").replace(".", "_") + ".json"
+    )
+
+
+def load_cached_types(  # pylint: disable=too-many-locals
+    find_type: Type[T],
+    *,
+    cwd: str | None = None,
+    folder_name: str = "src",
+    cache_file: str | Path | None = None,
+    max_depth: int | None = None,
+) -> "tuple[list[T], LoadReport]":
+    """Load all instances of a type found in a module, using a discovery cache
+
+    The first load walks the package like `load_types` and records, in the cache file, \
+    the module and attribute where every instance was found, together with the mtime \
+    and hash of every source file. Later loads, if no source changed, import only \
+    those modules and skip the walk.
+
+    Args:
+        find_type (Type[T]): The type to look for.
+        cwd (str | None, optional): The current working \
+            directory. Defaults to None.
+        folder_name (str, optional): The name of the module\
+            to load. Defaults to "src".
+        cache_file (str | Path | None, optional): The cache file. \
+            Defaults to None, that disables the cache.
+        max_depth (int | None, optional): How many levels of \
+            submodules to walk. Defaults to None, that walks all of them.
+
+    Raises:
+        ModuleLoadingError: If it cannot load the modules
+
+    Returns:
+        tuple[list[T], LoadReport]: The instances found and the timing report
+    """
+    started: float = perf_counter()
+    folder, package = _package_name(cwd, folder_name)
+    path: Path | None = Path(cache_file) if cache_file is not None else None
+    key: list[object] = [package, _type_name(find_type), max_depth]
+    cached, files = _open_cache(path, folder) if path is not None else (None, {})
+    found: list[T] | None = None
+    entries = _cached_entries(cached, files, key)
+    with ImportTimer(package) as timer:
+        if entries is not None:
+            found = _load_from_cache(find_type, entries)
+            if found is not None:
+                _import_package(package, folder_name)
+        is_cached: bool = found is not None
+        if found is None:
+            mod = _import_package(package, folder_name)
+            found, entries = [], []
+            for owner, name, obj in _find_in_module(
+                mod, find_type, True, max_depth
+            ):
+                # The prefix lets lazy mounting route requests before importing
+                entries.append([owner, name, str(getattr(obj, "prefix", ""))])
+                found.append(cast(T, obj))
+    if path is not None and (not is_cached or cached is None or files != cached["files"]):
+        # A read-only filesystem only costs the next start a walk
+        with suppress(OSError):
+            _write_cache(
+                path,
+                {
+                    "version": CACHE_VERSION,
+                    "key": key,
+                    "files": files,
+                    "entries": entries,
+                },
+            )
+    return found, {
+        "package": package,
+        "cached": is_cached,
+        "seconds": perf_counter() - started,
+        "modules": timer.report(),
+    }
+
+
+__all__ = ("ImportTimer", "cache_path", "load_cached_types", "read_manifest")
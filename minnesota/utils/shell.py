@@ -1,34 +1,548 @@
 """Shell utils"""
 
+from asyncio import (
+    AbstractEventLoop,
+    Queue,
+    Semaphore,
+    create_subprocess_exec,
+    create_subprocess_shell,
+    create_task,
+    get_running_loop,
+    wait_for,
+)
+from asyncio.subprocess import Process
+from atexit import register
+from collections.abc import AsyncIterator, Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from inspect import isawaitable
 from logging import Logger
-from os import environ
+from os import environ, killpg, name as os_name
 from pathlib import Path
-from subprocess import run as subrun  # nosec
-from threading import Thread
+from queue import Full
+from signal import SIGKILL
+from subprocess import PIPE, CalledProcessError, Popen, TimeoutExpired  # nosec
+from threading import BoundedSemaphore, Lock
+from time import monotonic, perf_counter
+from typing import TYPE_CHECKING, Any, Literal, overload
+from weakref import WeakKeyDictionary
 
+if TYPE_CHECKING:  # pragma: no cover
+    from typing import TypedDict
 
-def run_command(
+    class CommandResult(TypedDict):
+        """Outcome of a command"""
+
+        args: str | list[str]
+        returncode: int
+        stdout: str
+        stderr: str
+        duration: float
+        timed_out: bool
+
+
+def _log_command(full_cmd: str, logger: Logger | None) -> None:
+    """Log the command line"""
+    if logger is not None:
+        logger.info(f"Running: {full_cmd}")
+    else:
+        print(f"Running: {full_cmd}")
+
+
+def _kill(process: "Popen[str] | Process") -> None:
+    """Kill a process, with its children when it has its own process group"""
+    if (process.poll() if isinstance(process, Popen) else process.returncode) is not None:
+        return
+    if os_name == "posix":
+        try:
+            killpg(process.pid, SIGKILL)
+            return
+        except OSError:
+            pass
+    process.kill()
+
+
+class _Command:  # pylint: disable=too-few-public-methods
+    """The process of a queued command, once started"""
+
+    __slots__ = ("process", "cancelled")
+
+    def __init__(self) -> None:
+        """Initialize a command not started yet"""
+        self.process: "Popen[str] | None" = None
+        self.cancelled: bool = False
+
+
+class CommandExecutor:
+    """Run commands on a bounded pool of threads.
+
+    At most `max_workers` commands run at once, and at most `max_queue` more wait: \
+    past that, `submit` blocks, or raises `queue.Full` when not blocking.
+
+    Example:
+    ```python
+    executor = CommandExecutor(max_workers=2)
+    future = executor.submit("ls", "-la", shell=False, timeout=10, capture=True)
+    print(future.result()["stdout"])
+    ```
+    """
+
+    max_workers: int
+    max_queue: int
+    _pool: ThreadPoolExecutor
+    _slots: BoundedSemaphore
+    _commands: "dict[Future[CommandResult], _Command]"
+    _lock: Lock
+
+    def __init__(self, max_workers: int = 4, max_queue: int = 100) -> None:
+        """Initialize the executor"""
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="command")
+        self._slots = BoundedSemaphore(max_workers + max_queue)
+        self._commands = {}
+        self._lock = Lock()
+
+    def submit(  # noqa: PLR0913 # pylint: disable=too-many-arguments
+        self,
+        *cmd: str,
+        shell: bool = True,
+        cwd: str | None | Path = None,
+        timeout: float | None = None,
+        check: bool = False,
+        capture: bool = False,
+        logger: Logger | None = None,
+        block: bool = True,
+        queue_timeout: float | None = None,
+    ) -> "Future[CommandResult]":
+        """Queue a command
+
+        Args:
+            *cmd (str): The command, joined with spaces when run through the shell, \
+                or the argv list otherwise.
+            shell (bool, optional): Run it through the shell. Defaults to True.
+            cwd (str | None | Path, optional): The working directory. Defaults to None.
+            timeout (float | None, optional): Seconds before the command is killed. \
+                Defaults to None.
+            check (bool, optional): Fail the future with CalledProcessError \
+                on a non zero exit code. Defaults to False.
+            capture (bool, optional): Collect stdout and stderr, instead of \
+                inheriting them. Defaults to False.
+            logger (Logger | None, optional): Logger for the command line. Defaults to None.
+            block (bool, optional): Wait for room in the queue. Defaults to True.
+            queue_timeout (float | None, optional): Seconds to wait for room \
+                in the queue. Defaults to None, that waits forever.
+
+        Raises:
+            Full: If the queue is full and not blocking, or still full after `queue_timeout`
+
+        Returns:
+            Future[CommandResult]: The outcome of the command
+        """
+        # Released by _done
+        if not self._slots.acquire(  # pylint: disable=consider-using-with
+            blocking=block, timeout=queue_timeout if block else None
+        ):
+            raise Full("Too many commands queued")
+        command: _Command = _Command()
+        try:
+            future: "Future[CommandResult]" = self._pool.submit(
+                self._run, command, list(cmd), shell, cwd, timeout, check, capture, logger
+            )
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._commands[future] = command
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future: "Future[CommandResult]") -> None:
+        """Free the slot of a command"""
+        with self._lock:
+            self._commands.pop(future, None)
+        self._slots.release()
+
+    @staticmethod
+    def _run(  # noqa: PLR0913, PLR0917 # pylint: disable=too-many-arguments,too-many-positional-arguments
+        command: _Command,
+        cmd: list[str],
+        shell: bool,
+        cwd: str | None | Path,
+        timeout: float | None,
+        check: bool,
+        capture: bool,
+        logger: Logger | None,
+    ) -> "CommandResult":
+        """Run a command, on a thread of the pool"""
+        args: str | list[str] = " ".join(cmd) if shell else cmd
+        _log_command(" ".join(cmd), logger)
+        started: float = perf_counter()
+        timed_out: bool = False
+        with Popen(  # nosec
+            args,
+            shell=shell,
+            env=environ,
+            cwd=cwd,
+            stdout=PIPE if capture else None,
+            stderr=PIPE if capture else None,
+            text=True,
+            # Its own process group, so a timeout kills the children of the shell too
+            start_new_session=os_name == "posix",
+        ) as process:
+            command.process = process
+            if command.cancelled:
+                _kill(process)
+            try:
+                stdout, stderr = process.communicate(timeout=timeout)
+            except TimeoutExpired:
+                timed_out = True
+                _kill(process)
+                stdout, stderr = process.communicate()
+        result: "CommandResult" = {
+            "args": args,
+            "returncode": process.returncode,
+            "stdout": stdout or "",
+            "stderr": stderr or "",
+            "duration": perf_counter() - started,
+            "timed_out": timed_out,
+        }
+        if check and process.returncode != 0:
+            raise CalledProcessError(process.returncode, args, stdout, stderr)
+        return result
+
+    def cancel(self, future: "Future[CommandResult]") -> bool:
+        """Cancel a queued command, or kill a running one
+
+        Returns:
+            bool: True if it was still queued or running
+        """
+        if future.cancel():
+            return True
+        with self._lock:
+            command = self._commands.get(future)
+        if command is None:
+            return False
+        command.cancelled = True
+        if command.process is not None:
+            _kill(command.process)
+        return True
+
+    def shutdown(self, wait: bool = True, cancel: bool = False) -> None:
+        """Stop the executor, killing the running commands if cancelling"""
+        if cancel:
+            with self._lock:
+                futures = list(self._commands)
+            for future in futures:
+                self.cancel(future)
+        self._pool.shutdown(wait=wait, cancel_futures=cancel)
+
+
+_executors: list[CommandExecutor] = []
+_executors_lock: Lock = Lock()
+
+
+def get_executor() -> CommandExecutor:
+    """Get the executor of the background commands, sized by `COMMAND_WORKERS` \
+    and `COMMAND_QUEUE_SIZE`"""
+    with _executors_lock:
+        if not _executors:
+            _executors.append(
+                CommandExecutor(
+                    max_workers=int(environ.get("COMMAND_WORKERS", "4")),
+                    max_queue=int(environ.get("COMMAND_QUEUE_SIZE", "100")),
+                )
+            )
+            register(_executors[0].shutdown, wait=False, cancel=True)
+        return _executors[0]
+
+
+@overload
+def run_command(  # noqa: PLR0913 # pylint: disable=too-many-arguments
+    *cmd: str,
+    background: Literal[True] = True,
+    check: bool = False,
+    capture: bool = False,
+    cwd: str | None | Path = None,
+    logger: Logger | None = None,
+    shell: bool = True,
+    timeout: float | None = None,
+) -> "Future[CommandResult]":
+    """Run a command in the background"""
+
+
+@overload
+def run_command(  # noqa: PLR0913 # pylint: disable=too-many-arguments
+    *cmd: str,
+    background: Literal[False],
+    check: bool = False,
+    capture: bool = False,
+    cwd: str | None | Path = None,
+    logger: Logger | None = None,
+    shell: bool = True,
+    timeout: float | None = None,
+) -> "CommandResult":
+    """Run a command and wait for it"""
+
+
+def run_command(  # noqa: PLR0913 # pylint: disable=too-many-arguments
     *cmd: str,
     background: bool = True,
     check: bool = False,
+    capture: bool = False,
     cwd: str | None | Path = None,
     logger: Logger | None = None,
-) -> None:
-    """Run a command."""
-
-    def runner() -> None:
-        """Run the command."""
-        full_cmd: str = " ".join(cmd)
-        if logger is not None:
-            logger.info(f"Running: {full_cmd}")
-        else:
-            print(f"Running: {full_cmd}")
-        subrun(full_cmd, check=check, env=environ, cwd=cwd, shell=True)  # nosec
+    shell: bool = True,
+    timeout: float | None = None,
+) -> "Future[CommandResult] | CommandResult":
+    """Run a command.
 
+    In the background, the command is queued on the executor of `get_executor`, \
+    so a burst of commands cannot start unbounded threads and processes.
+
+    Args:
+        *cmd (str): The command, joined with spaces when run through the shell, \
+            or the argv list otherwise.
+        background (bool, optional): Do not wait for it. Defaults to True.
+        check (bool, optional): Raise CalledProcessError on a non zero exit code. \
+            Defaults to False.
+        capture (bool, optional): Collect stdout and stderr in the result, instead of \
+            inheriting them. Defaults to False.
+        cwd (str | None | Path, optional): The working directory. Defaults to None.
+        logger (Logger | None, optional): Logger for the command line. Defaults to None.
+        shell (bool, optional): Run it through the shell. Defaults to True.
+        timeout (float | None, optional): Seconds before the command is killed. \
+            Defaults to None.
+
+    Returns:
+        Future[CommandResult] | CommandResult: The future of the outcome in the \
+            background, or else the outcome
+    """
     if background:
-        Thread(target=runner).start()
-    else:
-        runner()
+        return get_executor().submit(
+            *cmd,
+            shell=shell,
+            cwd=cwd,
+            timeout=timeout,
+            check=check,
+            capture=capture,
+            logger=logger,
+        )
+    return CommandExecutor._run(  # pylint: disable=protected-access
+        _Command(), list(cmd), shell, cwd, timeout, check, capture, logger
+    )
+
+
+# Longest line read from a command, past that the line is split
+LINE_LIMIT: int = 1024 * 1024
+
+_async_slots: "WeakKeyDictionary[AbstractEventLoop, Semaphore]" = WeakKeyDictionary()
+
+
+def _async_slot() -> Semaphore:
+    """Get the semaphore of the async commands of the running loop, \
+    sized by `COMMAND_ASYNC_LIMIT`"""
+    loop: AbstractEventLoop = get_running_loop()
+    slot: Semaphore | None = _async_slots.get(loop)
+    if slot is None:
+        slot = Semaphore(int(environ.get("COMMAND_ASYNC_LIMIT", "8")))
+        _async_slots[loop] = slot
+    return slot
+
+
+async def _command_lines(  # noqa: C901, PLR0913, PLR0917
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    cmd: list[str],
+    shell: bool,
+    cwd: str | None | Path,
+    timeout: float | None,
+    logger: Logger | None,
+    on_line: Callable[[str, str], Any] | None,
+    status: dict[str, Any],
+) -> AsyncIterator[tuple[str, str]]:
+    """Run a command, and get its lines as `(stream, line)` as soon as written.
+
+    The exit code, the duration and whether it timed out are set in `status` at the end.
+    """
+    full_cmd: str = " ".join(cmd)
+    _log_command(full_cmd, logger)
+    async with _async_slot():
+        started: float = perf_counter()
+        options: dict[str, Any] = {
+            "stdout": PIPE,
+            "stderr": PIPE,
+            "env": environ,
+            "cwd": cwd,
+            "limit": LINE_LIMIT,
+            # Its own process group, so a timeout kills the children of the shell too
+            "start_new_session": os_name == "posix",
+        }
+        process: Process = await (
+            create_subprocess_shell(full_cmd, **options)  # nosec
+            if shell
+            else create_subprocess_exec(*cmd, **options)  # nosec
+        )
+        lines: "Queue[tuple[str, str] | None]" = Queue()
+
+        async def _read(name: str, stream: Any) -> None:
+            try:
+                while raw := await stream.readline():
+                    await lines.put((name, raw.decode("utf-8", errors="replace")))
+            finally:
+                await lines.put(None)
+
+        readers = [
+            create_task(_read("stdout", process.stdout)),
+            create_task(_read("stderr", process.stderr)),
+        ]
+        deadline: float | None = None if timeout is None else monotonic() + timeout
+        status["timed_out"] = False
+        exhausted: bool = False
+        try:
+            open_streams: int = len(readers)
+            while open_streams:
+                try:
+                    item = await wait_for(
+                        lines.get(), None if deadline is None else deadline - monotonic()
+                    )
+                except TimeoutError:
+                    status["timed_out"] = True
+                    break
+                if item is None:
+                    open_streams -= 1
+                    continue
+                if logger is not None:
+                    logger.info("%s: %s", item[0], item[1].rstrip("\n"))
+                if on_line is not None:
+                    forwarded = on_line(*item)
+                    if isawaitable(forwarded):
+                        await forwarded
+                yield item
+            exhausted = not status["timed_out"]
+        finally:
+            if exhausted:
+                # Its pipes closed, but it may still be running
+                try:
+                    await wait_for(
+                        process.wait(), None if deadline is None else deadline - monotonic()
+                    )
+                except TimeoutError:
+                    status["timed_out"] = True
+            if not exhausted or status["timed_out"]:
+                # On timeout, or when the consumer stops early, like a client that disconnects
+                _kill(process)
+            for reader in readers:
+                reader.cancel()
+            status["returncode"] = await process.wait()
+            status["duration"] = perf_counter() - started
+
+
+async def run_command_async(  # noqa: PLR0913 # pylint: disable=too-many-arguments
+    *cmd: str,
+    check: bool = False,
+    cwd: str | None | Path = None,
+    logger: Logger | None = None,
+    shell: bool = True,
+    timeout: float | None = None,
+    on_line: Callable[[str, str], Any] | None = None,
+) -> "CommandResult":
+    """Run a command without blocking the event loop.
+
+    At most `COMMAND_ASYNC_LIMIT` commands run at once per event loop, \
+    the others wait for their turn.
+
+    Example:
+    ```python
+    @router.post("/convert")
+    async def convert(user: CognitoUser) -> dict[str, int]:
+        result = await run_command_async("convert", "in.png", "out.jpg", shell=False, timeout=30)
+        return {"code": result["returncode"]}
+    ```
+
+    Args:
+        *cmd (str): The command, joined with spaces when run through the shell, \
+            or the argv list otherwise.
+        check (bool, optional): Raise CalledProcessError on a non zero exit code. \
+            Defaults to False.
+        cwd (str | None | Path, optional): The working directory. Defaults to None.
+        logger (Logger | None, optional): Logger for the command line, \
+            and for every line of output. Defaults to None.
+        shell (bool, optional): Run it through the shell. Defaults to True.
+        timeout (float | None, optional): Seconds before the command is killed. \
+            Defaults to None.
+        on_line (Callable[[str, str], Any] | None, optional): Called, or awaited, \
+            with the stream name, `stdout` or `stderr`, and every line. Defaults to None.
+
+    Returns:
+        CommandResult: The outcome of the command
+    """
+    status: dict[str, Any] = {}
+    output: dict[str, list[str]] = {"stdout": [], "stderr": []}
+    async for name, line in _command_lines(
+        list(cmd), shell, cwd, timeout, logger, on_line, status
+    ):
+        output[name].append(line)
+    args: str | list[str] = " ".join(cmd) if shell else list(cmd)
+    result: "CommandResult" = {
+        "args": args,
+        "returncode": status["returncode"],
+        "stdout": "".join(output["stdout"]),
+        "stderr": "".join(output["stderr"]),
+        "duration": status["duration"],
+        "timed_out": status["timed_out"],
+    }
+    if check and result["returncode"] != 0:
+        raise CalledProcessError(result["returncode"], args, result["stdout"], result["stderr"])
+    return result
+
+
+async def stream_command(  # noqa: PLR0913 # pylint: disable=too-many-arguments
+    *cmd: str,
+    stderr: bool = False,
+    cwd: str | None | Path = None,
+    logger: Logger | None = None,
+    shell: bool = True,
+    timeout: float | None = None,
+) -> AsyncIterator[str]:
+    """Run a command without blocking the event loop, and get its lines \
+    as soon as written, for a `StreamingResponse`.
+
+    The command is killed if the iteration stops early, \
+    like when the client disconnects.
+
+    Example:
+    ```python
+    @router.get("/logs")
+    async def logs(user: CognitoUser) -> StreamingResponse:
+        return StreamingResponse(
+            stream_command("tail", "-n", "100", "app.log", shell=False, timeout=10),
+            media_type="text/plain",
+        )
+    ```
+
+    Args:
+        *cmd (str): The command, joined with spaces when run through the shell, \
+            or the argv list otherwise.
+        stderr (bool, optional): Yield the lines of stderr too. Defaults to False.
+        cwd (str | None | Path, optional): The working directory. Defaults to None.
+        logger (Logger | None, optional): Logger for the command line, \
+            and for every line of output. Defaults to None.
+        shell (bool, optional): Run it through the shell. Defaults to True.
+        timeout (float | None, optional): Seconds before the command is killed. \
+            Defaults to None.
+
+    Yields:
+        str: The lines, with their line ending
+    """
+    status: dict[str, Any] = {}
+    async for name, line in _command_lines(list(cmd), shell, cwd, timeout, logger, None, status):
+        if stderr or name == "stdout":
+            yield line
 
 
-__all__ = ("run_command",)
+__all__ = (
+    "run_command",
+    "run_command_async",
+    "stream_command",
+    "CommandExecutor",
+    "get_executor",
+)